@@ -24,6 +24,114 @@ class Settings:
     WEAVIATE_API_KEY = os.getenv("WEAVIATE_API_KEY")
     SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY")
     
+    CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "400"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "60"))
+    CHUNK_STORE_MMAP_BYTES = int(os.getenv("CHUNK_STORE_MMAP_BYTES", str(256 * 1024 * 1024)))
+    EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "8000"))
+    EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "256"))
+    WEAVIATE_BATCH_SIZE = int(os.getenv("WEAVIATE_BATCH_SIZE", "100"))
+    WEAVIATE_BATCH_CONCURRENCY = int(os.getenv("WEAVIATE_BATCH_CONCURRENCY", "2"))
+    # One Weaviate tenant per user in WEAVIATE_TENANT_COLLECTION instead of
+    # doc_id filters over the shared DocumentChunk collection. Tenants unused
+    # for WEAVIATE_TENANT_IDLE_MINUTES are deactivated (or offloaded). Off by
+    # default: documents already in DocumentChunk are only vector-searched
+    # again once scripts/migrate_weaviate_tenants.py has copied them.
+    WEAVIATE_MULTI_TENANCY = os.getenv("WEAVIATE_MULTI_TENANCY", "false").lower() == "true"
+    WEAVIATE_TENANT_COLLECTION = os.getenv("WEAVIATE_TENANT_COLLECTION", "TenantDocumentChunk")
+    WEAVIATE_TENANT_IDLE_MINUTES = int(os.getenv("WEAVIATE_TENANT_IDLE_MINUTES", "30"))
+    WEAVIATE_TENANT_IDLE_ACTION = os.getenv("WEAVIATE_TENANT_IDLE_ACTION", "deactivate").lower()
+    INDEX_MAX_RETRIES = int(os.getenv("INDEX_MAX_RETRIES", "3"))
+    EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() in ("true", "1", "yes")
+    EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(os.path.dirname(__file__), "..", "embedding_cache.db"))
+    EMBED_CACHE_MEMORY_MB = int(os.getenv("EMBED_CACHE_MEMORY_MB", "64"))
+    EMBED_CACHE_DISK_MB = int(os.getenv("EMBED_CACHE_DISK_MB", "1024"))
+    MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "200"))
+    UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE", str(1024 * 1024)))
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+    HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
+    HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")
+    HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", "3"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    # Diversification: fetch k * MMR_FETCH_MULTIPLIER candidates, drop chunks
+    # with duplicate text and pick k by maximal marginal relevance
+    # (MMR_LAMBDA 1.0 = pure relevance, lower = more variety)
+    RETRIEVAL_DIVERSIFY = os.getenv("RETRIEVAL_DIVERSIFY", "true").lower() in ("true", "1", "yes")
+    MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+    MMR_FETCH_MULTIPLIER = int(os.getenv("MMR_FETCH_MULTIPLIER", "4"))
+    # Async retrieval: the query embedding and the vector query each get their
+    # own timeout, the whole retrieval (fallbacks included) RETRIEVAL_TIMEOUT
+    EMBED_QUERY_TIMEOUT = float(os.getenv("EMBED_QUERY_TIMEOUT", "10"))
+    VECTOR_QUERY_TIMEOUT = float(os.getenv("VECTOR_QUERY_TIMEOUT", "5"))
+    RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "20"))
+    # Start retrieval while the chat route is still being decided in
+    # conversations with documents; cancelled when the route is not RAG
+    SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() in ("true", "1", "yes")
+    # Query routing (app/services/query_router.py): "local" decides document vs
+    # general questions by embedding similarity and asks the LLM only when the
+    # margin is under ROUTER_MARGIN; "llm" always asks. ROUTER_AUDIT_RATE of
+    # local decisions are re-checked by the LLM in the background to measure accuracy.
+    ROUTER_MODE = os.getenv("ROUTER_MODE", "local").lower()
+    ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", "0.05"))
+    ROUTER_AUDIT_RATE = float(os.getenv("ROUTER_AUDIT_RATE", "0.05"))
+    # Routes cached per normalized query and document types; 0 disables
+    ROUTER_CACHE_SIZE = int(os.getenv("ROUTER_CACHE_SIZE", "2048"))
+    ROUTER_CACHE_TTL_SECONDS = float(os.getenv("ROUTER_CACHE_TTL_SECONDS", "3600"))
+    # Routing decisions are kept for ROUTER_LOG_RETENTION_DAYS; /status
+    # reports on the last ROUTER_STATS_WINDOW_HOURS of them
+    ROUTER_LOG_RETENTION_DAYS = float(os.getenv("ROUTER_LOG_RETENTION_DAYS", "30"))
+    ROUTER_STATS_WINDOW_HOURS = float(os.getenv("ROUTER_STATS_WINDOW_HOURS", "24"))
+    # Semantic answer cache (app/services/answer_cache.py): standalone RAG and
+    # LLM answers are reused for queries with cosine similarity of at least
+    # ANSWER_CACHE_THRESHOLD over the same documents
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("true", "1", "yes")
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+    ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+    # Prompt token budget per chat request (app/services/context_budget.py).
+    # Prompts use at most PROMPT_TOKEN_BUDGET tokens and always leave
+    # LLM_RESPONSE_TOKENS of the deployment's LLM_CONTEXT_TOKENS window for the
+    # answer. When there is retrieved context, history gets at most
+    # CONTEXT_HISTORY_TOKENS and each chunk at most CONTEXT_CHUNK_TOKENS.
+    # Tokens are counted with the tiktoken encoding of LLM_TOKENIZER_MODEL.
+    LLM_TOKENIZER_MODEL = os.getenv("LLM_TOKENIZER_MODEL") or AZURE_OPENAI_DEPLOYMENT_NAME
+    LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "128000"))
+    LLM_RESPONSE_TOKENS = int(os.getenv("LLM_RESPONSE_TOKENS", "2048"))
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "12000"))
+    CONTEXT_HISTORY_TOKENS = int(os.getenv("CONTEXT_HISTORY_TOKENS", "2000"))
+    CONTEXT_CHUNK_TOKENS = int(os.getenv("CONTEXT_CHUNK_TOKENS", "1000"))
+    # Conversation memory (app/services/conversation_memory.py): prompts get
+    # a summary of older turns (at most MEMORY_SUMMARY_TOKENS) and the recent
+    # turns (at most MEMORY_WINDOW_TOKENS without retrieved context). The
+    # summary is refreshed in the background once MEMORY_SUMMARY_EVERY_TURNS
+    # turns beyond the newest MEMORY_WINDOW_TURNS are unsummarized.
+    MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "true").lower() in ("true", "1", "yes")
+    MEMORY_WINDOW_TURNS = int(os.getenv("MEMORY_WINDOW_TURNS", "6"))
+    MEMORY_SUMMARY_EVERY_TURNS = int(os.getenv("MEMORY_SUMMARY_EVERY_TURNS", "4"))
+    MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "500"))
+    MEMORY_WINDOW_TOKENS = int(os.getenv("MEMORY_WINDOW_TOKENS", "3000"))
+    # Chat history pages (GET /conversations/{id}, /history with before, after
+    # or limit) hold at most HISTORY_PAGE_MAX_TURNS turns
+    HISTORY_PAGE_MAX_TURNS = int(os.getenv("HISTORY_PAGE_MAX_TURNS", "200"))
+    # Shared httpx clients for the Azure OpenAI models (app/services/clients.py);
+    # HTTP/2 is used when HTTP2_ENABLED and the h2 package is installed
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "120"))
+    HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("true", "1", "yes")
+    # Distinct model configurations kept; the least recently used are dropped
+    CHAT_MODEL_CACHE_SIZE = int(os.getenv("CHAT_MODEL_CACHE_SIZE", "16"))
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+    INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "32"))
+    # Shared pools for blocking work called from async handlers (app/services/executors.py);
+    # CPU_POOL_WORKERS=0 keeps document parsing in threads
+    IO_POOL_WORKERS = int(os.getenv("IO_POOL_WORKERS", "16"))
+    DB_POOL_WORKERS = int(os.getenv("DB_POOL_WORKERS", "8"))
+    CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+    LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+    LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+    
     JWT_SECRET = _get_jwt_secret()
     JWT_ALGO = "HS256"
     SESSION_TTL_HOURS = 24
@@ -33,6 +141,27 @@ class Settings:
     DB_PATH = os.path.join(os.path.dirname(__file__), "..", "app.db")
     DATA_DB_PATH = os.path.join(os.path.dirname(__file__), "..", "data.db")
     DOCUMENTS_DIR = os.path.join(os.path.dirname(__file__), "..", "documents")
+    BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", os.path.join(DOCUMENTS_DIR, "bm25"))
+    BM25_CACHE_SIZE = int(os.getenv("BM25_CACHE_SIZE", "64"))
+    # Vector store backend: "weaviate", "local" (in-process NumPy store) or
+    # "auto" (Weaviate when connected, otherwise local)
+    VECTOR_STORE = os.getenv("VECTOR_STORE", "auto").lower()
+    VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", os.path.join(DOCUMENTS_DIR, "vectors"))
+    # IVF index for the local vector store: built once a collection (or a
+    # filtered query) reaches LOCAL_ANN_MIN_VECTORS; nlist 0 picks 4 * sqrt(n).
+    # Raising nprobe improves recall at the cost of speed.
+    LOCAL_ANN_MIN_VECTORS = int(os.getenv("LOCAL_ANN_MIN_VECTORS", "50000"))
+    LOCAL_ANN_NLIST = int(os.getenv("LOCAL_ANN_NLIST", "0"))
+    LOCAL_ANN_NPROBE = int(os.getenv("LOCAL_ANN_NPROBE", "16"))
+    # Compact codes for the local vector store: "none", "int8" (4x smaller) or
+    # "pq" (product quantization, LOCAL_PQ_SUBVECTORS bytes per vector; 0 picks
+    # dim / 16). Candidates are ranked on the codes and the best
+    # k * LOCAL_RESCORE_FACTOR are rescored exactly from the float vectors
+    # (0 picks 4 for int8 and 16 for the coarser pq codes).
+    LOCAL_VECTOR_QUANTIZATION = os.getenv("LOCAL_VECTOR_QUANTIZATION", "none").lower()
+    LOCAL_PQ_SUBVECTORS = int(os.getenv("LOCAL_PQ_SUBVECTORS", "0"))
+    LOCAL_QUANTIZE_MIN_VECTORS = int(os.getenv("LOCAL_QUANTIZE_MIN_VECTORS", "10000"))
+    LOCAL_RESCORE_FACTOR = int(os.getenv("LOCAL_RESCORE_FACTOR", "0"))
 
 settings = Settings()
 
@@ -44,10 +44,22 @@ def init_db():
             file_type TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             user_id TEXT,
+            status TEXT DEFAULT 'ready',
+            content_hash TEXT,
             FOREIGN KEY(conversation_id) REFERENCES conversations(id)
         );
     """)
     
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS document_blobs (
+            content_hash TEXT PRIMARY KEY,
+            file_type TEXT NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'indexing',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
             id TEXT PRIMARY KEY,
@@ -74,11 +86,105 @@ def init_db():
         );
     """)
     
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks (
+            storage_key TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            page INTEGER,
+            text BLOB NOT NULL,
+            PRIMARY KEY(storage_key, chunk_index)
+        ) WITHOUT ROWID;
+    """)
+    
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id TEXT PRIMARY KEY,
+            doc_id TEXT NOT NULL,
+            conversation_id TEXT,
+            user_id TEXT,
+            content_hash TEXT,
+            file_path TEXT NOT NULL,
+            file_type TEXT NOT NULL,
+            status TEXT NOT NULL CHECK(status IN ('queued','running','completed','failed')),
+            chunks_parsed INTEGER DEFAULT 0,
+            chunks_embedded INTEGER DEFAULT 0,
+            chunks_indexed INTEGER DEFAULT 0,
+            chunks_failed INTEGER DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(doc_id) REFERENCES uploaded_documents(id)
+        );
+    """)
+    
+    # Weaviate tenants holding vectors for a stored document
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS document_blob_tenants (
+            storage_key TEXT NOT NULL,
+            tenant TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY(storage_key, tenant)
+        );
+    """)
+    
+    # Rolling summary of a conversation's older messages, up to summarized_seq
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            conversation_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_seq INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(conversation_id) REFERENCES conversations(id)
+        );
+    """)
+    
+    # Mean chunk embedding of each stored document, used by the query router
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS document_centroids (
+            storage_key TEXT PRIMARY KEY,
+            vector BLOB NOT NULL,
+            chunk_count INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    
+    # One row per routed chat message. llm_route is the LLM classifier's
+    # answer, when it was asked (escalation or audit of a local decision)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS routing_decisions (
+            id TEXT PRIMARY KEY,
+            conversation_id TEXT,
+            query TEXT NOT NULL,
+            route TEXT NOT NULL,
+            method TEXT NOT NULL CHECK(method IN ('rule','embedding','llm')),
+            document_score REAL,
+            general_score REAL,
+            llm_route TEXT,
+            latency_ms INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    
     try:
         cur.execute("SELECT user_id FROM uploaded_documents LIMIT 1")
     except Exception:
         cur.execute("ALTER TABLE uploaded_documents ADD COLUMN user_id TEXT")
     
+    try:
+        cur.execute("SELECT status FROM uploaded_documents LIMIT 1")
+    except Exception:
+        cur.execute("ALTER TABLE uploaded_documents ADD COLUMN status TEXT DEFAULT 'ready'")
+    
+    try:
+        cur.execute("SELECT content_hash FROM uploaded_documents LIMIT 1")
+    except Exception:
+        cur.execute("ALTER TABLE uploaded_documents ADD COLUMN content_hash TEXT")
+    
+    try:
+        cur.execute("SELECT content_hash FROM ingestion_jobs LIMIT 1")
+    except Exception:
+        cur.execute("ALTER TABLE ingestion_jobs ADD COLUMN content_hash TEXT")
+    
     try:
         cur.execute("SELECT user_id FROM conversations LIMIT 1")
     except Exception:
@@ -96,9 +202,45 @@ def init_db():
     except Exception:
         cur.execute("ALTER TABLE messages ADD COLUMN rag_references TEXT")
     
+    # Position of a message in its conversation; created_at only has
+    # second resolution, so messages of one exchange could tie
+    try:
+        cur.execute("SELECT seq FROM messages LIMIT 1")
+    except Exception:
+        cur.execute("ALTER TABLE messages ADD COLUMN seq INTEGER")
+        cur.execute("""
+            UPDATE messages SET seq = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.conversation_id = messages.conversation_id
+                AND (m.created_at < messages.created_at OR (m.created_at = messages.created_at AND m.rowid <= messages.rowid))
+            )
+        """)
+    
+    # Next seq of a conversation's messages; kept here rather than derived
+    # from MAX(seq) so numbering does not restart after the history is cleared
+    try:
+        cur.execute("SELECT next_seq FROM conversations LIMIT 1")
+    except Exception:
+        cur.execute("ALTER TABLE conversations ADD COLUMN next_seq INTEGER DEFAULT 1")
+        cur.execute("""
+            UPDATE conversations SET next_seq = COALESCE(
+                (SELECT MAX(seq) FROM messages WHERE messages.conversation_id = conversations.id), 0
+            ) + 1
+        """)
+    
+    try:
+        cur.execute("SELECT cached FROM routing_decisions LIMIT 1")
+    except Exception:
+        cur.execute("ALTER TABLE routing_decisions ADD COLUMN cached INTEGER DEFAULT 0")
+    
     try:
         cur.execute("CREATE INDEX IF NOT EXISTS idx_feedback_message_id ON feedback(message_id)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_feedback_user_id ON feedback(user_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs(status)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_documents_content_hash ON uploaded_documents(content_hash)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_document_blob_tenants_tenant ON document_blob_tenants(tenant)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_routing_decisions_created_at ON routing_decisions(created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_seq ON messages(conversation_id, seq)")
     except Exception:
         pass
     
@@ -130,29 +272,23 @@ def add_message(
     if references:
         references_json = json.dumps(references)
     cur.execute(
-        "INSERT INTO messages(id, conversation_id, role, content, response_time_ms, token_count, model_version, rag_references) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        (message_id, conversation_id, role, content, response_time_ms, token_count, model_version, references_json),
+        "UPDATE conversations SET next_seq = next_seq + 1 WHERE id = ? RETURNING next_seq - 1 AS seq",
+        (conversation_id,),
+    )
+    row = cur.fetchone()
+    cur.execute(
+        """
+        INSERT INTO messages(id, conversation_id, role, content, response_time_ms, token_count, model_version, rag_references, seq)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM messages WHERE conversation_id = ?)))
+        """,
+        (message_id, conversation_id, role, content, response_time_ms, token_count, model_version, references_json,
+         row["seq"] if row else None, conversation_id),
     )
     conn.commit()
     conn.close()
     return message_id
 
-def get_chat_history(conversation_id: str, include_ids: bool = False) -> List[Dict[str, Any]]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    if include_ids:
-        cur.execute(
-            "SELECT id, role, content, rag_references FROM messages WHERE conversation_id = ? ORDER BY created_at ASC",
-            (conversation_id,),
-        )
-    else:
-        cur.execute(
-            "SELECT role, content, rag_references FROM messages WHERE conversation_id = ? ORDER BY created_at ASC",
-            (conversation_id,),
-        )
-    rows = cur.fetchall()
-    conn.close()
-    
+def _pair_messages(rows, include_ids: bool) -> List[Dict[str, Any]]:
     paired = []
     current = {}
     for row in rows:
@@ -200,6 +336,166 @@ def get_chat_history(conversation_id: str, include_ids: bool = False) -> List[Di
         paired.append(current)
     return paired
 
+def get_chat_history(conversation_id: str, include_ids: bool = False) -> List[Dict[str, Any]]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    if include_ids:
+        cur.execute(
+            "SELECT id, role, content, rag_references FROM messages WHERE conversation_id = ? ORDER BY seq ASC",
+            (conversation_id,),
+        )
+    else:
+        cur.execute(
+            "SELECT role, content, rag_references FROM messages WHERE conversation_id = ? ORDER BY seq ASC",
+            (conversation_id,),
+        )
+    rows = cur.fetchall()
+    conn.close()
+    return _pair_messages(rows, include_ids)
+
+def get_chat_history_page(
+    conversation_id: str,
+    before_seq: Optional[int] = None,
+    after_seq: Optional[int] = None,
+    limit: Optional[int] = None
+) -> Dict[str, Any]:
+    """One page of paired turns (with message ids), keyed on messages.seq.
+
+    With after_seq, the turns after it, oldest first: the next page forward,
+    or everything a client holding after_seq is missing. Otherwise the
+    newest limit turns before before_seq (or the end), for scrolling back.
+    A page never splits a question from its answer; a leading answer whose
+    question is at or before after_seq comes back with an empty "user".
+    Returns {"chat_history", "first_seq", "last_seq", "has_more"}, where
+    first_seq and last_seq bound the page (None when it is empty) and are
+    the before_seq and after_seq of the neighbouring pages.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    # Turns start at user messages; a page covers limit of them
+    lower, upper, has_more = 0, None, False
+    if after_seq is not None:
+        lower = after_seq
+        if limit is not None:
+            cur.execute(
+                "SELECT seq FROM messages WHERE conversation_id = ? AND role = 'user' AND seq > ? ORDER BY seq ASC LIMIT ?",
+                (conversation_id, after_seq, limit + 1),
+            )
+            starts = [r["seq"] for r in cur.fetchall()]
+            if len(starts) > limit:
+                upper, has_more = starts[limit], True
+    else:
+        upper = before_seq
+        if limit is not None:
+            cur.execute(
+                "SELECT seq FROM messages WHERE conversation_id = ? AND role = 'user' AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (conversation_id, before_seq if before_seq is not None else 2 ** 62, limit + 1),
+            )
+            starts = [r["seq"] for r in cur.fetchall()]
+            if len(starts) > limit:
+                lower, has_more = starts[limit - 1] - 1, True
+    cur.execute(
+        """
+        SELECT id, seq, role, content, rag_references FROM messages
+        WHERE conversation_id = ? AND seq > ? AND seq < ?
+        ORDER BY seq ASC
+        """,
+        (conversation_id, lower, upper if upper is not None else 2 ** 62),
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return {
+        "chat_history": _pair_messages(rows, True),
+        "first_seq": rows[0]["seq"] if rows else None,
+        "last_seq": rows[-1]["seq"] if rows else None,
+        "has_more": has_more
+    }
+
+def get_message_seq(message_id: str) -> Optional[int]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT seq FROM messages WHERE id = ?", (message_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row["seq"] if row else None
+
+def get_conversation_version(conversation_id: str) -> Dict[str, Any]:
+    """Message count, newest seq and newest message id of a conversation; changes whenever its history does."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT COUNT(*) AS messages, MAX(seq) AS last_seq,
+               (SELECT id FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT 1) AS last_message_id
+        FROM messages WHERE conversation_id = ?
+        """,
+        (conversation_id, conversation_id),
+    )
+    row = cur.fetchone()
+    conn.close()
+    return {"messages": row["messages"], "last_seq": row["last_seq"] or 0, "last_message_id": row["last_message_id"]}
+
+def get_messages_after(conversation_id: str, after_seq: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Messages with seq above after_seq, oldest first; only the newest limit of them when limit is given."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    if limit is None:
+        cur.execute(
+            "SELECT seq, role, content FROM messages WHERE conversation_id = ? AND seq > ? ORDER BY seq ASC",
+            (conversation_id, after_seq),
+        )
+        rows = cur.fetchall()
+    else:
+        cur.execute(
+            "SELECT seq, role, content FROM messages WHERE conversation_id = ? AND seq > ? ORDER BY seq DESC LIMIT ?",
+            (conversation_id, after_seq, limit),
+        )
+        rows = cur.fetchall()[::-1]
+    conn.close()
+    return [{"seq": r["seq"], "role": r["role"], "content": r["content"]} for r in rows]
+
+def get_conversation_summary(conversation_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT summary, summarized_seq, updated_at FROM conversation_summaries WHERE conversation_id = ?",
+        (conversation_id,),
+    )
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def set_conversation_summary(conversation_id: str, summary: str, summarized_seq: int, previous_seq: int = 0) -> bool:
+    """Store a summary of the messages up to summarized_seq, if the stored one
+    still ends at previous_seq (0 for none) and the message at summarized_seq
+    still exists. Returns False when the conversation was cleared or another
+    refresh got there first, in which case nothing is written."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    if previous_seq:
+        cur.execute(
+            """
+            UPDATE conversation_summaries SET summary = ?, summarized_seq = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE conversation_id = ? AND summarized_seq = ?
+            AND EXISTS (SELECT 1 FROM messages WHERE conversation_id = ? AND seq = ?)
+            """,
+            (summary, summarized_seq, conversation_id, previous_seq, conversation_id, summarized_seq),
+        )
+    else:
+        cur.execute(
+            """
+            INSERT INTO conversation_summaries(conversation_id, summary, summarized_seq)
+            SELECT ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM conversation_summaries WHERE conversation_id = ?)
+            AND EXISTS (SELECT 1 FROM messages WHERE conversation_id = ? AND seq = ?)
+            """,
+            (conversation_id, summary, summarized_seq, conversation_id, conversation_id, summarized_seq),
+        )
+    written = cur.rowcount == 1
+    conn.commit()
+    conn.close()
+    return written
+
 def get_user_conversations(user_id: str) -> List[Dict[str, Any]]:
     conn = get_db_connection()
     cur = conn.cursor()
@@ -233,22 +529,37 @@ def add_uploaded_document_record(
     doc_id: str,
     name: str,
     file_type: str,
-    user_id: Optional[str] = None
+    user_id: Optional[str] = None,
+    status: str = "ready",
+    content_hash: Optional[str] = None
 ):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute(
-        "INSERT OR REPLACE INTO uploaded_documents(id, conversation_id, name, file_type, user_id) VALUES (?, ?, ?, ?, ?)",
-        (doc_id, conversation_id, name, file_type, user_id),
+        "INSERT OR REPLACE INTO uploaded_documents(id, conversation_id, name, file_type, user_id, status, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (doc_id, conversation_id, name, file_type, user_id, status, content_hash),
     )
     conn.commit()
     conn.close()
 
+# Documents uploaded before content addressing have no content_hash; their
+# file and vectors are stored under the document id instead.
+UPLOADED_DOCUMENT_COLUMNS = """
+    d.id, d.conversation_id, d.name, d.file_type, d.user_id, d.content_hash,
+    COALESCE(d.content_hash, d.id) AS storage_key,
+    COALESCE(b.file_type, d.file_type) AS storage_file_type,
+    COALESCE(b.status, d.status, 'ready') AS status
+"""
+
 def get_uploaded_documents(conversation_id: str) -> List[Dict[str, str]]:
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, name, file_type FROM uploaded_documents WHERE conversation_id = ? ORDER BY created_at ASC",
+        f"""
+        SELECT {UPLOADED_DOCUMENT_COLUMNS}
+        FROM uploaded_documents d LEFT JOIN document_blobs b ON b.content_hash = d.content_hash
+        WHERE d.conversation_id = ? ORDER BY d.created_at ASC
+        """,
         (conversation_id,),
     )
     rows = cur.fetchall()
@@ -257,11 +568,36 @@ def get_uploaded_documents(conversation_id: str) -> List[Dict[str, str]]:
         {
             "id": r["id"],
             "name": r["name"],
-            "file_type": r["file_type"] if "file_type" in r.keys() else ""
+            "file_type": r["file_type"] or "",
+            "status": r["status"],
+            "storage_key": r["storage_key"],
+            "storage_file_type": r["storage_file_type"] or ""
         }
         for r in rows
     ]
 
+def get_uploaded_document(doc_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT {UPLOADED_DOCUMENT_COLUMNS}
+        FROM uploaded_documents d LEFT JOIN document_blobs b ON b.content_hash = d.content_hash
+        WHERE d.id = ?
+        """,
+        (doc_id,),
+    )
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def set_uploaded_document_status(doc_id: str, status: str):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE uploaded_documents SET status = ? WHERE id = ?", (status, doc_id))
+    conn.commit()
+    conn.close()
+
 def delete_uploaded_document_record(doc_id: str):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -273,10 +609,17 @@ def clear_messages(conversation_id: str):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+    cur.execute("DELETE FROM conversation_summaries WHERE conversation_id = ?", (conversation_id,))
     conn.commit()
     conn.close()
 
-def delete_conversation(conversation_id: str, user_id: str) -> bool:
+def delete_conversation(conversation_id: str, user_id: str) -> Optional[List[Dict[str, str]]]:
+    """Delete a conversation and release its documents.
+    
+    Returns None if the conversation does not belong to the user, otherwise the
+    documents whose last reference was removed and whose stored file and
+    vectors should now be purged.
+    """
     conn = get_db_connection()
     cur = conn.cursor()
     
@@ -284,15 +627,31 @@ def delete_conversation(conversation_id: str, user_id: str) -> bool:
     row = cur.fetchone()
     if not row or row[0] != user_id:
         conn.close()
-        return False
+        return None
+    
+    cur.execute(
+        "SELECT id, file_type, content_hash FROM uploaded_documents WHERE conversation_id = ?",
+        (conversation_id,),
+    )
+    doc_rows = cur.fetchall()
     
     cur.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+    cur.execute("DELETE FROM conversation_summaries WHERE conversation_id = ?", (conversation_id,))
     cur.execute("DELETE FROM uploaded_documents WHERE conversation_id = ?", (conversation_id,))
     cur.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
     
+    orphaned = []
+    for doc in doc_rows:
+        if doc["content_hash"]:
+            blob = _release_document_blob(cur, doc["content_hash"])
+            if blob:
+                orphaned.append(blob)
+        else:
+            orphaned.append({"storage_key": doc["id"], "file_type": doc["file_type"] or ""})
+    
     conn.commit()
     conn.close()
-    return True
+    return orphaned
 
 def has_uploaded_document_named(name: str) -> bool:
     conn = get_db_connection()
@@ -302,3 +661,341 @@ def has_uploaded_document_named(name: str) -> bool:
     conn.close()
     return exists
 
+
+def create_ingestion_job(
+    doc_id: str,
+    conversation_id: Optional[str],
+    user_id: Optional[str],
+    file_path: str,
+    file_type: str,
+    content_hash: Optional[str] = None
+) -> str:
+    job_id = str(uuid.uuid4())
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO ingestion_jobs(id, doc_id, conversation_id, user_id, content_hash, file_path, file_type, status) VALUES (?, ?, ?, ?, ?, ?, ?, 'queued')",
+        (job_id, doc_id, conversation_id, user_id, content_hash, file_path, file_type),
+    )
+    conn.commit()
+    conn.close()
+    return job_id
+
+INGESTION_JOB_FIELDS = {
+    "status", "chunks_parsed", "chunks_embedded", "chunks_indexed", "chunks_failed", "error"
+}
+
+def update_ingestion_job(job_id: str, **fields):
+    unknown = set(fields) - INGESTION_JOB_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown ingestion job fields: {', '.join(sorted(unknown))}")
+    if not fields:
+        return
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"UPDATE ingestion_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (*fields.values(), job_id),
+    )
+    conn.commit()
+    conn.close()
+
+def get_ingestion_job(job_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,))
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def get_unfinished_ingestion_jobs() -> List[Dict[str, Any]]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT * FROM ingestion_jobs WHERE status IN ('queued', 'running') ORDER BY created_at ASC"
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def get_active_ingestion_job_for_blob(content_hash: str) -> Optional[str]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id FROM ingestion_jobs WHERE content_hash = ? AND status IN ('queued', 'running') ORDER BY created_at DESC LIMIT 1",
+        (content_hash,),
+    )
+    row = cur.fetchone()
+    conn.close()
+    return row["id"] if row else None
+
+def acquire_document_blob(content_hash: str, file_type: str) -> Dict[str, Any]:
+    """Add a reference to the stored copy of a document, creating it if needed.
+    
+    Returns the blob's file_type and status, and whether this call created it.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT OR IGNORE INTO document_blobs(content_hash, file_type, ref_count, status) VALUES (?, ?, 0, 'indexing')",
+        (content_hash, file_type),
+    )
+    created = cur.rowcount == 1
+    cur.execute(
+        "UPDATE document_blobs SET ref_count = ref_count + 1 WHERE content_hash = ?",
+        (content_hash,),
+    )
+    cur.execute("SELECT file_type, status FROM document_blobs WHERE content_hash = ?", (content_hash,))
+    row = cur.fetchone()
+    conn.commit()
+    conn.close()
+    return {"created": created, "file_type": row["file_type"], "status": row["status"]}
+
+def _release_document_blob(cur, content_hash: str) -> Optional[Dict[str, str]]:
+    cur.execute(
+        "UPDATE document_blobs SET ref_count = ref_count - 1 WHERE content_hash = ?",
+        (content_hash,),
+    )
+    cur.execute("SELECT file_type, ref_count FROM document_blobs WHERE content_hash = ?", (content_hash,))
+    row = cur.fetchone()
+    if not row or row["ref_count"] > 0:
+        return None
+    cur.execute("DELETE FROM document_blobs WHERE content_hash = ?", (content_hash,))
+    return {"storage_key": content_hash, "file_type": row["file_type"]}
+
+def release_document_blob(content_hash: str) -> Optional[Dict[str, str]]:
+    """Drop a reference to a stored document. Returns the blob if this was the last reference."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    orphaned = _release_document_blob(cur, content_hash)
+    conn.commit()
+    conn.close()
+    return orphaned
+
+def user_has_document_blob(user_id: str, content_hash: Optional[str]) -> bool:
+    if not content_hash:
+        return False
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT 1 FROM uploaded_documents WHERE user_id = ? AND content_hash = ? LIMIT 1",
+        (user_id, content_hash),
+    )
+    exists = cur.fetchone() is not None
+    conn.close()
+    return exists
+
+def get_document_blob(content_hash: str) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM document_blobs WHERE content_hash = ?", (content_hash,))
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def set_document_blob_status(content_hash: str, status: str):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE document_blobs SET status = ? WHERE content_hash = ?", (status, content_hash))
+    conn.commit()
+    conn.close()
+
+def get_conversation_user(conversation_id: str) -> Optional[str]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT user_id FROM conversations WHERE id = ?", (conversation_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row["user_id"] if row else None
+
+def get_document_blob_users(storage_key: str) -> List[Optional[str]]:
+    """Users holding at least one upload stored under storage_key."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT DISTINCT user_id FROM uploaded_documents WHERE COALESCE(content_hash, id) = ?",
+        (storage_key,),
+    )
+    users = [r["user_id"] for r in cur.fetchall()]
+    conn.close()
+    return users
+
+def add_document_blob_tenant(storage_key: str, tenant: str):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT OR IGNORE INTO document_blob_tenants(storage_key, tenant) VALUES (?, ?)",
+        (storage_key, tenant),
+    )
+    conn.commit()
+    conn.close()
+
+def remove_document_blob_tenant(storage_key: str, tenant: Optional[str] = None):
+    """Forget one tenant's copy of a document's vectors, or every copy if tenant is None."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    if tenant is None:
+        cur.execute("DELETE FROM document_blob_tenants WHERE storage_key = ?", (storage_key,))
+    else:
+        cur.execute(
+            "DELETE FROM document_blob_tenants WHERE storage_key = ? AND tenant = ?",
+            (storage_key, tenant),
+        )
+    conn.commit()
+    conn.close()
+
+def get_document_blob_tenants(storage_key: str) -> List[str]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT tenant FROM document_blob_tenants WHERE storage_key = ?", (storage_key,))
+    tenants = [r["tenant"] for r in cur.fetchall()]
+    conn.close()
+    return tenants
+
+def get_tenant_storage_keys(tenant: str) -> List[str]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT storage_key FROM document_blob_tenants WHERE tenant = ?", (tenant,))
+    keys = [r["storage_key"] for r in cur.fetchall()]
+    conn.close()
+    return keys
+
+def set_document_centroid(storage_key: str, vector: bytes, chunk_count: int):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT OR REPLACE INTO document_centroids(storage_key, vector, chunk_count) VALUES (?, ?, ?)",
+        (storage_key, vector, chunk_count),
+    )
+    conn.commit()
+    conn.close()
+
+def get_document_centroids(storage_keys: List[str]) -> Dict[str, bytes]:
+    if not storage_keys:
+        return {}
+    conn = get_db_connection()
+    cur = conn.cursor()
+    placeholders = ",".join("?" for _ in storage_keys)
+    cur.execute(
+        f"SELECT storage_key, vector FROM document_centroids WHERE storage_key IN ({placeholders})",
+        list(storage_keys),
+    )
+    centroids = {r["storage_key"]: r["vector"] for r in cur.fetchall()}
+    conn.close()
+    return centroids
+
+def delete_document_centroid(storage_key: str):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM document_centroids WHERE storage_key = ?", (storage_key,))
+    conn.commit()
+    conn.close()
+
+def add_routing_decision(
+    conversation_id: Optional[str],
+    query: str,
+    route: str,
+    method: str,
+    document_score: Optional[float] = None,
+    general_score: Optional[float] = None,
+    llm_route: Optional[str] = None,
+    latency_ms: Optional[int] = None,
+    cached: bool = False,
+) -> str:
+    decision_id = str(uuid.uuid4())
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO routing_decisions(
+            id, conversation_id, query, route, method, document_score, general_score, llm_route, latency_ms, cached
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (decision_id, conversation_id, query, route, method, document_score, general_score, llm_route, latency_ms, int(cached)),
+    )
+    conn.commit()
+    conn.close()
+    return decision_id
+
+def set_routing_decision_llm_route(decision_id: str, llm_route: str):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE routing_decisions SET llm_route = ? WHERE id = ?", (llm_route, decision_id))
+    conn.commit()
+    conn.close()
+
+def delete_routing_decisions_before(days: float) -> int:
+    """Delete routing decisions older than days. Returns how many were deleted."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM routing_decisions WHERE created_at < datetime('now', ?)", (f"-{days} days",))
+    deleted = cur.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
+
+def get_routing_stats(window_hours: float = 24) -> Dict[str, Any]:
+    """Decision counts and latency per method and per route, cache hits, and how often
+    audited local decisions matched the LLM, over the last window_hours. Cache hits
+    count under the route and the cache, not under the method that originally decided."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    # Every query is a range scan on the created_at index
+    since = (f"-{window_hours} hours",)
+    cur.execute(
+        """
+        SELECT method, COUNT(*) AS decisions, AVG(latency_ms) AS avg_latency_ms
+        FROM routing_decisions WHERE created_at >= datetime('now', ?) AND NOT cached GROUP BY method
+        """,
+        since,
+    )
+    methods = {
+        r["method"]: {"decisions": r["decisions"], "avg_latency_ms": round(r["avg_latency_ms"] or 0, 1)}
+        for r in cur.fetchall()
+    }
+    cur.execute(
+        """
+        SELECT route, COUNT(*) AS decisions, AVG(latency_ms) AS avg_latency_ms, MAX(latency_ms) AS max_latency_ms
+        FROM routing_decisions WHERE created_at >= datetime('now', ?) GROUP BY route
+        """,
+        since,
+    )
+    routes = {
+        r["route"]: {
+            "decisions": r["decisions"],
+            "avg_latency_ms": round(r["avg_latency_ms"] or 0, 1),
+            "max_latency_ms": r["max_latency_ms"]
+        }
+        for r in cur.fetchall()
+    }
+    cur.execute(
+        "SELECT COUNT(*) AS hits, AVG(latency_ms) AS avg_latency_ms FROM routing_decisions WHERE created_at >= datetime('now', ?) AND cached",
+        since,
+    )
+    cache = cur.fetchone()
+    cur.execute(
+        """
+        SELECT COUNT(*) AS audited, SUM(route = llm_route) AS agreed
+        FROM routing_decisions
+        WHERE created_at >= datetime('now', ?) AND method = 'embedding' AND llm_route IS NOT NULL
+        """,
+        since,
+    )
+    audit = cur.fetchone()
+    conn.close()
+    hits = cache["hits"] or 0
+    total = sum(m["decisions"] for m in methods.values()) + hits
+    audited = audit["audited"] or 0
+    return {
+        "window_hours": window_hours,
+        "decisions": total,
+        "methods": methods,
+        "routes": routes,
+        "cache_hits": hits,
+        "cache_hit_rate": round(hits / total, 3) if total else None,
+        "cache_avg_latency_ms": round(cache["avg_latency_ms"] or 0, 1),
+        "llm_fallback_rate": round(methods.get("llm", {}).get("decisions", 0) / total, 3) if total else None,
+        "audited": audited,
+        "audit_agreement": round((audit["agreed"] or 0) / audited, 3) if audited else None,
+    }
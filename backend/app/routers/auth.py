@@ -4,13 +4,11 @@ import uuid
 import sqlite3
 from app.utils.auth import hash_password, verify_password, create_jwt, get_user_from_jwt
 from app.database import get_db_connection
+from app.services.executors import run_db, run_io
 
 router = APIRouter()
 
-@router.post("/register")
-async def register_user(username: str = Form(...), password: str = Form(...)):
-    pw_hash, salt = hash_password(password)
-    user_id = str(uuid.uuid4())
+def _insert_user(user_id: str, username: str, pw_hash: str, salt: bytes) -> bool:
     conn = get_db_connection()
     cur = conn.cursor()
     try:
@@ -20,29 +18,37 @@ async def register_user(username: str = Form(...), password: str = Form(...)):
         )
         conn.commit()
     except sqlite3.IntegrityError:
+        return False
+    finally:
         conn.close()
-        raise HTTPException(status_code=400, detail="Username already exists")
-    conn.close()
-    return {"message": "User registered", "user_id": user_id}
+    return True
 
-@router.post("/login")
-async def login(username: str = Form(...), password: str = Form(...)):
+def _get_credentials(username: str):
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT id, password_hash, salt FROM users WHERE username = ?", (username,))
+    cur.execute("SELECT id, password_hash, salt, username, role FROM users WHERE username = ?", (username,))
     row = cur.fetchone()
     conn.close()
+    return row
+
+@router.post("/register")
+async def register_user(username: str = Form(...), password: str = Form(...)):
+    # PBKDF2 takes tens of milliseconds; hashlib releases the GIL while it runs
+    pw_hash, salt = await run_io(hash_password, password)
+    user_id = str(uuid.uuid4())
+    if not await run_db(_insert_user, user_id, username, pw_hash, salt):
+        raise HTTPException(status_code=400, detail="Username already exists")
+    return {"message": "User registered", "user_id": user_id}
+
+@router.post("/login")
+async def login(username: str = Form(...), password: str = Form(...)):
+    row = await run_db(_get_credentials, username)
     if not row:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    user_id, password_hash_hex, salt = row
-    if not verify_password(password, password_hash_hex, salt):
+    user_id, password_hash_hex, salt, username, role = row
+    if not await run_io(verify_password, password, password_hash_hex, salt):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT username, role FROM users WHERE id = ?", (user_id,))
-    urow = cur.fetchone()
-    conn.close()
-    token = create_jwt(user_id, urow[0], urow[1])
+    token = create_jwt(user_id, username, role)
     return {"message": "Logged in", "token": token}
 
 @router.post("/logout")
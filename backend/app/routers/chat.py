@@ -1,18 +1,34 @@
 from fastapi import APIRouter, Form, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from app.utils.auth import require_user
 from app.database import (
     ensure_conversation,
     add_message,
     get_chat_history,
+    get_chat_history_page,
+    get_message_seq,
     get_uploaded_documents
 )
-from app.services.weaviate_service import retrieve_docs
+from app.services.conversation_memory import load_chat_memory, schedule_summary_refresh
+from app.services.weaviate_service import aretrieve_docs
 from app.services.sql_agent_service import get_sql_agent, is_sql_query
+from app.services.executors import run_db, run_io
+from app.services.context_budget import build_prompt_context, describe_usage
+from app.services.clients import get_chat_model
+from app.services.query_router import (
+    is_greeting,
+    classify_document_query,
+    record_decision,
+    get_cached_route,
+    cache_route
+)
+from app.services.answer_cache import find_cached_answer, cached_references, remember_answer
 from app.config import settings
-from langchain_openai import AzureChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables import RunnableLambda
+import anyio
+import asyncio
 import json
 import time
 import mlflow
@@ -22,11 +38,10 @@ router = APIRouter()
 
 SQL_FILE_TYPES = {".csv", ".xls", ".xlsx", ".tsv"}
 DOCUMENT_FILE_TYPES = {".pdf", ".docx", ".doc", ".txt", ".pptx", ".ppt"}
+RETRIEVAL_MODES = {"vector", "hybrid"}
 
-def clean_markdown(text: str) -> str:
-    if not text:
-        return text
-    
+def _strip_markdown(text: str) -> str:
+    """The line-level rules of clean_markdown, without collapsing blank lines or stripping."""
     text = re.sub(r'\*\*\*(.*?)\*\*\*', r'\1', text)
     text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
     text = re.sub(r'\*(.*?)\*', r'\1', text)
@@ -39,11 +54,107 @@ def clean_markdown(text: str) -> str:
     text = re.sub(r'!\[([^\]]*)\]\([^\)]+\)', r'\1', text)
     text = re.sub(r'^\s*[-*+]\s+', '', text, flags=re.MULTILINE)
     text = re.sub(r'^\s*\d+\.\s+', '', text, flags=re.MULTILINE)
+    return text
+
+def clean_markdown(text: str) -> str:
+    if not text:
+        return text
+    
+    text = _strip_markdown(text)
     text = re.sub(r'\n{3,}', '\n\n', text)
     text = text.strip()
     
     return text
 
+# Characters that start inline markup; the part of a line from the first one
+# on is held back until the line is complete. A trailing "!" may start an image.
+_INLINE_MARKUP = re.compile(r"[*_`~\[]|!(?=\[|$)")
+# Heading, "-"/"+" list or numbered list marker at the start of a line
+_LINE_MARKER = re.compile(r"^\s*(?:#{1,6}\s+|[-+]\s+|\d+\.\s+)")
+# A line holding only these characters may still turn into a marker
+_MARKER_CHARS = set("#-+.0123456789 \t")
+# clean_markdown's list rules start with \s*, which also removes blank lines before a list item
+_LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+\.)\s+")
+
+class MarkdownStreamCleaner:
+    """clean_markdown for an answer that arrives in pieces.
+    
+    feed() takes the next piece and returns the cleaned text that can no
+    longer change; flush() returns the rest once the answer is complete.
+    clean_markdown's rules work within a line, so complete lines are cleaned
+    whole. Of the line still arriving, only the text before any inline markup
+    is released, and whitespace at its end waits for the next word. The
+    result matches clean_markdown except where markup runs across lines.
+    """
+    
+    def __init__(self):
+        self._line = ""
+        self._released = 0
+        self._pending = ""
+        self._started = False
+        self._lstrip = True
+    
+    def _clean(self, line):
+        cleaned = _strip_markdown(line)
+        return cleaned.lstrip() if self._lstrip else cleaned
+    
+    def _stable(self, line):
+        marker = _LINE_MARKER.match(line)
+        inline = _INLINE_MARKUP.search(line, marker.end() if marker else 0)
+        stable = line[:inline.start()] if inline else line
+        if set(stable) <= _MARKER_CHARS:
+            return ""
+        return self._clean(stable)
+    
+    def _release(self, cleaned, line):
+        # Whitespace at the end is kept back until something follows it
+        new = cleaned[self._released:len(cleaned.rstrip())]
+        if not new:
+            return ""
+        out = ""
+        if self._started:
+            out = self._pending
+            if _LIST_ITEM.match(line):
+                out = out[:out.find("\n") + 1]
+            out = re.sub(r'\n{3,}', '\n\n', out)
+        self._pending = ""
+        self._started = True
+        self._released += len(new)
+        return out + new
+    
+    def _end_line(self, cleaned):
+        if self._started:
+            self._pending += cleaned[self._released:] + "\n"
+        self._released = 0
+        self._lstrip = not self._started
+    
+    def feed(self, text: str) -> str:
+        if not text:
+            return ""
+        lines = (self._line + text).split("\n")
+        self._line = lines.pop()
+        out = []
+        for line in lines:
+            cleaned = self._clean(line)
+            out.append(self._release(cleaned, line))
+            self._end_line(cleaned)
+        out.append(self._release(self._stable(self._line), self._line))
+        return "".join(out)
+    
+    def flush(self) -> str:
+        out = self._release(self._clean(self._line), self._line)
+        self._line = ""
+        self._pending = ""
+        return out
+
+def answer_chain(prompt_template, llm):
+    """Runnable chain: prompt | llm | extract content | clean markdown."""
+    extract_content = RunnableLambda(
+        lambda x: x.content if hasattr(x, "content") else str(x)
+    )
+    clean_content = RunnableLambda(lambda x: clean_markdown(x) if x else None)
+    return prompt_template | llm | extract_content | clean_content
+
 async def needs_web_search(query: str, llm, has_documents: bool = False) -> bool:
     """Use Runnable pattern to determine if web search is needed."""
     if has_documents:
@@ -126,10 +237,7 @@ async def is_document_query(query: str, llm, uploaded_docs: list) -> bool:
         return False
     
     # Simple greetings and general conversation should not use RAG
-    query_lower = query.lower().strip()
-    general_greetings = ["hi", "hello", "hey", "good morning", "good afternoon", "good evening", "how are you", "what's up", "thanks", "thank you", "bye", "goodbye"]
-    
-    if query_lower in general_greetings or any(query_lower.startswith(greeting) for greeting in general_greetings):
+    if is_greeting(query):
         return False
     
     # Use LLM to determine if query is about documents
@@ -184,13 +292,28 @@ Answer (YES or NO):"""
         return False
 
 async def detect_route(query: str, conversation_id: str | None, llm) -> str:
+    started = time.time()
     uploaded_docs = []
     if conversation_id:
-        uploaded_docs = get_uploaded_documents(conversation_id)
+        uploaded_docs = await run_db(get_uploaded_documents, conversation_id)
+    
+    async def llm_classify(q):
+        return await is_document_query(q, llm, uploaded_docs)
     
+    cached = get_cached_route(query, uploaded_docs, conversation_id)
+    if cached:
+        route, method, scores = cached
+    else:
+        route, method, scores = await _choose_route(query, uploaded_docs, llm_classify)
+        cache_route(query, uploaded_docs, conversation_id, (route, method, scores))
+    await record_decision(conversation_id, query, route, method, started, scores, llm_classify, cached=cached is not None)
+    return route
+
+async def _choose_route(query: str, uploaded_docs: list, llm_classify):
+    """Pick the route; returns (route, method, scores) where method is "rule", "embedding" or "llm"."""
     # Check for document metadata queries first
     if uploaded_docs and is_document_meta_query(query):
-        return "doc_meta"
+        return "doc_meta", "rule", None
     
     has_sql_files = any(
         doc["file_type"].lower() in SQL_FILE_TYPES 
@@ -203,86 +326,75 @@ async def detect_route(query: str, conversation_id: str | None, llm) -> str:
     
     # If no documents uploaded, use LLM (no automatic web search)
     if not uploaded_docs:
-        return "llm"
+        return "llm", "rule", None
     
     # If SQL files exist, check if it's a SQL query
     if has_sql_files:
         if is_sql_query(query):
-            return "sql"
-        # If not a SQL query, check if it's about documents
-        if has_doc_files:
-            is_about_docs = await is_document_query(query, llm, uploaded_docs)
-            if is_about_docs:
-                return "rag"
-            return "llm"
+            return "sql", "rule", None
         # Only SQL files, use SQL agent
-        return "sql"
+        if not has_doc_files:
+            return "sql", "rule", None
     
     # If document files exist, check if query is actually about documents
     if has_doc_files:
-        is_about_docs = await is_document_query(query, llm, uploaded_docs)
-        if is_about_docs:
-            return "rag"
-        return "llm"
+        if is_greeting(query):
+            return "llm", "rule", None
+        doc_files = [doc for doc in uploaded_docs if doc["file_type"].lower() in DOCUMENT_FILE_TYPES]
+        is_about_docs, method, scores = await classify_document_query(query, doc_files, llm_classify)
+        return ("rag" if is_about_docs else "llm"), method, scores
     
     # Fallback: no recognized file types
-    return "llm"
+    return "llm", "rule", None
 
-async def handle_rag_query(query: str, conversation_id: str | None, llm, chat_history: list = None):
-    """Handle RAG queries using modern Runnable patterns."""
-    try:
-        print(f"🔍 Starting RAG query: '{query}' for conversation: {conversation_id}")
-        
-        # Retrieve documents
-        retrieved_docs = retrieve_docs(query, k=8, conversation_id=conversation_id)
-        
-        if not retrieved_docs:
-            print(f"⚠️ No documents retrieved for query: {query}")
-            # Double-check if documents exist in database
-            if conversation_id:
-                uploaded_docs = get_uploaded_documents(conversation_id)
-                if uploaded_docs:
-                    print(f"⚠️ Documents exist in DB ({len(uploaded_docs)}) but not retrieved from Weaviate")
-                else:
-                    print(f"⚠️ No documents found in database for conversation {conversation_id}")
-            return None, None
-        
-        print(f"✅ Retrieved {len(retrieved_docs)} documents for RAG query")
-        
-        # Build document context with better chunking
-        document_parts = []
-        total_length = 0
-        max_length = 8000  # Increased context window
-        
-        for i, doc in enumerate(retrieved_docs):
-            content = doc.page_content.strip()
-            if not content:
-                continue
-            
-            # Take up to 2000 chars per document, but respect total limit
-            chunk_size = min(2000, max_length - total_length)
-            if chunk_size <= 0:
-                break
-            
-            if len(content) > chunk_size:
-                content = content[:chunk_size] + "..."
-            
-            document_parts.append(f"[Document Chunk {i+1}]\n{content}")
-            total_length += len(content)
-            
-            if total_length >= max_length:
-                break
-        
-        document_context = "\n\n".join(document_parts)
-        
-        if not document_context.strip():
-            print("⚠️ Document context is empty after processing")
-            return None, None
-        
-        print(f"✅ Built document context ({len(document_context)} chars from {len(document_parts)} chunks)")
-        
-        # Enhanced system prompt for better RAG responses
-        system_prompt = """You are a helpful assistant that answers questions based EXCLUSIVELY on the provided document context.
+async def prepare_rag_prompt(
+    query: str,
+    conversation_id: str | None,
+    chat_history: list = None,
+    retrieval_mode: str | None = None,
+    hybrid_alpha: float | None = None,
+    top_k: int = 8,
+    diversify: bool | None = None,
+    mmr_lambda: float | None = None,
+    usage: dict | None = None,
+    retrieved_docs: list | None = None,
+):
+    """Retrieve chunks for the query and build the RAG prompt.
+    
+    retrieved_docs, when given, are chunks already retrieved for this query
+    with these options (by speculative retrieval) and are used as they are.
+    Returns (prompt_template, inputs, retrieved_docs), or None when nothing
+    usable was retrieved.
+    """
+    print(f"🔍 Starting RAG query: '{query}' for conversation: {conversation_id}")
+    
+    # Retrieve documents
+    if retrieved_docs is None:
+        retrieved_docs = await aretrieve_docs(
+            query,
+            k=top_k,
+            conversation_id=conversation_id,
+            mode=retrieval_mode,
+            alpha=hybrid_alpha,
+            diversify=diversify,
+            mmr_lambda=mmr_lambda
+        )
+    
+    if not retrieved_docs:
+        print(f"⚠️ No documents retrieved for query: {query}")
+        # Double-check if documents exist in database
+        if conversation_id:
+            uploaded_docs = await run_db(get_uploaded_documents, conversation_id)
+            if uploaded_docs:
+                print(f"⚠️ Documents exist in DB ({len(uploaded_docs)}) but not retrieved from Weaviate")
+            else:
+                print(f"⚠️ No documents found in database for conversation {conversation_id}")
+        return None
+    
+    print(f"✅ Retrieved {len(retrieved_docs)} documents for RAG query")
+    
+    # Enhanced system prompt for better RAG responses
+    system_prompt = """You are a helpful assistant that answers questions based EXCLUSIVELY on the provided document context.
 
 CRITICAL INSTRUCTIONS:
 1. Use ONLY the information from the document context to answer the question.
@@ -292,42 +404,107 @@ CRITICAL INSTRUCTIONS:
 5. Be precise, accurate, and detailed in your response.
 6. Respond in plain text without any markdown formatting, bold text, asterisks, or special characters.
 7. If summarizing, provide a comprehensive summary covering the main points from the document context."""
-        
-        # Build chat history messages for context
-        history_messages = []
-        if chat_history:
-            for msg in chat_history[-4:]:  # Reduced to 4 to save tokens for document context
-                if isinstance(msg, dict):
-                    if msg.get("user"):
-                        history_messages.append(("human", msg["user"]))
-                    if msg.get("assistant"):
-                        history_messages.append(("assistant", msg["assistant"]))
-        
-        # Use ChatPromptTemplate with Runnable pattern
-        prompt_template = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            *history_messages,
-            ("human", """Document Context:
-{document_context}
+    
+    human_template = """Document Context:
+{context}
 
 Question: {query}
 
-Based on the document context provided above, please answer the question. If the question asks for a summary, provide a comprehensive summary of the relevant content from the documents.""")
-        ])
-        
-        # Create Runnable chain: prompt | llm | extract content | clean markdown
-        extract_content = RunnableLambda(
-            lambda x: x.content if hasattr(x, "content") else str(x)
+Based on the document context provided above, please answer the question. If the question asks for a summary, provide a comprehensive summary of the relevant content from the documents."""
+    
+    # Fit history and document chunks into the prompt token budget
+    prompt = build_prompt_context(
+        system_prompt,
+        human_template,
+        query,
+        chat_history=chat_history,
+        chunks=[doc.page_content for doc in retrieved_docs]
+    )
+    
+    if not prompt["context"].strip():
+        print("⚠️ Document context is empty after processing")
+        return None
+    
+    print(f"✅ Built document context: {describe_usage(prompt)}")
+    if usage is not None:
+        usage.update(prompt["tokens"])
+    
+    # Use ChatPromptTemplate with Runnable pattern
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder("history"),
+        ("human", human_template)
+    ])
+    inputs = {"history": prompt["history"], "context": prompt["context"], "query": query}
+    return prompt_template, inputs, retrieved_docs
+
+async def rag_references(retrieved_docs: list, conversation_id: str | None) -> list:
+    """Names of the documents the retrieved chunks came from, at most 3."""
+    # Build references from document metadata
+    references = []
+    seen_doc_ids = set()
+    uploaded_docs = await run_db(get_uploaded_documents, conversation_id) if conversation_id else []
+    for i, doc in enumerate(retrieved_docs):
+        if hasattr(doc, "metadata") and doc.metadata:
+            doc_id = doc.metadata.get("doc_id") or doc.metadata.get("source", "")
+            if doc_id and doc_id not in seen_doc_ids:
+                # Try to get document name from database
+                if conversation_id:
+                    for ud in uploaded_docs:
+                        if ud.get("id") == doc_id:
+                            references.append(ud.get("name", f"Document {len(references)+1}"))
+                            seen_doc_ids.add(doc_id)
+                            break
+                if doc_id not in seen_doc_ids:
+                    references.append(f"Document {len(references)+1}")
+                    seen_doc_ids.add(doc_id)
+    
+    if not references:
+        references = [f"Document {i+1}" for i in range(min(len(retrieved_docs), 3))]
+    
+    return references[:3]  # Limit to 3 references
+
+async def handle_rag_query(
+    query: str,
+    conversation_id: str | None,
+    llm,
+    chat_history: list = None,
+    retrieval_mode: str | None = None,
+    hybrid_alpha: float | None = None,
+    top_k: int = 8,
+    diversify: bool | None = None,
+    mmr_lambda: float | None = None,
+    usage: dict | None = None,
+    retrieved_docs: list | None = None,
+):
+    """Handle RAG queries using modern Runnable patterns.
+    
+    retrieval_mode ("vector" or "hybrid"), hybrid_alpha, top_k, diversify and
+    mmr_lambda override the retrieval defaults for this request. The prompt's
+    token counts are written to usage when it is given. retrieved_docs skips
+    retrieval, see prepare_rag_prompt.
+    """
+    try:
+        prepared = await prepare_rag_prompt(
+            query,
+            conversation_id,
+            chat_history,
+            retrieval_mode=retrieval_mode,
+            hybrid_alpha=hybrid_alpha,
+            top_k=top_k,
+            diversify=diversify,
+            mmr_lambda=mmr_lambda,
+            usage=usage,
+            retrieved_docs=retrieved_docs
         )
-        clean_content = RunnableLambda(lambda x: clean_markdown(x) if x else None)
+        if not prepared:
+            return None, None
+        prompt_template, inputs, retrieved_docs = prepared
         
-        chain = prompt_template | llm | extract_content | clean_content
+        chain = answer_chain(prompt_template, llm)
         
         print(f"🔍 Invoking LLM with Runnable chain...")
-        answer = await chain.ainvoke({
-            "document_context": document_context,
-            "query": query
-        })
+        answer = await chain.ainvoke(inputs)
         
         if not answer or answer.strip() == "":
             print("⚠️ LLM returned empty answer")
@@ -335,30 +512,10 @@ Based on the document context provided above, please answer the question. If the
         
         print(f"✅ Generated answer ({len(answer)} chars)")
         
-        # Build references from document metadata
-        references = []
-        seen_doc_ids = set()
-        for i, doc in enumerate(retrieved_docs):
-            if hasattr(doc, "metadata") and doc.metadata:
-                doc_id = doc.metadata.get("doc_id") or doc.metadata.get("source", "")
-                if doc_id and doc_id not in seen_doc_ids:
-                    # Try to get document name from database
-                    if conversation_id:
-                        uploaded_docs = get_uploaded_documents(conversation_id)
-                        for ud in uploaded_docs:
-                            if ud.get("id") == doc_id:
-                                references.append(ud.get("name", f"Document {len(references)+1}"))
-                                seen_doc_ids.add(doc_id)
-                                break
-                    if doc_id not in seen_doc_ids:
-                        references.append(f"Document {len(references)+1}")
-                        seen_doc_ids.add(doc_id)
-        
-        if not references:
-            references = [f"Document {i+1}" for i in range(min(len(retrieved_docs), 3))]
+        references = await rag_references(retrieved_docs, conversation_id)
         
         print(f"✅ RAG query completed successfully with {len(references)} references")
-        return answer, references[:3]  # Limit to 3 references
+        return answer, references
         
     except Exception as e:
         print(f"⚠️ Error in handle_rag_query: {e}")
@@ -405,11 +562,14 @@ async def handle_sql_query(query: str, conversation_id: str | None, user_id: str
         print(f"SQL Agent error: {e}")
         return None, None
 
-async def handle_serpapi_query(query: str, llm, chat_history: list = None):
-    """Handle SerpAPI queries using modern Runnable patterns."""
+async def prepare_serpapi_prompt(query: str, chat_history: list = None, usage: dict | None = None):
+    """Run the web search and build the prompt that answers from its results.
+    
+    Returns (prompt_template, inputs), or None when the search gave nothing.
+    """
     if not settings.SERPAPI_API_KEY:
         print("⚠️ SERPAPI_API_KEY not set")
-        return None, None
+        return None
     
     from langchain_community.utilities import SerpAPIWrapper
     
@@ -442,7 +602,7 @@ async def handle_serpapi_query(query: str, llm, chat_history: list = None):
     serpapi = SerpAPIWrapper(serpapi_api_key=settings.SERPAPI_API_KEY)
     
     try:
-        search_results = serpapi.run(optimized_query)
+        search_results = await run_io(serpapi.run, optimized_query)
         
         # Handle both string and dict returns
         if isinstance(search_results, dict):
@@ -461,12 +621,12 @@ async def handle_serpapi_query(query: str, llm, chat_history: list = None):
         
         if not search_results or not search_results.strip():
             print("⚠️ SerpAPI returned empty results")
-            return None, None
+            return None
     except Exception as e:
         print(f"⚠️ SerpAPI error: {e}")
         import traceback
         traceback.print_exc()
-        return None, None
+        return None
     
     system_prompt = """You are a helpful assistant that answers questions based on web search results.
 
@@ -482,45 +642,49 @@ IMPORTANT INSTRUCTIONS:
 
 The search results may contain partial information - extract and present what is available, even if incomplete."""
     
-    # Build chat history messages for context
-    history_messages = []
-    if chat_history:
-        for msg in chat_history[-6:]:
-            if isinstance(msg, dict):
-                if msg.get("user"):
-                    history_messages.append(("human", msg["user"]))
-                if msg.get("assistant"):
-                    history_messages.append(("assistant", msg["assistant"]))
-            elif isinstance(msg, dict) and "role" in msg:
-                if msg.get("role") == "user":
-                    history_messages.append(("human", msg.get("content", "")))
-                elif msg.get("role") == "assistant":
-                    history_messages.append(("assistant", msg.get("content", "")))
+    human_template = """Search Results:
+{context}
+
+Question: {query}
+
+Provide an accurate answer based on the search results above:"""
+    
+    # Fit history and search results into the prompt token budget
+    prompt = build_prompt_context(
+        system_prompt,
+        human_template,
+        query,
+        chat_history=chat_history,
+        chunks=[search_results],
+        chunk_label=None,
+        chunk_tokens=0
+    )
+    print(f"✅ Built search context: {describe_usage(prompt)}")
+    if usage is not None:
+        usage.update(prompt["tokens"])
     
     # Use ChatPromptTemplate with Runnable pattern
     prompt_template = ChatPromptTemplate.from_messages([
         ("system", system_prompt),
-        *history_messages,
-        ("human", """Search Results:
-{search_results}
-
-Question: {query}
-
-Provide an accurate answer based on the search results above:""")
+        MessagesPlaceholder("history"),
+        ("human", human_template)
     ])
+    inputs = {"history": prompt["history"], "context": prompt["context"], "query": query}
+    return prompt_template, inputs
+
+async def handle_serpapi_query(query: str, llm, chat_history: list = None, usage: dict | None = None):
+    """Handle SerpAPI queries using modern Runnable patterns.
     
-    # Create Runnable chain: prompt | llm | extract content | clean markdown
-    extract_content = RunnableLambda(
-        lambda x: x.content if hasattr(x, "content") else str(x)
-    )
-    clean_content = RunnableLambda(lambda x: clean_markdown(x) if x else None)
+    The prompt's token counts are written to usage when it is given.
+    """
+    prepared = await prepare_serpapi_prompt(query, chat_history, usage)
+    if not prepared:
+        return None, None
+    prompt_template, inputs = prepared
     
-    chain = prompt_template | llm | extract_content | clean_content
+    chain = answer_chain(prompt_template, llm)
     
-    answer = await chain.ainvoke({
-        "search_results": search_results,
-        "query": query
-    })
+    answer = await chain.ainvoke(inputs)
     
     # SerpAPIWrapper returns formatted string, so we can't extract individual links
     # But we can indicate that search was performed
@@ -528,48 +692,224 @@ Provide an accurate answer based on the search results above:""")
     
     return answer, references
 
+def prepare_llm_prompt(query: str, chat_history: list = None, usage: dict | None = None):
+    """Build the prompt for answering from the model alone, with as much chat
+    history as the prompt token budget allows. Returns (prompt_template, inputs)."""
+    system_prompt = "You are a helpful assistant. Answer the user's question to the best of your ability. You have access to the conversation history. Respond in plain text without any markdown formatting, bold text, or special characters."
+    human_template = "{query}"
+    
+    prompt = build_prompt_context(system_prompt, human_template, query, chat_history=chat_history)
+    print(f"✅ Built LLM prompt: {describe_usage(prompt)}")
+    if usage is not None:
+        usage.update(prompt["tokens"])
+    
+    # Use ChatPromptTemplate with Runnable pattern
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder("history"),
+        ("human", human_template)
+    ])
+    return prompt_template, {"history": prompt["history"], "query": query}
+
+async def handle_llm_query(query: str, llm, chat_history: list = None, usage: dict | None = None):
+    """Answer from the model alone. The prompt's token counts are written to usage when it is given."""
+    try:
+        prompt_template, inputs = prepare_llm_prompt(query, chat_history, usage)
+        chain = answer_chain(prompt_template, llm)
+        
+        answer = await chain.ainvoke(inputs)
+        
+        if not answer or answer.strip() == "":
+            print("⚠️ LLM returned empty answer")
+        return answer
+    except Exception as e:
+        print(f"⚠️ Error in LLM handler: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+def _log_chat_metrics(response_time_ms, route, has_references, prompt_tokens=None, time_to_first_token_ms=None, cache_lookup=None, stage_ms=None):
+    try:
+        mlflow.log_metric("response_time_ms", response_time_ms)
+        for stage, ms in (stage_ms or {}).items():
+            mlflow.log_metric(f"stage_{stage}_ms", ms)
+        if cache_lookup:
+            hit = cache_lookup["hit"]
+            mlflow.log_metric("answer_cache_hit", 1 if hit else 0)
+            if hit:
+                mlflow.log_metric("answer_cache_latency_saved_ms", max(0, hit["response_time_ms"] - response_time_ms))
+        if prompt_tokens:
+            mlflow.log_metric("prompt_tokens", prompt_tokens)
+        if time_to_first_token_ms is not None:
+            mlflow.log_metric("time_to_first_token_ms", time_to_first_token_ms)
+        mlflow.log_param("route", route)
+        mlflow.log_param("has_references", has_references)
+    except:
+        pass
+
+def _rag_options(retrieval_mode, hybrid_alpha, top_k, diversify, mmr_lambda):
+    """Validate the per-request retrieval form fields into handle_rag_query keyword arguments."""
+    if retrieval_mode and retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval_mode must be one of: {', '.join(sorted(RETRIEVAL_MODES))}")
+    if not 1 <= top_k <= 50:
+        raise HTTPException(status_code=400, detail="top_k must be between 1 and 50")
+    if mmr_lambda is not None and not 0.0 <= mmr_lambda <= 1.0:
+        raise HTTPException(status_code=400, detail="mmr_lambda must be between 0 and 1")
+    return {
+        "retrieval_mode": retrieval_mode,
+        "hybrid_alpha": hybrid_alpha,
+        "top_k": top_k,
+        "diversify": diversify,
+        "mmr_lambda": mmr_lambda
+    }
+
+def _chat_llm():
+    # Shared model on the pooled HTTP clients; no new connections per request
+    return get_chat_model(temperature=0.7)
+
+def _elapsed_ms(started):
+    return int((time.time() - started) * 1000)
+
+async def _timed(awaitable, stage_ms, stage):
+    started = time.time()
+    try:
+        return await awaitable
+    finally:
+        stage_ms[stage] = _elapsed_ms(started)
+
+def start_speculative_retrieval(query, conversation_id, uploaded_docs, rag_options, stage_ms):
+    """Start retrieval for the query while the route is still being decided.
+    
+    Only for conversations with documents to search, and not for queries the
+    routing rules send elsewhere without asking a model. Its duration is
+    recorded as stage_ms["retrieval"]. Returns the task, or None.
+    """
+    if not settings.SPECULATIVE_RETRIEVAL:
+        return None
+    file_types = {doc["file_type"].lower() for doc in uploaded_docs}
+    if not file_types & DOCUMENT_FILE_TYPES:
+        return None
+    if is_greeting(query) or is_document_meta_query(query) or (file_types & SQL_FILE_TYPES and is_sql_query(query)):
+        return None
+    retrieval = aretrieve_docs(
+        query,
+        k=rag_options["top_k"],
+        conversation_id=conversation_id,
+        mode=rag_options["retrieval_mode"],
+        alpha=rag_options["hybrid_alpha"],
+        diversify=rag_options["diversify"],
+        mmr_lambda=rag_options["mmr_lambda"]
+    )
+    return asyncio.create_task(_timed(retrieval, stage_ms, "retrieval"))
+
+async def resolve_speculative_retrieval(task, needed, stage_ms):
+    """The chunks of a speculative retrieval if they are needed, otherwise cancel it.
+    
+    Returns None when there was no retrieval, it was not needed or it failed;
+    the caller then retrieves as usual. Time spent waiting for it once the
+    route was known is recorded as stage_ms["retrieval_wait"].
+    """
+    if task is None:
+        return None
+    if not needed:
+        if not task.done():
+            task.cancel()
+            print("✂️ Cancelled speculative retrieval")
+        await asyncio.gather(task, return_exceptions=True)
+        return None
+    started = time.time()
+    try:
+        return await task
+    except Exception as e:
+        print(f"⚠️ Speculative retrieval failed: {e}")
+        return None
+    finally:
+        stage_ms["retrieval_wait"] = _elapsed_ms(started)
+
+async def _response_history(conversation_id, history_mode, after_seq, user_message_id):
+    if history_mode == "full":
+        return {"chat_history": await run_db(get_chat_history, conversation_id, include_ids=True)}
+    if after_seq is None:
+        # Just this turn, from its question on
+        after_seq = (await run_db(get_message_seq, user_message_id) or 1) - 1
+    page = await run_db(get_chat_history_page, conversation_id, after_seq=after_seq)
+    return {"history_mode": "delta", "chat_history": page["chat_history"], "last_seq": page["last_seq"] or after_seq}
+
 @router.post("/chat/text")
 async def chat_text(
     query: str = Form(...),
     search_online: str = Form("false"),
     conversation_id: str | None = Form(None),
+    retrieval_mode: str | None = Form(None),
+    hybrid_alpha: float | None = Form(None),
+    top_k: int = Form(8),
+    diversify: bool | None = Form(None),
+    mmr_lambda: float | None = Form(None),
+    history_mode: str = Form("full"),
+    after_seq: int | None = Form(None),
     current_user: dict = Depends(require_user),
 ):
+    """Answer a message. history_mode "full" returns the whole conversation as
+    chat_history; "delta" returns only the turns after after_seq (just this
+    turn when after_seq is omitted) and last_seq, the cursor for the next
+    request."""
+    if history_mode not in ("full", "delta"):
+        raise HTTPException(status_code=400, detail="history_mode must be 'full' or 'delta'")
+    rag_options = _rag_options(retrieval_mode, hybrid_alpha, top_k, diversify, mmr_lambda)
+    
     start_time = time.time()
     user_id = current_user["id"]
     
-    conversation_id = ensure_conversation(conversation_id, user_id)
-    
-    add_message(conversation_id, "user", query)
-    
-    llm = AzureChatOpenAI(
-        azure_deployment=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
-        openai_api_key=settings.AZURE_OPENAI_API_KEY,
-        openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-        temperature=0.7
-    )
+    conversation_id = await run_db(ensure_conversation, conversation_id, user_id)
     
-    uploaded_docs = []
-    if conversation_id:
-        uploaded_docs = get_uploaded_documents(conversation_id)
+    user_message_id = await run_db(add_message, conversation_id, "user", query)
     
-    chat_history = get_chat_history(conversation_id, include_ids=False)
+    llm = _chat_llm()
+    stage_ms = {}
     
-    route = await detect_route(query, conversation_id, llm)
+    stage_started = time.time()
+    uploaded_docs, chat_history = await asyncio.gather(
+        run_db(get_uploaded_documents, conversation_id),
+        run_db(load_chat_memory, conversation_id)
+    )
+    stage_ms["load"] = _elapsed_ms(stage_started)
     
     # Convert search_online string to boolean
     search_online_bool = search_online.lower() in ("true", "1", "yes", "on")
     
-    # Override route to SerpAPI if user explicitly requested web search
-    if search_online_bool:
-        route = "serpapi"
-        print(f"🔍 User requested web search, routing to SerpAPI")
-    
-    print(f"🔍 Initial route detected: {route}, uploaded_docs: {len(uploaded_docs)}, search_online: {search_online_bool}")
-    
     answer = None
     references = None
+    prompt_usage = {}
+    # Route whose handler produced the answer, when the answer may be cached
+    generated_by = None
+    
+    # Retrieval runs alongside routing and the answer cache lookup (which
+    # share one query embedding) and is cancelled unless the route is RAG
+    speculative = None if search_online_bool else start_speculative_retrieval(
+        query, conversation_id, uploaded_docs, rag_options, stage_ms
+    )
+    try:
+        stage_started = time.time()
+        # Override route to SerpAPI if user explicitly requested web search
+        if search_online_bool:
+            route = "serpapi"
+            print("🔍 User requested web search, routing to SerpAPI")
+        else:
+            route = await detect_route(query, conversation_id, llm)
+        stage_ms["route"] = _elapsed_ms(stage_started)
+        
+        print(f"🔍 Initial route detected: {route}, uploaded_docs: {len(uploaded_docs)}, search_online: {search_online_bool}")
+        
+        cache_lookup = await find_cached_answer(query, route, uploaded_docs, chat_history)
+        if cache_lookup and cache_lookup["hit"]:
+            answer = cache_lookup["hit"]["answer"]
+            references = cached_references(cache_lookup["hit"], uploaded_docs)
+    except BaseException:
+        if speculative:
+            speculative.cancel()
+        raise
+    prefetched_docs = await resolve_speculative_retrieval(speculative, route == "rag" and not answer, stage_ms)
+    stage_started = time.time()
     
     if route == "doc_meta":
         print("🔍 Handling document metadata query...")
@@ -584,7 +924,9 @@ async def chat_text(
     
     if route == "rag" and not answer:
         print("🔍 Trying RAG...")
-        answer, references = await handle_rag_query(query, conversation_id, llm, chat_history)
+        answer, references = await handle_rag_query(
+            query, conversation_id, llm, chat_history, usage=prompt_usage, retrieved_docs=prefetched_docs, **rag_options
+        )
         
         # Check if RAG answer indicates no information in documents
         rag_has_no_info = False
@@ -599,6 +941,8 @@ async def chat_text(
                 "not found in the document"
             ]
             rag_has_no_info = any(phrase in answer_lower for phrase in no_info_phrases)
+            if not rag_has_no_info:
+                generated_by = "rag"
         
         if not answer or rag_has_no_info:
             if rag_has_no_info:
@@ -606,40 +950,41 @@ async def chat_text(
             else:
                 print(f"⚠️ RAG returned no answer, uploaded_docs: {len(uploaded_docs)}")
             
+            indexing_docs = [doc for doc in uploaded_docs if doc["status"] == "indexing"]
+            
             # If RAG fails, just fall back to LLM (no automatic SerpAPI)
-            if uploaded_docs:
+            if not answer and indexing_docs:
+                print(f"⏳ {len(indexing_docs)} document(s) still indexing, skipping fallbacks")
+                names = ", ".join(doc.get("name", "Unknown") for doc in indexing_docs)
+                answer = f"Your document(s) {names} are still being indexed. Please try again in a moment."
+            elif uploaded_docs:
                 print("🔍 RAG failed but documents exist, trying with simplified query...")
                 simplified_query = " ".join(query.split()[:10])  # First 10 words
-                answer, references = await handle_rag_query(simplified_query, conversation_id, llm, chat_history)
+                answer, references = await handle_rag_query(simplified_query, conversation_id, llm, chat_history, usage=prompt_usage, **rag_options)
 
                 if answer:
                     print("✅ RAG succeeded with simplified query")
                 elif not answer:
                     print("⚠️ RAG still failed with simplified query, checking document indexing...")
-                    from app.services.weaviate_service import get_client
-                    from weaviate.classes.query import Filter
-                    client = get_client()
-                    if client and client.collections.exists("DocumentChunk"):
-                        doc_records = get_uploaded_documents(conversation_id)
-                        doc_ids = [doc["id"] for doc in doc_records]
+                    from app.services.weaviate_service import get_vector_store
+                    store = get_vector_store()
+                    if store:
+                        doc_records = await run_db(get_uploaded_documents, conversation_id)
+                        doc_ids = [doc["storage_key"] for doc in doc_records]
                         if doc_ids:
-                            collection = client.collections.get("DocumentChunk")
                             try:
-                                test_res = collection.query.fetch_objects(
-                                    limit=1,
-                                    filters=Filter.by_property("doc_id").contains_any(doc_ids[:1])
-                                )
-                                if not test_res.objects:
-                                    print("⚠️ Documents are not indexed in Weaviate!")
+                                indexed = await store.afetch(doc_ids[:1], 1)
+                                if not indexed:
+                                    print("⚠️ Documents are not indexed in the vector store!")
                                     answer = f"I found {len(uploaded_docs)} uploaded document(s), but they appear to not be properly indexed yet. Please try again in a moment, or re-upload the document."
                                 else:
-                                    print(f"✅ Found {len(test_res.objects)} indexed chunks, but RAG still failed")
+                                    print(f"✅ Found {len(indexed)} indexed chunks, but RAG still failed")
                                     route = "llm"
                             except Exception as check_error:
                                 print(f"⚠️ Error checking document index: {check_error}")
                                 route = "llm"
                     else:
-                        print("⚠️ Weaviate client not available")
+                        print("⚠️ Vector store not available")
                         route = "llm"
             else:
                 print("🔍 RAG failed, routing to LLM")
@@ -647,83 +992,263 @@ async def chat_text(
     
     if route == "serpapi" and not answer:
         print("🔍 Trying SerpAPI (user requested web search)...")
-        answer, references = await handle_serpapi_query(query, llm, chat_history)
+        answer, references = await handle_serpapi_query(query, llm, chat_history, usage=prompt_usage)
         if not answer:
             print("⚠️ SerpAPI returned no answer, falling back to LLM")
             route = "llm"
     
     if route == "llm" and not answer:
         print("🔍 Trying LLM...")
-        try:
-            system_prompt = "You are a helpful assistant. Answer the user's question to the best of your ability. You have access to the conversation history. Respond in plain text without any markdown formatting, bold text, or special characters."
-            
-            # Build chat history messages for context
-            history_messages = []
-            if chat_history:
-                for msg in chat_history[-10:]:
-                    if isinstance(msg, dict):
-                        if msg.get("user"):
-                            history_messages.append(("human", msg["user"]))
-                        if msg.get("assistant"):
-                            history_messages.append(("assistant", msg["assistant"]))
-                    elif isinstance(msg, dict) and "role" in msg:
-                        if msg.get("role") == "user":
-                            history_messages.append(("human", msg.get("content", "")))
-                        elif msg.get("role") == "assistant":
-                            history_messages.append(("assistant", msg.get("content", "")))
-            
-            # Use ChatPromptTemplate with Runnable pattern
-            prompt_template = ChatPromptTemplate.from_messages([
-                ("system", system_prompt),
-                *history_messages,
-                ("human", "{query}")
-            ])
-            
-            # Create Runnable chain: prompt | llm | extract content | clean markdown
-            extract_content = RunnableLambda(
-                lambda x: x.content if hasattr(x, "content") else str(x)
-            )
-            clean_content = RunnableLambda(lambda x: clean_markdown(x) if x else None)
-            
-            chain = prompt_template | llm | extract_content | clean_content
-            
-            answer = await chain.ainvoke({"query": query})
-            
-            if not answer or answer.strip() == "":
-                print("⚠️ LLM returned empty answer")
-        except Exception as e:
-            print(f"⚠️ Error in LLM handler: {e}")
-            import traceback
-            traceback.print_exc()
-            answer = None
+        answer = await handle_llm_query(query, llm, chat_history, usage=prompt_usage)
+        if answer:
+            generated_by = "llm"
     
     if not answer:
         answer = "I apologize, but I couldn't generate a response. Please try rephrasing your question."
     
+    stage_ms["answer"] = _elapsed_ms(stage_started)
     response_time_ms = int((time.time() - start_time) * 1000)
+    stage_ms["total"] = response_time_ms
+    print(f"⏱️ Stage timings (ms): {stage_ms}")
     
     references_json = json.dumps(references) if references else None
-    message_id = add_message(
+    message_id = await run_db(
+        add_message,
         conversation_id,
         "assistant",
         answer,
         response_time_ms=response_time_ms,
         references=references
     )
+    if cache_lookup and (cache_lookup["hit"] or generated_by):
+        remember_answer(cache_lookup, generated_by, uploaded_docs, query, answer, references, message_id, response_time_ms)
+    schedule_summary_refresh(conversation_id)
     
-    try:
-        mlflow.log_metric("response_time_ms", response_time_ms)
-        mlflow.log_param("route", route)
-        mlflow.log_param("has_references", bool(references))
-    except:
-        pass
+    # The file-based MLflow store writes to disk
+    await run_io(_log_chat_metrics, response_time_ms, route, bool(references), prompt_usage.get("total"), None, cache_lookup, stage_ms)
     
-    final_chat_history = get_chat_history(conversation_id, include_ids=True)
+    history = await _response_history(conversation_id, history_mode, after_seq, user_message_id)
     
     return {
         "conversation_id": conversation_id,
         "message_id": message_id,
-        "chat_history": final_chat_history,
+        **history,
         "answer": answer,
-        "references": references
+        "references": references,
+        "prompt_tokens": prompt_usage or None,
+        "timings_ms": stage_ms
     }
+
+async def plan_streamed_answer(
+    query: str,
+    conversation_id: str,
+    user_id: str,
+    llm,
+    route: str,
+    uploaded_docs: list,
+    chat_history: list,
+    rag_options: dict,
+    usage: dict,
+    retrieved_docs: list | None = None
+):
+    """Do everything for /chat/stream up to the LLM call.
+    
+    Follows the route fallbacks of /chat/text, except the ones that need the
+    finished answer. retrieved_docs are chunks already retrieved for the
+    query. Returns (route, answer, references, prompt): prompt is the
+    (prompt_template, inputs) to stream from, or None when answer is already
+    final.
+    """
+    if route == "doc_meta":
+        print("🔍 Handling document metadata query...")
+        answer, references = await handle_doc_meta_query(query, conversation_id, uploaded_docs)
+        return route, answer, references, None
+    
+    if route == "sql":
+        print("🔍 Trying SQL agent...")
+        answer, references = await handle_sql_query(query, conversation_id, user_id)
+        if answer:
+            return route, answer, references, None
+        print("⚠️ SQL agent returned no answer, falling back to RAG")
+        route = "rag"
+    
+    if route == "rag":
+        print("🔍 Trying RAG...")
+        try:
+            prepared = await prepare_rag_prompt(
+                query, conversation_id, chat_history, usage=usage, retrieved_docs=retrieved_docs, **rag_options
+            )
+            if not prepared and uploaded_docs:
+                indexing_docs = [doc for doc in uploaded_docs if doc["status"] == "indexing"]
+                if indexing_docs:
+                    print(f"⏳ {len(indexing_docs)} document(s) still indexing, skipping fallbacks")
+                    names = ", ".join(doc.get("name", "Unknown") for doc in indexing_docs)
+                    return route, f"Your document(s) {names} are still being indexed. Please try again in a moment.", None, None
+                print("🔍 RAG failed but documents exist, trying with simplified query...")
+                simplified_query = " ".join(query.split()[:10])  # First 10 words
+                prepared = await prepare_rag_prompt(simplified_query, conversation_id, chat_history, usage=usage, **rag_options)
+        except Exception as e:
+            print(f"⚠️ Error preparing RAG prompt: {e}")
+            prepared = None
+        if prepared:
+            prompt_template, inputs, retrieved_docs = prepared
+            references = await rag_references(retrieved_docs, conversation_id)
+            return route, None, references, (prompt_template, inputs)
+        print("🔍 RAG failed, routing to LLM")
+        route = "llm"
+    
+    if route == "serpapi":
+        print("🔍 Trying SerpAPI (user requested web search)...")
+        prepared = await prepare_serpapi_prompt(query, chat_history, usage)
+        if prepared:
+            return route, None, None, prepared
+        print("⚠️ SerpAPI returned no answer, falling back to LLM")
+    
+    print("🔍 Trying LLM...")
+    return "llm", None, None, prepare_llm_prompt(query, chat_history, usage)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _save_streamed_answer(conversation_id, answer, references, route, start_time, first_token_at, prompt_usage, cache_lookup=None):
+    response_time_ms = int((time.time() - start_time) * 1000)
+    time_to_first_token_ms = int((first_token_at - start_time) * 1000) if first_token_at else None
+    message_id = await run_db(
+        add_message,
+        conversation_id,
+        "assistant",
+        answer,
+        response_time_ms=response_time_ms,
+        references=references
+    )
+    schedule_summary_refresh(conversation_id)
+    # The file-based MLflow store writes to disk
+    await run_io(_log_chat_metrics, response_time_ms, route, bool(references), prompt_usage.get("total"), time_to_first_token_ms, cache_lookup)
+    return {
+        "message_id": message_id,
+        "response_time_ms": response_time_ms,
+        "time_to_first_token_ms": time_to_first_token_ms
+    }
+
+@router.post("/chat/stream")
+async def chat_stream(
+    query: str = Form(...),
+    search_online: str = Form("false"),
+    conversation_id: str | None = Form(None),
+    retrieval_mode: str | None = Form(None),
+    hybrid_alpha: float | None = Form(None),
+    top_k: int = Form(8),
+    diversify: bool | None = Form(None),
+    mmr_lambda: float | None = Form(None),
+    current_user: dict = Depends(require_user),
+):
+    """Streaming version of /chat/text, as server-sent events.
+    
+    Events, in order: "start" (conversation_id), "route", "references",
+    "token" (cleaned answer text as the model produces it), then "done"
+    (message_id, response_time_ms, time_to_first_token_ms, prompt_tokens,
+    timings_ms).
+    A failure after the stream has started is sent as an "error" event. The
+    assistant message is saved when the stream ends; if the client
+    disconnects, the model call is cancelled and the text already sent is
+    saved.
+    """
+    rag_options = _rag_options(retrieval_mode, hybrid_alpha, top_k, diversify, mmr_lambda)
+    
+    start_time = time.time()
+    user_id = current_user["id"]
+    
+    conversation_id = await run_db(ensure_conversation, conversation_id, user_id)
+    
+    await run_db(add_message, conversation_id, "user", query)
+    
+    llm = _chat_llm()
+    search_online_bool = search_online.lower() in ("true", "1", "yes", "on")
+    
+    async def events():
+        route = "llm"
+        references = None
+        prompt_usage = {}
+        parts = []
+        first_token_at = None
+        cache_lookup = None
+        generated_by = None
+        speculative = None
+        stage_ms = {}
+        disconnected = True
+        try:
+            yield _sse("start", {"conversation_id": conversation_id})
+            
+            uploaded_docs, chat_history = await asyncio.gather(
+                run_db(get_uploaded_documents, conversation_id),
+                run_db(load_chat_memory, conversation_id)
+            )
+            if search_online_bool:
+                route = "serpapi"
+                print("🔍 User requested web search, routing to SerpAPI")
+            else:
+                speculative = start_speculative_retrieval(query, conversation_id, uploaded_docs, rag_options, stage_ms)
+                route = await detect_route(query, conversation_id, llm)
+            
+            cache_lookup = await find_cached_answer(query, route, uploaded_docs, chat_history)
+            hit = cache_lookup and cache_lookup["hit"]
+            prefetched_docs = await resolve_speculative_retrieval(speculative, route == "rag" and not hit, stage_ms)
+            if hit:
+                answer, references, prompt = hit["answer"], cached_references(hit, uploaded_docs), None
+            else:
+                route, answer, references, prompt = await plan_streamed_answer(
+                    query, conversation_id, user_id, llm, route, uploaded_docs, chat_history, rag_options, prompt_usage,
+                    retrieved_docs=prefetched_docs
+                )
+            yield _sse("route", {"route": route})
+            yield _sse("references", {"references": references})
+            
+            if prompt:
+                prompt_template, inputs = prompt
+                cleaner = MarkdownStreamCleaner()
+                async for chunk in (prompt_template | llm).astream(inputs):
+                    text = cleaner.feed(chunk.content if hasattr(chunk, "content") else str(chunk))
+                    if text:
+                        first_token_at = first_token_at or time.time()
+                        parts.append(text)
+                        yield _sse("token", {"text": text})
+                answer = cleaner.flush()
+                if route in ("rag", "llm"):
+                    generated_by = route
+            if answer:
+                first_token_at = first_token_at or time.time()
+                parts.append(answer)
+                yield _sse("token", {"text": answer})
+            disconnected = False
+        except Exception as e:
+            print(f"⚠️ Error in chat stream: {e}")
+            import traceback
+            traceback.print_exc()
+            disconnected = False
+            yield _sse("error", {"detail": "The answer could not be completed"})
+        finally:
+            if speculative and not speculative.done():
+                speculative.cancel()
+            if disconnected:
+                # Cancelled by a client disconnect: keep what the user already saw
+                print(f"🔌 Client disconnected from chat stream after {sum(len(p) for p in parts)} chars")
+                if parts:
+                    with anyio.CancelScope(shield=True):
+                        await _save_streamed_answer(conversation_id, "".join(parts), references, route, start_time, first_token_at, prompt_usage)
+        
+        if not parts:
+            parts.append("I apologize, but I couldn't generate a response. Please try rephrasing your question.")
+            yield _sse("token", {"text": parts[0]})
+        saved = await _save_streamed_answer(
+            conversation_id, "".join(parts), references, route, start_time, first_token_at, prompt_usage, cache_lookup
+        )
+        if cache_lookup and (cache_lookup["hit"] or generated_by):
+            remember_answer(cache_lookup, generated_by, uploaded_docs, query, "".join(parts), references, saved["message_id"], saved["response_time_ms"])
+        print(f"✅ Streamed {route} answer: first token after {saved['time_to_first_token_ms']} ms, done after {saved['response_time_ms']} ms")
+        yield _sse("done", {**saved, "prompt_tokens": prompt_usage or None, "timings_ms": stage_ms})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,56 +1,130 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, Form
+import hashlib
+from fastapi import APIRouter, HTTPException, Depends, Query, Form, Request, Response
+from app.config import settings
 from app.utils.auth import require_user
 from app.database import (
     get_user_conversations,
     get_chat_history,
+    get_chat_history_page,
+    get_conversation_version,
     ensure_conversation,
     clear_messages,
-    delete_conversation
+    delete_conversation,
+    get_uploaded_documents
 )
+from app.services.document_service import purge_document_storage
+from app.services.weaviate_service import release_document_tenant
+from app.services.executors import run_db, run_io
+from app.services.query_router import invalidate_routing_cache
 
 router = APIRouter()
 
+# History endpoints return the whole conversation by default. With before,
+# after or limit they return one page keyed on message seq (see
+# get_chat_history_page): no parameters but limit gives the newest turns,
+# before=<first_seq> the page before, and after=<last_seq> everything since,
+# which is how a client catches up without re-downloading the conversation.
+# Responses carry an ETag derived from the conversation's version, so a
+# client sending If-None-Match gets a 304 without the history being read.
+
+def _history_etag(conversation_id, version, *variant):
+    key = f"{conversation_id}:{version['messages']}:{version['last_seq']}:{version['last_message_id']}:{variant}"
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+async def _history_response(request, response, conversation_id, include_ids, before, after, limit):
+    version = await run_db(get_conversation_version, conversation_id)
+    etag = _history_etag(conversation_id, version, include_ids, before, after, limit)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    if before is None and after is None and limit is None:
+        return {
+            "conversation_id": conversation_id,
+            "chat_history": await run_db(get_chat_history, conversation_id, include_ids=include_ids)
+        }
+    page = await run_db(get_chat_history_page, conversation_id, before, after, limit)
+    return {"conversation_id": conversation_id, **page}
+
+def _page_params(
+    before: int | None = Query(None, ge=1, description="Return turns before this seq (a page's first_seq)"),
+    after: int | None = Query(None, ge=0, description="Return turns after this seq (a page's last_seq)"),
+    limit: int | None = Query(None, ge=1, le=settings.HISTORY_PAGE_MAX_TURNS, description="Turns per page")
+):
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Pass either before or after, not both")
+    return before, after, limit
+
 @router.get("/conversations")
 async def list_conversations(current_user: dict = Depends(require_user)):
-    conversations = get_user_conversations(current_user["id"])
+    conversations = await run_db(get_user_conversations, current_user["id"])
     return {"conversations": conversations}
 
 @router.get("/conversations/current")
-async def get_current_conversation(current_user: dict = Depends(require_user)):
-    conversations = get_user_conversations(current_user["id"])
+async def get_current_conversation(
+    request: Request,
+    response: Response,
+    page: tuple = Depends(_page_params),
+    current_user: dict = Depends(require_user)
+):
+    conversations = await run_db(get_user_conversations, current_user["id"])
     if conversations:
         conversation_id = conversations[0]["id"]
     else:
-        conversation_id = ensure_conversation(None, current_user["id"])
+        conversation_id = await run_db(ensure_conversation, None, current_user["id"])
     
-    return {
-        "conversation_id": conversation_id,
-        "chat_history": get_chat_history(conversation_id)
-    }
+    return await _history_response(request, response, conversation_id, False, *page)
 
 @router.get("/conversations/{conversation_id}")
-async def get_conversation(conversation_id: str, current_user: dict = Depends(require_user)):
-    ensure_conversation(conversation_id, current_user["id"])
-    return {
-        "conversation_id": conversation_id,
-        "chat_history": get_chat_history(conversation_id, include_ids=True)
-    }
+async def get_conversation(
+    conversation_id: str,
+    request: Request,
+    response: Response,
+    page: tuple = Depends(_page_params),
+    current_user: dict = Depends(require_user)
+):
+    await run_db(ensure_conversation, conversation_id, current_user["id"])
+    return await _history_response(request, response, conversation_id, True, *page)
+
+def _delete_conversation(conversation_id: str, user_id: str) -> bool:
+    storage_keys = {doc["storage_key"] for doc in get_uploaded_documents(conversation_id)}
+    orphaned = delete_conversation(conversation_id, user_id)
+    if orphaned is None:
+        return False
+    invalidate_routing_cache(conversation_id)
+    for doc in orphaned:
+        purge_document_storage(doc["storage_key"], doc["file_type"])
+    # Documents other users still hold only leave this user's tenant
+    for storage_key in storage_keys - {doc["storage_key"] for doc in orphaned}:
+        release_document_tenant(storage_key, user_id)
+    return True
 
 @router.delete("/conversations/{conversation_id}")
 async def delete_conversation_endpoint(conversation_id: str, current_user: dict = Depends(require_user)):
-    success = delete_conversation(conversation_id, current_user["id"])
-    if not success:
+    if not await run_io(_delete_conversation, conversation_id, current_user["id"]):
         raise HTTPException(status_code=404, detail="Conversation not found or access denied")
     return {"message": "Conversation deleted successfully"}
 
 @router.get("/history")
-async def get_history(conversation_id: str = Query(...), current_user: dict = Depends(require_user)):
-    ensure_conversation(conversation_id, current_user["id"])
-    return {"conversation_id": conversation_id, "chat_history": get_chat_history(conversation_id)}
+async def get_history(
+    request: Request,
+    response: Response,
+    conversation_id: str = Query(...),
+    page: tuple = Depends(_page_params),
+    current_user: dict = Depends(require_user)
+):
+    await run_db(ensure_conversation, conversation_id, current_user["id"])
+    return await _history_response(request, response, conversation_id, False, *page)
 
 @router.post("/clear_history")
 async def clear_history(conversation_id: str = Form(...), current_user: dict = Depends(require_user)):
-    ensure_conversation(conversation_id, current_user["id"])
-    clear_messages(conversation_id)
+    await run_db(ensure_conversation, conversation_id, current_user["id"])
+    await run_db(clear_messages, conversation_id)
     return {"message": "History cleared.", "conversation_id": conversation_id}
 
@@ -1,13 +1,31 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
+from fastapi import APIRouter, Form, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse
 from app.utils.auth import require_user
 from app.database import (
     ensure_conversation,
     add_uploaded_document_record,
     get_uploaded_documents,
-    delete_uploaded_document_record
+    delete_uploaded_document_record,
+    get_uploaded_document,
+    get_ingestion_job,
+    get_active_ingestion_job_for_blob,
+    acquire_document_blob,
+    release_document_blob,
+    set_document_blob_status,
+    user_has_document_blob
 )
 from app.config import settings
-from app.services.weaviate_service import embed_and_index_docs
+from app.services.document_service import (
+    get_document_path,
+    purge_document_storage,
+    receive_upload,
+    UploadTooLarge,
+    InvalidUpload
+)
+from app.services.ingestion_service import submit_ingestion_job, submit_tenant_sync, IngestionQueueFull
+from app.services.weaviate_service import release_document_tenant
+from app.services.executors import run_db, run_io
+from app.services.query_router import invalidate_routing_cache
 import uuid
 import os
 from pathlib import Path
@@ -17,106 +35,98 @@ router = APIRouter()
 def get_file_extension(filename: str) -> str:
     return Path(filename).suffix.lower()
 
-def process_document(file_content: bytes, file_type: str):
+def _get_loader(file_path: str, file_type: str):
     from langchain_community.document_loaders import PyPDFLoader, TextLoader, CSVLoader
     from langchain_community.document_loaders import UnstructuredWordDocumentLoader
     from langchain_community.document_loaders import UnstructuredExcelLoader
-    import tempfile
-    import io
-    
-    docs = []
     
+    if file_type == ".pdf":
+        return PyPDFLoader(file_path)
+    elif file_type == ".txt":
+        return TextLoader(file_path, autodetect_encoding=True)
+    elif file_type == ".csv":
+        return CSVLoader(file_path)
+    elif file_type in [".xls", ".xlsx"]:
+        return UnstructuredExcelLoader(file_path)
+    elif file_type in [".doc", ".docx"]:
+        return UnstructuredWordDocumentLoader(file_path)
+    raise ValueError(f"Unsupported file type: {file_type}")
+
+def load_document_pages(file_path: str, file_type: str):
+    """Lazily yield the parsed pages (or rows) of a stored document."""
     try:
-        if file_type == ".pdf":
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                tmp_file.write(file_content)
-                tmp_path = tmp_file.name
-            try:
-                loader = PyPDFLoader(tmp_path)
-                docs = loader.load()
-            finally:
-                os.unlink(tmp_path)
-        
-        elif file_type == ".txt":
-            loader = TextLoader(io.BytesIO(file_content))
-            docs = loader.load()
-        
-        elif file_type == ".csv":
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp_file:
-                tmp_file.write(file_content)
-                tmp_path = tmp_file.name
-            try:
-                loader = CSVLoader(tmp_path)
-                docs = loader.load()
-            finally:
-                os.unlink(tmp_path)
-        
-        elif file_type in [".xls", ".xlsx"]:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_type) as tmp_file:
-                tmp_file.write(file_content)
-                tmp_path = tmp_file.name
-            try:
-                loader = UnstructuredExcelLoader(tmp_path)
-                docs = loader.load()
-            finally:
-                os.unlink(tmp_path)
-        
-        elif file_type in [".doc", ".docx"]:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_type) as tmp_file:
-                tmp_file.write(file_content)
-                tmp_path = tmp_file.name
-            try:
-                loader = UnstructuredWordDocumentLoader(tmp_path)
-                docs = loader.load()
-            finally:
-                os.unlink(tmp_path)
-        
-        else:
-            raise ValueError(f"Unsupported file type: {file_type}")
-    
+        loader = _get_loader(file_path, file_type)
+        yield from loader.lazy_load()
     except Exception as e:
         print(f"Error processing document: {e}")
         raise HTTPException(status_code=400, detail=f"Failed to process document: {str(e)}")
-    
-    return docs
 
-@router.post("/upload_document")
+def process_document(file_path: str, file_type: str):
+    return list(load_document_pages(file_path, file_type))
+
+def _remove_if_exists(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+def _release_upload(content_hash: str):
+    orphaned = release_document_blob(content_hash)
+    if orphaned:
+        purge_document_storage(orphaned["storage_key"], orphaned["file_type"])
+
+# Multipart boundaries, part headers and form fields on top of the file
+MAX_FORM_OVERHEAD = 1024 * 1024
+
+ALLOWED_UPLOAD_TYPES = {".pdf", ".txt", ".csv", ".xls", ".xlsx", ".doc", ".docx", ".pptx", ".ppt"}
+
+# The body is parsed by receive_upload rather than by FastAPI, which would
+# spool the whole file before the handler runs; this documents the form
+UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "conversation_id": {"type": "string"}
+                    }
+                }
+            }
+        }
+    }
+}
+
+@router.post("/upload_document", openapi_extra=UPLOAD_FORM_SCHEMA)
 async def upload_document(
-    file: UploadFile = File(...),
-    conversation_id: str | None = Form(None),
+    request: Request,
     current_user: dict = Depends(require_user),
 ):
+    tmp_path = None
     try:
-        file_content = await file.read()
-        file_type = get_file_extension(file.filename)
-        
-        allowed_types = {".pdf", ".txt", ".csv", ".xls", ".xlsx", ".doc", ".docx", ".pptx", ".ppt"}
-        if file_type not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported file type. Allowed: {', '.join(allowed_types)}"
-            )
-        
-        conversation_id = ensure_conversation(conversation_id, current_user["id"])
-        
-        doc_id = str(uuid.uuid4())
-        
-        docs = process_document(file_content, file_type)
-        
-        if not docs:
-            raise HTTPException(status_code=400, detail="Document processing returned no content")
+        max_bytes = settings.MAX_UPLOAD_MB * 1024 * 1024
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes + MAX_FORM_OVERHEAD:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {settings.MAX_UPLOAD_MB} MB upload limit")
         
         documents_dir = os.path.abspath(settings.DOCUMENTS_DIR)
-        os.makedirs(documents_dir, exist_ok=True, mode=0o755)
-        
-        file_path = os.path.join(documents_dir, f"{doc_id}{file_type}")
+        await run_io(os.makedirs, documents_dir, exist_ok=True, mode=0o755)
         
         try:
-            with open(file_path, "wb") as f:
-                f.write(file_content)
-            os.chmod(file_path, 0o644)
+            fields, upload = await receive_upload(
+                request.headers.get("content-type", ""),
+                request.stream(),
+                documents_dir,
+                max_bytes,
+                settings.UPLOAD_BLOCK_SIZE,
+                allowed_types=ALLOWED_UPLOAD_TYPES
+            )
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidUpload as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except PermissionError as e:
-            import stat
             dir_stat = os.stat(documents_dir)
             raise HTTPException(
                 status_code=500,
@@ -127,23 +137,85 @@ async def upload_document(
                 status_code=500,
                 detail=f"Failed to save file: {str(e)}"
             )
+        tmp_path, content_hash, size = upload["tmp_path"], upload["content_hash"], upload["size"]
+        filename = upload["filename"]
+        file_type = get_file_extension(filename)
+        
+        conversation_id = await run_db(ensure_conversation, fields.get("conversation_id") or None, current_user["id"])
+        
+        doc_id = str(uuid.uuid4())
+        
+        # Identical files share one stored copy, one parse and one set of vectors
+        blob = await run_db(acquire_document_blob, content_hash, file_type)
+        file_path = get_document_path(content_hash, blob["file_type"])
         
-        add_uploaded_document_record(
+        if blob["created"] or not await run_io(os.path.exists, file_path):
+            try:
+                await run_io(os.replace, tmp_path, file_path)
+            except OSError as e:
+                await run_io(_release_upload, content_hash)
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to save file: {str(e)}"
+                )
+        print(f"📥 Received {filename} ({size / (1024 * 1024):.1f} MB, {content_hash[:12]})")
+        
+        await run_db(
+            add_uploaded_document_record,
             conversation_id=conversation_id,
             doc_id=doc_id,
-            name=file.filename,
+            name=filename,
             file_type=file_type,
-            user_id=current_user["id"]
+            user_id=current_user["id"],
+            status="indexing",
+            content_hash=content_hash
         )
+        invalidate_routing_cache(conversation_id)
         
-        embed_and_index_docs(docs, doc_id=doc_id, conversation_id=conversation_id)
+        job_id = None
+        if blob["created"] or blob["status"] == "failed":
+            await run_db(set_document_blob_status, content_hash, "indexing")
+            try:
+                job_id = await run_db(
+                    submit_ingestion_job,
+                    doc_id=doc_id,
+                    conversation_id=conversation_id,
+                    user_id=current_user["id"],
+                    file_path=file_path,
+                    file_type=blob["file_type"],
+                    content_hash=content_hash
+                )
+            except IngestionQueueFull as e:
+                await run_db(delete_uploaded_document_record, doc_id)
+                await run_io(_release_upload, content_hash)
+                raise HTTPException(status_code=503, detail=str(e))
+        elif blob["status"] == "indexing":
+            job_id = await run_db(get_active_ingestion_job_for_blob, content_hash)
         
-        return {
-            "message": "Document uploaded successfully",
-            "document_id": doc_id,
-            "conversation_id": conversation_id,
-            "filename": file.filename
-        }
+        if blob["status"] == "ready" and not blob["created"]:
+            print(f"♻️ Reusing stored copy of {filename} ({content_hash[:12]})")
+            submit_tenant_sync(content_hash)
+            return {
+                "message": "Document uploaded successfully",
+                "document_id": doc_id,
+                "status": "ready",
+                "deduplicated": True,
+                "conversation_id": conversation_id,
+                "filename": filename
+            }
+        
+        return JSONResponse(
+            status_code=202,
+            content={
+                "message": "Document uploaded, indexing in progress",
+                "document_id": doc_id,
+                "job_id": job_id,
+                "status": "indexing",
+                "deduplicated": not blob["created"],
+                "conversation_id": conversation_id,
+                "filename": filename
+            }
+        )
     
     except HTTPException:
         raise
@@ -152,6 +224,47 @@ async def upload_document(
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    finally:
+        if tmp_path:
+            await run_io(_remove_if_exists, tmp_path)
+
+@router.get("/documents/jobs/{job_id}")
+async def get_ingestion_job_status(job_id: str, current_user: dict = Depends(require_user)):
+    job = await run_db(get_ingestion_job, job_id)
+    # Jobs for shared documents are visible to everyone who uploaded the same file
+    if not job or (
+        job["user_id"] != current_user["id"]
+        and not await run_db(user_has_document_blob, current_user["id"], job["content_hash"])
+    ):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job["id"],
+        "document_id": job["doc_id"],
+        "conversation_id": job["conversation_id"],
+        "status": job["status"],
+        "chunks_parsed": job["chunks_parsed"],
+        "chunks_embedded": job["chunks_embedded"],
+        "chunks_indexed": job["chunks_indexed"],
+        "chunks_failed": job["chunks_failed"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+
+def _remove_document(document_id: str):
+    document = get_uploaded_document(document_id)
+    delete_uploaded_document_record(document_id)
+    
+    if document:
+        invalidate_routing_cache(document["conversation_id"])
+        if document["content_hash"]:
+            orphaned = release_document_blob(document["content_hash"])
+            if orphaned:
+                purge_document_storage(orphaned["storage_key"], orphaned["file_type"])
+            else:
+                release_document_tenant(document["content_hash"], document["user_id"])
+        else:
+            purge_document_storage(document["storage_key"], document["storage_file_type"])
 
 @router.post("/remove_document")
 async def remove_document_endpoint(
@@ -159,28 +272,7 @@ async def remove_document_endpoint(
     current_user: dict = Depends(require_user),
 ):
     try:
-        from app.services.weaviate_service import get_client
-        from weaviate.classes.query import Filter
-        
-        client = get_client()
-        if client:
-            try:
-                collection = client.collections.get("DocumentChunk")
-                collection.data.delete_many(
-                    where=Filter.by_property("doc_id").equal(document_id)
-                )
-            except Exception as e:
-                print(f"Error deleting from Weaviate: {e}")
-        
-        file_path = os.path.join(settings.DOCUMENTS_DIR, document_id)
-        for ext in [".pdf", ".txt", ".csv", ".xls", ".xlsx", ".doc", ".docx", ".pptx", ".ppt"]:
-            full_path = f"{file_path}{ext}"
-            if os.path.exists(full_path):
-                os.remove(full_path)
-                break
-        
-        delete_uploaded_document_record(document_id)
-        
+        await run_io(_remove_document, document_id)
         return {"message": "Document removed successfully", "document_id": document_id}
     
     except Exception as e:
@@ -193,10 +285,9 @@ async def list_documents(
     current_user: dict = Depends(require_user),
 ):
     try:
-        from app.database import ensure_conversation
-        ensure_conversation(conversation_id, current_user["id"])
+        await run_db(ensure_conversation, conversation_id, current_user["id"])
         
-        documents = get_uploaded_documents(conversation_id)
+        documents = await run_db(get_uploaded_documents, conversation_id)
         
         return {"documents": documents}
     
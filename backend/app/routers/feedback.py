@@ -1,32 +1,26 @@
 from fastapi import APIRouter, Form, HTTPException, Depends
 from app.utils.auth import require_user
 from app.database import get_db_connection
+from app.services.executors import run_db
+from app.services.answer_cache import evict_for_message
 import uuid
 
 router = APIRouter()
 
-@router.post("/feedback")
-async def save_feedback(
-    message_id: str = Form(...),
-    feedback_type: str = Form(...),
-    detailed_feedback: str = Form(None),
-    current_user: dict = Depends(require_user),
-):
-    if feedback_type not in ["thumbs_up", "thumbs_down"]:
-        raise HTTPException(status_code=400, detail="feedback_type must be 'thumbs_up' or 'thumbs_down'")
-    
+def _save_feedback(message_id, feedback_type, detailed_feedback, user_id):
+    """Insert or update a user's feedback on a message. Returns its id, or None if the message does not exist."""
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT conversation_id FROM messages WHERE id = ?", (message_id,))
     msg_row = cur.fetchone()
     if not msg_row:
         conn.close()
-        raise HTTPException(status_code=404, detail="Message not found")
+        return None
     conversation_id = msg_row[0]
     
     cur.execute(
         "SELECT id FROM feedback WHERE message_id = ? AND user_id = ?",
-        (message_id, current_user["id"])
+        (message_id, user_id)
     )
     existing = cur.fetchone()
     
@@ -40,24 +34,47 @@ async def save_feedback(
     else:
         cur.execute(
             "INSERT INTO feedback(id, message_id, conversation_id, user_id, feedback_type, detailed_feedback) VALUES (?, ?, ?, ?, ?, ?)",
-            (feedback_id, message_id, conversation_id, current_user["id"], feedback_type, detailed_feedback)
+            (feedback_id, message_id, conversation_id, user_id, feedback_type, detailed_feedback)
         )
     
     conn.commit()
     conn.close()
-    
-    return {"message": "Feedback saved", "feedback_id": feedback_id}
+    return feedback_id
 
-@router.get("/feedback/{message_id}")
-async def get_feedback(message_id: str, current_user: dict = Depends(require_user)):
+def _get_feedback(message_id, user_id):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute(
         "SELECT feedback_type, detailed_feedback, created_at FROM feedback WHERE message_id = ? AND user_id = ?",
-        (message_id, current_user["id"])
+        (message_id, user_id)
     )
     row = cur.fetchone()
     conn.close()
+    return row
+
+@router.post("/feedback")
+async def save_feedback(
+    message_id: str = Form(...),
+    feedback_type: str = Form(...),
+    detailed_feedback: str = Form(None),
+    current_user: dict = Depends(require_user),
+):
+    if feedback_type not in ["thumbs_up", "thumbs_down"]:
+        raise HTTPException(status_code=400, detail="feedback_type must be 'thumbs_up' or 'thumbs_down'")
+    
+    feedback_id = await run_db(_save_feedback, message_id, feedback_type, detailed_feedback, current_user["id"])
+    if feedback_id is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    
+    if feedback_type == "thumbs_down":
+        # Stop serving a disliked answer to other conversations
+        evict_for_message(message_id)
+    
+    return {"message": "Feedback saved", "feedback_id": feedback_id}
+
+@router.get("/feedback/{message_id}")
+async def get_feedback(message_id: str, current_user: dict = Depends(require_user)):
+    row = await run_db(_get_feedback, message_id, current_user["id"])
     
     if not row:
         return {"feedback": None}
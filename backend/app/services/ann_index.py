@@ -0,0 +1,150 @@
+import os
+import threading
+import numpy as np
+
+ASSIGN_BLOCK_ROWS = 16384
+
+def assign_to_centroids(vectors, centroids):
+    """Return the index of the nearest (highest dot product) centroid for each vector."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def spherical_kmeans(data, n_clusters, iterations=20, seed=0):
+    """k-means on unit vectors with cosine similarity; returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_to_centroids(data, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_clusters)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(data[order], starts[nonempty], axis=0)
+        # Re-seed empty clusters with random points
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            sums[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms > 0, norms, 1.0)
+    return centroids.astype(np.float32)
+
+class IVFIndex:
+    """Inverted-file index over the rows of a vector matrix.
+
+    Rows are partitioned among nlist k-means centroids. A query scores the
+    centroids, then only the rows filed under the nprobe closest ones, so
+    nprobe trades recall for speed. The inverted lists hold row numbers in CSR
+    form (list c is rows[offsets[c]:offsets[c+1]]); new rows go to a pending
+    buffer merged on the next search. Deletes are tombstones owned by the
+    caller and passed to search as a mask.
+    """
+
+    def __init__(self, centroids):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        self.rows = np.empty(0, dtype=np.int64)
+        self.n_rows = 0
+        self._pending_rows = []
+        self._pending_lists = []
+        self._lock = threading.Lock()
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, matrix, nlist, sample_size=None, iterations=10, seed=0):
+        """Train centroids on a sample of matrix and file every row under one."""
+        rng = np.random.default_rng(seed)
+        n = len(matrix)
+        nlist = max(1, min(nlist, n))
+        sample_size = min(n, sample_size or min(max(nlist * 16, 10000), 65536))
+        sample = np.sort(rng.choice(n, sample_size, replace=False))
+        index = cls(spherical_kmeans(matrix[sample], nlist, iterations, seed))
+        index.add(matrix, 0)
+        return index
+
+    def add(self, vectors, first_row):
+        """File vectors as rows first_row, first_row + 1, ..."""
+        if not len(vectors):
+            return
+        assignments = assign_to_centroids(vectors, self.centroids)
+        with self._lock:
+            self._pending_rows.append(np.arange(first_row, first_row + len(vectors), dtype=np.int64))
+            self._pending_lists.append(assignments)
+            self.n_rows = max(self.n_rows, first_row + len(vectors))
+
+    def _merge(self):
+        with self._lock:
+            if not self._pending_rows:
+                return
+            new_rows = np.concatenate(self._pending_rows)
+            new_lists = np.concatenate(self._pending_lists)
+            self._pending_rows, self._pending_lists = [], []
+            old_lists = np.repeat(np.arange(self.nlist, dtype=np.int32), np.diff(self.offsets))
+            lists = np.concatenate([old_lists, new_lists])
+            rows = np.concatenate([self.rows, new_rows])
+            order = np.argsort(lists, kind="stable")
+            self.rows = rows[order]
+            np.cumsum(np.bincount(lists, minlength=self.nlist), out=self.offsets[1:])
+
+    def probe(self, q, nprobe):
+        """Return the rows filed under the nprobe centroids closest to q."""
+        self._merge()
+        nprobe = max(1, min(nprobe, self.nlist))
+        centroid_scores = self.centroids @ q
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in probed])
+
+    def candidates(self, q, nprobe, mask=None):
+        """Sorted rows to score for q.
+
+        mask, if given, is a boolean array over rows; rows where it is False
+        (tombstoned or filtered out) are dropped.
+        """
+        candidates = self.probe(q, nprobe)
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        # Sorted rows turn the memmap gather into a forward scan
+        candidates.sort()
+        return candidates
+
+    def search(self, matrix, q, k, nprobe, mask=None):
+        """Approximate top-k rows of matrix by dot product with q. Returns (rows, scores) best first."""
+        candidates = self.candidates(q, nprobe, mask)
+        if not len(candidates):
+            return candidates, np.empty(0, dtype=np.float32)
+        scores = matrix[candidates] @ q
+        top = min(k, len(candidates))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return candidates[best], scores[best]
+
+    def reassign(self, matrix):
+        """Re-file every row of matrix under the existing centroids (after row numbers change)."""
+        with self._lock:
+            self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+            self.rows = np.empty(0, dtype=np.int64)
+            self._pending_rows, self._pending_lists = [], []
+            self.n_rows = 0
+        self.add(matrix, 0)
+
+    def save(self, path):
+        self._merge()
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, offsets=self.offsets, rows=self.rows, n_rows=self.n_rows)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data["centroids"])
+            index.offsets = data["offsets"]
+            index.rows = data["rows"]
+            index.n_rows = int(data["n_rows"])
+        return index
@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import numpy as np
+from app.config import settings
+
+# Answers reused across conversations for near-identical questions. An entry
+# belongs to a route ("rag" or "llm") and a document set: the sorted storage
+# keys (content hashes) of the documents in the conversation that produced it
+# for RAG answers, none for LLM answers. A lookup hits when the route and
+# document set match and the query embeddings have cosine similarity of at
+# least ANSWER_CACHE_THRESHOLD. Only standalone questions (no earlier turns
+# in the conversation) are looked up or stored, since follow-ups depend on
+# history the cache does not see. A thumbs-down on any message served from an
+# entry evicts it.
+
+CACHEABLE_ROUTES = {"rag", "llm"}
+
+_entries = OrderedDict()
+_by_message = {}
+_lock = threading.Lock()
+_stats = {"lookups": 0, "hits": 0, "stores": 0, "evicted_by_feedback": 0, "latency_saved_ms": 0}
+
+def document_set_key(route, uploaded_docs):
+    """The document set an answer on route depends on, or None when it must not be cached."""
+    if route not in CACHEABLE_ROUTES:
+        return None
+    if route == "llm":
+        return ""
+    if not uploaded_docs or any(doc.get("status") != "ready" for doc in uploaded_docs):
+        return None
+    keys = sorted({doc["storage_key"] for doc in uploaded_docs})
+    return hashlib.sha1("\n".join(keys).encode("utf-8")).hexdigest()
+
+async def embed_for_cache(query):
+    """The normalized query embedding, or None when embeddings are unavailable."""
+    from app.services import weaviate_service
+    embedder = weaviate_service.embedder
+    if not embedder:
+        return None
+    try:
+        vec = await asyncio.wait_for(embedder.aembed_query(query), settings.EMBED_QUERY_TIMEOUT)
+    except Exception as e:
+        print(f"⚠️ Answer cache could not embed query: {e}")
+        return None
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else None
+
+def _expire(now):
+    expired = [entry_id for entry_id, entry in _entries.items() if entry["expires_at"] < now]
+    for entry_id in expired:
+        _drop(entry_id)
+
+def _drop(entry_id):
+    entry = _entries.pop(entry_id, None)
+    if entry:
+        for message_id in entry["message_ids"]:
+            _by_message.pop(message_id, None)
+    return entry
+
+def lookup_answer(route, doc_set, vector):
+    """The best entry for route and doc_set at or above the similarity threshold, or None.
+
+    Returns a dict with entry_id, query, answer, references, similarity and
+    response_time_ms (how long the original answer took).
+    """
+    if not settings.ANSWER_CACHE_ENABLED or doc_set is None or vector is None:
+        return None
+    with _lock:
+        _stats["lookups"] += 1
+        _expire(time.time())
+        candidates = [
+            (entry_id, entry) for entry_id, entry in _entries.items()
+            if entry["route"] == route and entry["doc_set"] == doc_set and len(entry["vector"]) == len(vector)
+        ]
+        if not candidates:
+            return None
+        similarities = np.stack([entry["vector"] for _, entry in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < settings.ANSWER_CACHE_THRESHOLD:
+            return None
+        entry_id, entry = candidates[best]
+        _entries.move_to_end(entry_id)
+        _stats["hits"] += 1
+        return {
+            "entry_id": entry_id,
+            "query": entry["query"],
+            "answer": entry["answer"],
+            "references": entry["references"],
+            "reference_keys": entry["reference_keys"],
+            "similarity": float(similarities[best]),
+            "response_time_ms": entry["response_time_ms"]
+        }
+
+def record_hit(entry_id, message_id, latency_saved_ms):
+    """Tie a message served from entry_id to it, so feedback on the message can evict it."""
+    with _lock:
+        entry = _entries.get(entry_id)
+        if entry and message_id:
+            entry["message_ids"].add(message_id)
+            _by_message[message_id] = entry_id
+        _stats["latency_saved_ms"] += max(0, latency_saved_ms)
+
+def store_answer(route, doc_set, vector, query, answer, references, reference_keys, message_id, response_time_ms):
+    if not settings.ANSWER_CACHE_ENABLED or settings.ANSWER_CACHE_SIZE <= 0 or doc_set is None or vector is None or not answer:
+        return
+    entry_id = str(uuid.uuid4())
+    with _lock:
+        _entries[entry_id] = {
+            "route": route,
+            "doc_set": doc_set,
+            "vector": vector,
+            "query": query,
+            "answer": answer,
+            "references": references,
+            "reference_keys": reference_keys or [],
+            "response_time_ms": response_time_ms,
+            "message_ids": {message_id} if message_id else set(),
+            "expires_at": time.time() + settings.ANSWER_CACHE_TTL_SECONDS
+        }
+        if message_id:
+            _by_message[message_id] = entry_id
+        _stats["stores"] += 1
+        while len(_entries) > settings.ANSWER_CACHE_SIZE:
+            _drop(next(iter(_entries)))
+
+def evict_for_message(message_id):
+    """Drop the entry that produced or served message_id. Returns True if there was one."""
+    with _lock:
+        entry_id = _by_message.get(message_id)
+        if entry_id is None or not _drop(entry_id):
+            return False
+        _stats["evicted_by_feedback"] += 1
+    print(f"🗑️ Evicted cached answer after negative feedback on message {message_id}")
+    return True
+
+def get_answer_cache_stats():
+    with _lock:
+        lookups = _stats["lookups"]
+        return {
+            "enabled": settings.ANSWER_CACHE_ENABLED,
+            "entries": len(_entries),
+            "max_entries": settings.ANSWER_CACHE_SIZE,
+            **_stats,
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else None
+        }
+
+async def find_cached_answer(query, route, uploaded_docs, chat_history):
+    """Look the query up for route. Returns None when the request is not eligible,
+    otherwise {"vector", "hit"} where hit is the lookup_answer result or None;
+    pass it to remember_answer once the answer is saved."""
+    from app.services.context_budget import history_turn_count
+    if not settings.ANSWER_CACHE_ENABLED or route not in CACHEABLE_ROUTES:
+        return None
+    if history_turn_count(chat_history, query):
+        return None
+    doc_set = document_set_key(route, uploaded_docs)
+    if doc_set is None:
+        return None
+    vector = await embed_for_cache(query)
+    if vector is None:
+        return None
+    hit = lookup_answer(route, doc_set, vector)
+    if hit:
+        print(f"♻️ Answer cache hit ({hit['similarity']:.3f}) for {query[:60]!r} from {hit['query'][:60]!r}")
+    return {"vector": vector, "hit": hit}
+
+def cached_references(hit, uploaded_docs):
+    """The hit's references, named as in this conversation when it has the same documents under other names."""
+    keys = set(hit["reference_keys"])
+    names = []
+    for doc in uploaded_docs:
+        if doc["storage_key"] in keys and doc.get("name") not in names:
+            names.append(doc.get("name"))
+    return names[:3] or hit["references"]
+
+def remember_answer(lookup, route, uploaded_docs, query, answer, references, message_id, response_time_ms):
+    """Store a freshly generated answer, or tie a served hit to its message and record the time saved."""
+    if not lookup:
+        return
+    hit = lookup["hit"]
+    if hit:
+        record_hit(hit["entry_id"], message_id, hit["response_time_ms"] - response_time_ms)
+        return
+    names = set(references or [])
+    reference_keys = sorted({doc["storage_key"] for doc in uploaded_docs if doc.get("name") in names})
+    store_answer(
+        route,
+        document_set_key(route, uploaded_docs),
+        lookup["vector"],
+        query,
+        answer,
+        references,
+        reference_keys,
+        message_id,
+        response_time_ms
+    )
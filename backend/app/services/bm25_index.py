@@ -0,0 +1,236 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from app.config import settings
+
+# Words and identifiers such as "cs-101", "v2.3" or "part_no"; identifiers are
+# also indexed by their parts so "cs" and "101" still match.
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[-_./]")
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in
+into is it its me my of on or our so than that the their them then there these they this
+to was we were what when where which who why will with would you your
+""".split())
+
+def tokenize(text):
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if _PART_RE.search(token):
+            tokens.extend(part for part in _PART_RE.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+class BM25Index:
+    """BM25 postings for the chunks of one document.
+
+    Postings are kept in CSR form: for term id t, positions
+    offsets[t]:offsets[t+1] of `postings` and `freqs` hold the local chunk
+    positions containing t and the term frequency there. New chunks go to a
+    pending buffer and are merged into the arrays on the next query or save.
+    """
+
+    def __init__(self):
+        self.vocab = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.empty(0, dtype=np.int32)
+        self.freqs = np.empty(0, dtype=np.float32)
+        self.chunk_ids = np.empty(0, dtype=np.int32)
+        self.doc_lens = np.empty(0, dtype=np.float32)
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.chunk_ids) + len(self._pending)
+
+    def add(self, chunk_index, text):
+        self._pending.append((chunk_index, Counter(tokenize(text))))
+
+    def _compact(self):
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            start = len(self.chunk_ids)
+            new_terms, new_postings, new_freqs = [], [], []
+            for i, (_, counts) in enumerate(pending):
+                for term, tf in counts.items():
+                    term_id = self.vocab.setdefault(term, len(self.vocab))
+                    new_terms.append(term_id)
+                    new_postings.append(start + i)
+                    new_freqs.append(tf)
+
+            old_terms = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+            terms = np.concatenate([old_terms, np.asarray(new_terms, dtype=np.int64)])
+            postings = np.concatenate([self.postings, np.asarray(new_postings, dtype=np.int32)])
+            freqs = np.concatenate([self.freqs, np.asarray(new_freqs, dtype=np.float32)])
+            order = np.argsort(terms, kind="stable")
+
+            self.postings = postings[order]
+            self.freqs = freqs[order]
+            self.offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(terms, minlength=len(self.vocab)), out=self.offsets[1:])
+            self.chunk_ids = np.concatenate([
+                self.chunk_ids, np.asarray([c for c, _ in pending], dtype=np.int32)
+            ])
+            self.doc_lens = np.concatenate([
+                self.doc_lens, np.asarray([sum(c.values()) for _, c in pending], dtype=np.float32)
+            ])
+
+    def term_postings(self, term):
+        term_id = self.vocab.get(term)
+        if term_id is None:
+            return None, None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.postings[start:end], self.freqs[start:end]
+
+    def save(self, path):
+        self._compact()
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            vocab=np.frombuffer(json.dumps(terms).encode("utf-8"), dtype=np.uint8),
+            offsets=self.offsets,
+            postings=self.postings,
+            freqs=self.freqs,
+            chunk_ids=self.chunk_ids,
+            doc_lens=self.doc_lens,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            terms = json.loads(data["vocab"].tobytes().decode("utf-8"))
+            index.vocab = {term: i for i, term in enumerate(terms)}
+            index.offsets = data["offsets"]
+            index.postings = data["postings"]
+            index.freqs = data["freqs"]
+            index.chunk_ids = data["chunk_ids"]
+            index.doc_lens = data["doc_lens"]
+        return index
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def _index_path(storage_key):
+    return os.path.join(os.path.abspath(settings.BM25_INDEX_DIR), f"{storage_key}.npz")
+
+def _cache(storage_key, index):
+    with _indexes_lock:
+        _indexes[storage_key] = index
+        _indexes.move_to_end(storage_key)
+        while len(_indexes) > settings.BM25_CACHE_SIZE:
+            _indexes.popitem(last=False)
+
+def get_bm25_index(storage_key):
+    """Return the index for a document, loading it from disk or building it from the chunk store."""
+    with _indexes_lock:
+        index = _indexes.get(storage_key)
+        if index is not None:
+            _indexes.move_to_end(storage_key)
+            return index
+
+    path = _index_path(storage_key)
+    if os.path.exists(path):
+        index = BM25Index.load(path)
+    else:
+        from app.services.chunk_store import load_chunks
+        chunks = load_chunks(storage_key)
+        if not chunks:
+            return None
+        print(f"🔄 Building BM25 index for {storage_key} from {len(chunks)} stored chunks")
+        index = BM25Index()
+        for chunk in chunks:
+            index.add(chunk.metadata["chunk_index"], chunk.page_content)
+        save_bm25_index(storage_key, index)
+    _cache(storage_key, index)
+    return index
+
+def save_bm25_index(storage_key, index):
+    os.makedirs(os.path.abspath(settings.BM25_INDEX_DIR), exist_ok=True)
+    index.save(_index_path(storage_key))
+
+def index_chunks(storage_key, chunks):
+    """Pass chunks through unchanged while adding them to the document's BM25 index."""
+    index = BM25Index()
+    try:
+        for chunk in chunks:
+            index.add(chunk.metadata.get("chunk_index"), chunk.page_content)
+            yield chunk
+    finally:
+        if len(index):
+            save_bm25_index(storage_key, index)
+            _cache(storage_key, index)
+
+def delete_bm25_index(storage_key):
+    with _indexes_lock:
+        _indexes.pop(storage_key, None)
+    path = _index_path(storage_key)
+    if os.path.exists(path):
+        os.remove(path)
+
+def search_bm25(storage_keys, query, k=8, k1=1.5, b=0.75):
+    """Score the chunks of several documents as one corpus.
+
+    Returns up to k (storage_key, chunk_index, score) tuples, best first.
+    Collection statistics (N, document frequency, average length) are summed
+    across the documents so scores are comparable between them.
+    """
+    indexes = []
+    for key in storage_keys:
+        index = get_bm25_index(key)
+        if index is not None:
+            index._compact()
+            if len(index):
+                indexes.append((key, index))
+    terms = Counter(tokenize(query))
+    if not indexes or not terms:
+        return []
+
+    n_chunks = sum(len(index) for _, index in indexes)
+    avgdl = max(sum(float(index.doc_lens.sum()) for _, index in indexes) / n_chunks, 1.0)
+
+    term_postings = {}
+    for term in terms:
+        postings = [index.term_postings(term) for _, index in indexes]
+        df = sum(len(p) for p, _ in postings if p is not None)
+        if df:
+            # Non-negative BM25 idf, as used by Lucene
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            term_postings[term] = (idf, postings)
+
+    keys, chunk_ids, scores = [], [], []
+    for i, (key, index) in enumerate(indexes):
+        doc_scores = np.zeros(len(index.chunk_ids), dtype=np.float32)
+        norm = k1 * (1 - b + b * index.doc_lens / avgdl)
+        for term, (idf, postings) in term_postings.items():
+            positions, freqs = postings[i]
+            if positions is None:
+                continue
+            doc_scores[positions] += terms[term] * idf * freqs * (k1 + 1) / (freqs + norm[positions])
+        matched = np.nonzero(doc_scores)[0]
+        keys.extend([key] * len(matched))
+        chunk_ids.append(index.chunk_ids[matched])
+        scores.append(doc_scores[matched])
+
+    if not keys:
+        return []
+    chunk_ids = np.concatenate(chunk_ids)
+    scores = np.concatenate(scores)
+    top = min(k, len(scores))
+    best = np.argpartition(-scores, top - 1)[:top]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [(keys[i], int(chunk_ids[i]), float(scores[i])) for i in best]
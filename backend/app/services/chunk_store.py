@@ -0,0 +1,97 @@
+import sqlite3
+import threading
+import zstandard
+from langchain_core.documents import Document
+from app.config import settings
+
+# Chunk text is stored zstd-compressed; parsed documents compress several-fold.
+# zstd contexts are not thread-safe, so each thread gets its own.
+_zstd = threading.local()
+
+def _compressor():
+    if not hasattr(_zstd, "compressor"):
+        _zstd.compressor = zstandard.ZstdCompressor(level=3)
+    return _zstd.compressor
+
+def _decompressor():
+    if not hasattr(_zstd, "decompressor"):
+        _zstd.decompressor = zstandard.ZstdDecompressor()
+    return _zstd.decompressor
+
+WRITE_BATCH_SIZE = 200
+
+def _connect():
+    conn = sqlite3.connect(settings.DB_PATH)
+    # Let SQLite serve reads from a memory-mapped view of the database file
+    conn.execute(f"PRAGMA mmap_size = {settings.CHUNK_STORE_MMAP_BYTES}")
+    return conn
+
+def _write_rows(storage_key, rows):
+    conn = _connect()
+    conn.executemany(
+        "INSERT OR REPLACE INTO document_chunks(storage_key, chunk_index, page, text) VALUES (?, ?, ?, ?)",
+        [(storage_key, chunk_index, page, _compressor().compress(text.encode("utf-8"))) for chunk_index, page, text in rows],
+    )
+    conn.commit()
+    conn.close()
+
+def persist_chunks(storage_key, chunks):
+    """Pass chunks through unchanged while writing them to the chunk store in batches."""
+    rows = []
+    try:
+        for chunk in chunks:
+            rows.append((chunk.metadata.get("chunk_index"), chunk.metadata.get("page"), chunk.page_content))
+            if len(rows) >= WRITE_BATCH_SIZE:
+                _write_rows(storage_key, rows)
+                rows = []
+            yield chunk
+    finally:
+        if rows:
+            _write_rows(storage_key, rows)
+
+def store_chunks(storage_key, chunks):
+    """Replace the stored chunks of a document. Returns the number stored."""
+    delete_chunks(storage_key)
+    count = 0
+    for _ in persist_chunks(storage_key, chunks):
+        count += 1
+    return count
+
+def load_chunks(storage_key, chunk_indexes=None):
+    """Return stored chunks of a document as Documents ordered by chunk_index."""
+    conn = _connect()
+    if chunk_indexes is None:
+        rows = conn.execute(
+            "SELECT chunk_index, page, text FROM document_chunks WHERE storage_key = ? ORDER BY chunk_index",
+            (storage_key,),
+        ).fetchall()
+    else:
+        chunk_indexes = [int(i) for i in chunk_indexes]
+        if not chunk_indexes:
+            conn.close()
+            return []
+        placeholders = ",".join("?" * len(chunk_indexes))
+        rows = conn.execute(
+            f"SELECT chunk_index, page, text FROM document_chunks WHERE storage_key = ? AND chunk_index IN ({placeholders})",
+            (storage_key, *chunk_indexes),
+        ).fetchall()
+    conn.close()
+    return [
+        Document(
+            page_content=_decompressor().decompress(text).decode("utf-8"),
+            metadata={"chunk_index": chunk_index, "page": page}
+        )
+        for chunk_index, page, text in rows
+    ]
+
+def has_chunks(storage_key):
+    conn = _connect()
+    row = conn.execute("SELECT 1 FROM document_chunks WHERE storage_key = ? LIMIT 1", (storage_key,)).fetchone()
+    conn.close()
+    return row is not None
+
+def delete_chunks(storage_key):
+    conn = _connect()
+    conn.execute("DELETE FROM document_chunks WHERE storage_key = ?", (storage_key,))
+    conn.commit()
+    conn.close()
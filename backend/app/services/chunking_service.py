@@ -0,0 +1,89 @@
+import re
+from langchain_core.documents import Document
+from app.config import settings
+from app.utils.tokens import count_tokens, get_encoding
+
+# Paragraph breaks, line breaks and sentence ends, in order of preference
+_UNIT_BOUNDARY = re.compile(r"\n\s*\n|\n|(?<=[.!?;:])\s+")
+
+def _split_units(text):
+    """Split text into sentence-like units that keep their trailing separator."""
+    units = []
+    start = 0
+    for match in _UNIT_BOUNDARY.finditer(text):
+        end = match.end()
+        if end > start:
+            units.append(text[start:end])
+        start = end
+    if start < len(text):
+        units.append(text[start:])
+    return units
+
+def _hard_split(unit, max_tokens):
+    """Split a single unit that is longer than a whole chunk."""
+    encoding = get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(unit, disallowed_special=())
+        for start in range(0, len(tokens), max_tokens):
+            yield encoding.decode(tokens[start:start + max_tokens])
+        return
+    # Without tiktoken fall back to the same ~4 characters per token estimate as count_tokens
+    step = max(1, max_tokens * 4)
+    for start in range(0, len(unit), step):
+        yield unit[start:start + step]
+
+def split_text(text, chunk_tokens, overlap_tokens):
+    """Yield chunks of at most chunk_tokens tokens, cut at sentence boundaries
+    where possible and overlapping the previous chunk by up to overlap_tokens."""
+    window = []
+    window_tokens = 0
+    for unit in _split_units(text):
+        unit_tokens = count_tokens(unit)
+        pieces = [(unit, unit_tokens)]
+        if unit_tokens > chunk_tokens:
+            pieces = [(p, count_tokens(p)) for p in _hard_split(unit, chunk_tokens)]
+        for piece, piece_tokens in pieces:
+            if window and window_tokens + piece_tokens > chunk_tokens:
+                yield "".join(p for p, _ in window).strip()
+                # Carry the tail of the previous chunk over as overlap
+                carried = []
+                carried_tokens = 0
+                for p, t in reversed(window):
+                    if carried_tokens + t > overlap_tokens or carried_tokens + t + piece_tokens > chunk_tokens:
+                        break
+                    carried.insert(0, (p, t))
+                    carried_tokens += t
+                window = carried
+                window_tokens = carried_tokens
+            window.append((piece, piece_tokens))
+            window_tokens += piece_tokens
+    if window:
+        chunk = "".join(p for p, _ in window).strip()
+        if chunk:
+            yield chunk
+
+def iter_chunks(docs, chunk_tokens=None, overlap_tokens=None):
+    """Turn an iterable of parsed pages into a stream of overlapping chunks.
+
+    Each chunk keeps the source metadata plus chunk_index (position in the
+    whole document) and page. Pages are consumed one at a time, so passing a
+    lazy loader keeps memory bounded by a single page.
+    """
+    chunk_tokens = chunk_tokens or settings.CHUNK_TOKENS
+    overlap_tokens = settings.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+
+    chunk_index = 0
+    for doc in docs:
+        text = (doc.page_content or "").strip()
+        if not text:
+            continue
+        metadata = dict(doc.metadata or {})
+        page = metadata.get("page")
+        for chunk in split_text(text, chunk_tokens, overlap_tokens):
+            if not chunk:
+                continue
+            yield Document(
+                page_content=chunk,
+                metadata={**metadata, "chunk_index": chunk_index, "page": page}
+            )
+            chunk_index += 1
@@ -0,0 +1,175 @@
+import threading
+from collections import OrderedDict
+import httpx
+from app.config import settings
+
+# One sync and one async httpx client, shared by every Azure OpenAI chat and
+# embedding model, so requests reuse pooled keep-alive connections (and
+# HTTP/2 streams when the h2 package is installed) instead of each model
+# opening its own. Models are cached per parameter set, at most
+# CHAT_MODEL_CACHE_SIZE of them; asking for a temperature that was used
+# recently returns the same object. Request, error, HTTP/2 and new-connection
+# counts come from event hooks and httpx's "trace" request extension.
+
+http_client = None
+async_http_client = None
+_models = OrderedDict()
+_lock = threading.Lock()
+_counters = {
+    kind: {"requests": 0, "errors": 0, "http2_responses": 0, "connections_opened": 0}
+    for kind in ("sync", "async")
+}
+
+def _http2_available():
+    if not settings.HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _client_options():
+    return {
+        "http2": _http2_available(),
+        "limits": httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+        ),
+        "timeout": httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+    }
+
+def _count_response(kind, response):
+    with _lock:
+        _counters[kind]["requests"] += 1
+        if response.status_code >= 400:
+            _counters[kind]["errors"] += 1
+        if response.http_version == "HTTP/2":
+            _counters[kind]["http2_responses"] += 1
+
+def _count_trace(kind, event_name):
+    if event_name == "connection.connect_tcp.complete":
+        with _lock:
+            _counters[kind]["connections_opened"] += 1
+
+def _trace_sync_request(request):
+    request.extensions["trace"] = lambda event_name, info: _count_trace("sync", event_name)
+
+async def _trace_async(event_name, info):
+    _count_trace("async", event_name)
+
+async def _trace_async_request(request):
+    request.extensions["trace"] = _trace_async
+
+async def _count_async_response(response):
+    _count_response("async", response)
+
+def get_http_client():
+    """The shared sync httpx client, created on first use."""
+    global http_client
+    if http_client is None:
+        with _lock:
+            if http_client is None:
+                http_client = httpx.Client(
+                    event_hooks={
+                        "request": [_trace_sync_request],
+                        "response": [lambda response: _count_response("sync", response)]
+                    },
+                    **_client_options()
+                )
+    return http_client
+
+def get_async_http_client():
+    """The shared async httpx client, created on first use."""
+    global async_http_client
+    if async_http_client is None:
+        with _lock:
+            if async_http_client is None:
+                async_http_client = httpx.AsyncClient(
+                    event_hooks={"request": [_trace_async_request], "response": [_count_async_response]},
+                    **_client_options()
+                )
+    return async_http_client
+
+def _cached_model(key, build):
+    with _lock:
+        model = _models.get(key)
+        if model is not None:
+            _models.move_to_end(key)
+            return model
+    model = build()
+    with _lock:
+        # Another thread may have built the same model meanwhile; keep one
+        model = _models.setdefault(key, model)
+        _models.move_to_end(key)
+        while len(_models) > max(1, settings.CHAT_MODEL_CACHE_SIZE):
+            _models.popitem(last=False)
+    return model
+
+def get_chat_model(temperature=0.7, deployment=None, **params):
+    """An AzureChatOpenAI on the shared HTTP clients, cached per distinct set of arguments.
+
+    Extra keyword arguments (max_tokens, timeout, ...) are passed to AzureChatOpenAI.
+    """
+    from langchain_openai import AzureChatOpenAI
+    deployment = deployment or settings.AZURE_OPENAI_DEPLOYMENT_NAME
+    key = ("chat", deployment, temperature, tuple(sorted(params.items())))
+    return _cached_model(key, lambda: AzureChatOpenAI(
+        azure_deployment=deployment,
+        openai_api_key=settings.AZURE_OPENAI_API_KEY,
+        openai_api_version=settings.AZURE_OPENAI_API_VERSION,
+        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+        temperature=temperature,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+        **params
+    ))
+
+def get_embeddings_model(deployment=None):
+    """An AzureOpenAIEmbeddings on the shared HTTP clients."""
+    from langchain_openai import AzureOpenAIEmbeddings
+    deployment = deployment or settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME
+    return _cached_model(("embeddings", deployment), lambda: AzureOpenAIEmbeddings(
+        azure_deployment=deployment,
+        api_key=settings.AZURE_OPENAI_API_KEY,
+        api_version=settings.AZURE_OPENAI_API_VERSION,
+        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+        model=deployment,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client()
+    ))
+
+def init_clients():
+    get_http_client()
+    get_async_http_client()
+    protocol = "HTTP/2" if _http2_available() else "HTTP/1.1"
+    print(f"✅ Shared HTTP clients ready ({protocol}, up to {settings.HTTP_MAX_CONNECTIONS} connections)")
+
+async def close_clients():
+    global http_client, async_http_client
+    with _lock:
+        sync_client, http_client = http_client, None
+        async_client, async_http_client = async_http_client, None
+        _models.clear()
+    if sync_client:
+        sync_client.close()
+    if async_client:
+        await async_client.aclose()
+
+def _pool_stats(client, kind):
+    with _lock:
+        stats = {"open": client is not None, **_counters[kind]}
+    # Above 1 means requests are reusing pooled connections
+    opened = stats["connections_opened"]
+    stats["requests_per_connection"] = round(stats["requests"] / opened, 2) if opened else None
+    return stats
+
+def get_client_stats():
+    return {
+        "http2_enabled": _http2_available(),
+        "models": len(_models),
+        "max_models": settings.CHAT_MODEL_CACHE_SIZE,
+        "sync": _pool_stats(http_client, "sync"),
+        "async": _pool_stats(async_http_client, "async")
+    }
@@ -0,0 +1,212 @@
+from app.config import settings
+from app.services.chunking_service import _split_units, _hard_split
+from app.utils.tokens import count_tokens
+
+# Chat formatting costs a few tokens per message on top of its content, plus
+# the tokens that prime the reply (OpenAI's published estimate)
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+# Trimmed chunks end with this marker; chunks that would get less than
+# MIN_CHUNK_TOKENS are left out rather than cut to a fragment
+TRIM_MARKER = " ..."
+MIN_CHUNK_TOKENS = 32
+# Chat history entry carrying the summary of older messages (conversation_memory.py)
+SUMMARY_ROLE = "summary"
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+def prompt_token_budget():
+    """Tokens a prompt may use: PROMPT_TOKEN_BUDGET, capped by the context window minus the reply."""
+    return max(0, min(settings.PROMPT_TOKEN_BUDGET, settings.LLM_CONTEXT_TOKENS - settings.LLM_RESPONSE_TOKENS))
+
+def _count(text):
+    return count_tokens(text, settings.LLM_TOKENIZER_MODEL)
+
+def trim_to_tokens(text, max_tokens):
+    """Cut text to at most max_tokens, at the last sentence boundary that fits.
+
+    Falls back to a hard token cut when not even the first sentence fits.
+    Returns the text unchanged if it already fits, otherwise the cut text
+    followed by TRIM_MARKER.
+    """
+    if _count(text) <= max_tokens:
+        return text
+    limit = max_tokens - _count(TRIM_MARKER)
+    if limit <= 0:
+        return ""
+    kept = []
+    used = 0
+    for unit in _split_units(text):
+        unit_tokens = _count(unit)
+        if used + unit_tokens > limit:
+            break
+        kept.append(unit)
+        used += unit_tokens
+    # Token counts of the pieces do not always add up to the count of the joined text
+    trimmed = "".join(kept).rstrip()
+    while kept and _count(trimmed) > limit:
+        kept.pop()
+        trimmed = "".join(kept).rstrip()
+    if not trimmed:
+        trimmed = next(_hard_split(text, limit), "").rstrip()
+    return trimmed + TRIM_MARKER if trimmed else ""
+
+def _history_turns(chat_history, query):
+    """Group chat history into turns of ("human" | "assistant", text) messages, oldest first."""
+    turns = []
+    for msg in chat_history or []:
+        if not isinstance(msg, dict) or msg.get("role") == SUMMARY_ROLE:
+            continue
+        if "role" in msg:
+            role = "human" if msg.get("role") == "user" else "assistant"
+            if role == "human" or not turns:
+                turns.append([])
+            turns[-1].append((role, msg.get("content") or ""))
+            continue
+        turn = []
+        if msg.get("user"):
+            turn.append(("human", msg["user"]))
+        if msg.get("assistant"):
+            turn.append(("assistant", msg["assistant"]))
+        if turn:
+            turns.append(turn)
+    # The current question is stored before the history is read; it is sent
+    # as the final human message, so drop the unanswered copy
+    if turns and turns[-1] == [("human", query)]:
+        turns.pop()
+    return turns
+
+def _history_summary(chat_history):
+    for msg in chat_history or []:
+        if isinstance(msg, dict) and msg.get("role") == SUMMARY_ROLE and msg.get("content"):
+            return msg["content"]
+    return None
+
+def history_turn_count(chat_history, query):
+    """Number of earlier turns in chat_history, not counting the current question."""
+    return len(_history_turns(chat_history, query))
+
+def _fit_history(turns, budget):
+    """Keep the most recent turns that fit in budget tokens; the newest turn is trimmed rather than dropped."""
+    kept = []
+    used = 0
+    for turn in reversed(turns):
+        turn_tokens = sum(_count(text) + MESSAGE_OVERHEAD_TOKENS for _, text in turn)
+        if used + turn_tokens <= budget:
+            kept.insert(0, turn)
+            used += turn_tokens
+            continue
+        if not kept:
+            # Share what is left between the question and the answer of the newest turn
+            per_message = budget // len(turn) - MESSAGE_OVERHEAD_TOKENS
+            trimmed = [(role, trim_to_tokens(text, per_message)) for role, text in turn] if per_message >= MIN_CHUNK_TOKENS else []
+            if trimmed and all(text for _, text in trimmed):
+                kept.insert(0, trimmed)
+                used += sum(_count(text) + MESSAGE_OVERHEAD_TOKENS for _, text in trimmed)
+        break
+    return [message for turn in kept for message in turn], len(kept), used
+
+def build_prompt_context(
+    system_prompt,
+    template,
+    query,
+    chat_history=None,
+    chunks=None,
+    chunk_label="Document Chunk",
+    budget=None,
+    history_tokens=None,
+    chunk_tokens=None,
+):
+    """Fit the system prompt, chat history and context chunks into one token budget.
+
+    template is the final human message, with {context} and {query}
+    placeholders. The system prompt, template and query are always sent; of
+    what is left, a conversation summary in chat_history (see
+    conversation_memory.load_chat_memory) gets up to MEMORY_SUMMARY_TOKENS
+    and never more than a quarter, the history up to history_tokens
+    (CONTEXT_HISTORY_TOKENS, or MEMORY_WINDOW_TOKENS when there are no
+    chunks) and the chunks the rest, in the order given, each cut to
+    chunk_tokens (CONTEXT_CHUNK_TOKENS; 0 for no per-chunk limit) at a
+    sentence boundary. History never takes more than half of what is left
+    when there are chunks. chunk_label numbers the chunks
+    ("[Document Chunk 1]"); None joins them without labels. The summary is
+    sent as a system message at the start of the history.
+
+    Returns a dict with the history messages, the context string and a
+    "tokens" report of where the budget went.
+    """
+    budget = prompt_token_budget() if budget is None else budget
+    fixed = {
+        "system": _count(system_prompt) + MESSAGE_OVERHEAD_TOKENS,
+        "query": _count(template) + _count(query) + MESSAGE_OVERHEAD_TOKENS + REPLY_PRIMING_TOKENS,
+    }
+    available = max(0, budget - sum(fixed.values()))
+
+    summary_messages = []
+    summary_used = 0
+    summary = _history_summary(chat_history)
+    if summary:
+        summary_cap = min(settings.MEMORY_SUMMARY_TOKENS, available // 4) - _count(SUMMARY_PREFIX) - MESSAGE_OVERHEAD_TOKENS
+        summary = trim_to_tokens(summary, summary_cap) if summary_cap >= MIN_CHUNK_TOKENS else ""
+        if summary:
+            summary_messages = [("system", SUMMARY_PREFIX + summary)]
+            summary_used = _count(SUMMARY_PREFIX + summary) + MESSAGE_OVERHEAD_TOKENS
+            available -= summary_used
+
+    if chunks is None:
+        history_cap = min(available, settings.MEMORY_WINDOW_TOKENS if history_tokens is None else history_tokens)
+    else:
+        history_cap = min(available // 2, settings.CONTEXT_HISTORY_TOKENS if history_tokens is None else history_tokens)
+    history, history_turns, history_used = _fit_history(_history_turns(chat_history, query), history_cap)
+    available -= history_used
+
+    chunk_cap = settings.CONTEXT_CHUNK_TOKENS if chunk_tokens is None else chunk_tokens
+    separator_tokens = _count("\n\n")
+    parts = []
+    trimmed = 0
+    context_used = 0
+    for chunk in chunks or []:
+        text = (chunk or "").strip()
+        if not text:
+            continue
+        label = f"[{chunk_label} {len(parts) + 1}]\n" if chunk_label else ""
+        overhead = _count(label) + (separator_tokens if parts else 0)
+        room = available - context_used - overhead
+        if chunk_cap:
+            room = min(room, chunk_cap)
+        if room < MIN_CHUNK_TOKENS:
+            break
+        fitted = trim_to_tokens(text, room)
+        if not fitted:
+            break
+        if fitted != text:
+            trimmed += 1
+        parts.append(label + fitted)
+        context_used += overhead + _count(fitted)
+
+    tokens = {
+        "system": fixed["system"],
+        "summary": summary_used,
+        "history": history_used,
+        "context": context_used,
+        "query": fixed["query"],
+    }
+    tokens["total"] = sum(tokens.values())
+    tokens["budget"] = budget
+    return {
+        "history": summary_messages + history,
+        "context": "\n\n".join(parts),
+        "history_turns": history_turns,
+        "chunks_used": len(parts),
+        "chunks_trimmed": trimmed,
+        "tokens": tokens,
+    }
+
+def describe_usage(prompt):
+    """One-line summary of a build_prompt_context result for the logs."""
+    tokens = prompt["tokens"]
+    return (
+        f"{tokens['total']}/{tokens['budget']} prompt tokens "
+        f"(system {tokens['system']}, summary {tokens['summary']}, history {tokens['history']} in {prompt['history_turns']} turns, "
+        f"context {tokens['context']} in {prompt['chunks_used']} chunks, {prompt['chunks_trimmed']} trimmed, "
+        f"query {tokens['query']})"
+    )
@@ -0,0 +1,126 @@
+import asyncio
+from app.config import settings
+from app.database import get_conversation_summary, set_conversation_summary, get_messages_after
+from app.services.context_budget import SUMMARY_ROLE, trim_to_tokens, _count
+from app.services.executors import run_db
+
+# Chat memory: a rolling summary of a conversation's older messages, stored
+# in conversation_summaries, plus the messages after it. Once more than
+# MEMORY_WINDOW_TURNS + MEMORY_SUMMARY_EVERY_TURNS turns are unsummarized, a
+# background refresh folds all but the newest MEMORY_WINDOW_TURNS into the
+# summary, so requests only ever load a bounded tail of the conversation.
+
+# Each message is cut to this many tokens before summarizing, and one
+# summarization call takes at most SUMMARY_INPUT_TOKENS of messages
+SUMMARY_MESSAGE_TOKENS = 400
+SUMMARY_INPUT_TOKENS = 4000
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a conversation between a user and an assistant. Merge the new messages into the existing summary.
+
+Keep facts, names, numbers, decisions, the user's goals and preferences, the documents discussed and open questions. Drop greetings and small talk. Write plain text in the third person ("The user asked ..."), at most {max_words} words."""
+
+SUMMARY_HUMAN_TEMPLATE = """Existing summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+# Conversations being summarized, and the tasks doing it
+_refreshing = set()
+_refresh_tasks = set()
+
+def _tail_messages():
+    # The window, the turns waiting for the next refresh and the current question
+    return 2 * (settings.MEMORY_WINDOW_TURNS + settings.MEMORY_SUMMARY_EVERY_TURNS) + 1
+
+def load_chat_memory(conversation_id):
+    """Chat history for the prompt builders: the summary of older messages as a
+    {"role": "summary"} entry (when there is one), then the recent messages as
+    {"role", "content"} dicts, oldest first."""
+    if not settings.MEMORY_ENABLED:
+        return get_messages_after(conversation_id, 0)
+    summary = get_conversation_summary(conversation_id)
+    after = summary["summarized_seq"] if summary else 0
+    messages = get_messages_after(conversation_id, after, limit=_tail_messages())
+    if summary and summary["summary"]:
+        return [{"role": SUMMARY_ROLE, "content": summary["summary"]}] + messages
+    return messages
+
+def _batches(messages):
+    batch = []
+    used = 0
+    for msg in messages:
+        tokens = min(_count(msg["content"]), SUMMARY_MESSAGE_TOKENS)
+        if batch and used + tokens > SUMMARY_INPUT_TOKENS:
+            yield batch
+            batch, used = [], 0
+        batch.append(msg)
+        used += tokens
+    if batch:
+        yield batch
+
+async def _summarize(llm, summary, messages):
+    from langchain_core.prompts import ChatPromptTemplate
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SUMMARY_SYSTEM_PROMPT),
+        ("human", SUMMARY_HUMAN_TEMPLATE)
+    ])
+    transcript = "\n".join(
+        f"{'User' if msg['role'] == 'user' else 'Assistant'}: {trim_to_tokens(msg['content'], SUMMARY_MESSAGE_TOKENS)}"
+        for msg in messages
+    )
+    response = await (prompt | llm).ainvoke({
+        "max_words": int(settings.MEMORY_SUMMARY_TOKENS * 0.75),
+        "summary": summary or "(none yet)",
+        "messages": transcript
+    })
+    text = (response.content if hasattr(response, "content") else str(response)).strip()
+    return trim_to_tokens(text, settings.MEMORY_SUMMARY_TOKENS)
+
+async def refresh_summary(conversation_id):
+    """Fold the messages older than the recent window into the summary, if enough have piled up.
+
+    Returns True when the summary was updated.
+    """
+    from app.services.clients import get_chat_model
+    summary = await run_db(get_conversation_summary, conversation_id)
+    text = summary["summary"] if summary else ""
+    summarized_seq = summary["summarized_seq"] if summary else 0
+    messages = await run_db(get_messages_after, conversation_id, summarized_seq)
+    if len(messages) <= 2 * (settings.MEMORY_WINDOW_TURNS + settings.MEMORY_SUMMARY_EVERY_TURNS):
+        return False
+    older = messages[:-2 * settings.MEMORY_WINDOW_TURNS] if settings.MEMORY_WINDOW_TURNS else messages
+    # The window starts with a question; keep an unanswered one with its answer
+    while older and older[-1]["role"] == "user":
+        older.pop()
+    if not older:
+        return False
+    llm = get_chat_model(temperature=0)
+    for batch in _batches(older):
+        text = await _summarize(llm, text, batch)
+        # The conversation may have been cleared while the model was summarizing
+        if not await run_db(set_conversation_summary, conversation_id, text, batch[-1]["seq"], summarized_seq):
+            print(f"📝 Dropped summary of conversation {conversation_id}: its history changed meanwhile")
+            return False
+        summarized_seq = batch[-1]["seq"]
+    print(f"📝 Summarized {len(older)} messages of conversation {conversation_id} ({_count(text)} tokens)")
+    return True
+
+async def _refresh(conversation_id):
+    try:
+        await refresh_summary(conversation_id)
+    except Exception as e:
+        print(f"⚠️ Failed to refresh summary of conversation {conversation_id}: {e}")
+    finally:
+        _refreshing.discard(conversation_id)
+
+def schedule_summary_refresh(conversation_id):
+    """Refresh the conversation's summary in the background, unless a refresh is already running."""
+    if not settings.MEMORY_ENABLED or not conversation_id or conversation_id in _refreshing:
+        return
+    _refreshing.add(conversation_id)
+    task = asyncio.create_task(_refresh(conversation_id))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
@@ -0,0 +1,49 @@
+import hashlib
+import re
+import numpy as np
+
+def content_hash(text):
+    """Hash of a chunk's text with case and whitespace normalized, so repeated headers and
+    the same paragraph taken from overlapping pages collide."""
+    normalized = re.sub(r"\s+", " ", text).strip().lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def maximal_marginal_relevance(query_vector, candidate_vectors, k, lambda_mult=0.7, relevance=None):
+    """Pick k candidates balancing relevance against similarity to the ones already picked.
+
+    Each step takes argmax(lambda * relevance - (1 - lambda) * max similarity
+    to the selection). relevance defaults to the cosine similarity with the
+    query. lambda_mult 1.0 is plain relevance order; lower values favour
+    diversity. Returns candidate indices in selection order.
+    """
+    vectors = np.asarray(candidate_vectors, dtype=np.float32)
+    n = len(vectors)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1.0)
+    if relevance is None:
+        q = np.asarray(query_vector, dtype=np.float32)
+        relevance = vectors @ (q / (np.linalg.norm(q) or 1.0))
+    relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+def rank_relevance(n, low, high):
+    """Relevance for n candidates in ranked order, spread linearly from high down to low."""
+    if n <= 1:
+        return np.full(n, high, dtype=np.float32)
+    return np.linspace(high, low, n, dtype=np.float32)
@@ -18,3 +18,166 @@ def get_document(doc_id):
 def get_all_documents():
     return uploaded_docs
 
+
+def get_document_path(storage_key, file_type):
+    from app.config import settings
+    import os
+    return os.path.join(os.path.abspath(settings.DOCUMENTS_DIR), f"{storage_key}{file_type}")
+
+def purge_document_storage(storage_key, file_type):
+    """Delete the stored file and vectors of a document nobody references anymore."""
+    from app.services.weaviate_service import get_vector_store
+    from app.services.chunk_store import delete_chunks
+    from app.services.bm25_index import delete_bm25_index
+    from app.database import delete_document_centroid
+    import os
+    
+    store = get_vector_store()
+    if store:
+        try:
+            store.delete(storage_key)
+        except Exception as e:
+            print(f"Error deleting from {store.name} vector store: {e}")
+    
+    delete_chunks(storage_key)
+    delete_bm25_index(storage_key)
+    delete_document_centroid(storage_key)
+    
+    file_path = get_document_path(storage_key, file_type)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    print(f"🗑️ Purged stored data for document {storage_key}")
+
+class UploadTooLarge(Exception):
+    pass
+
+class InvalidUpload(Exception):
+    pass
+
+# Largest non-file form field accepted alongside an upload
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+async def receive_upload(content_type, body, directory, max_bytes, block_size, allowed_types=None, file_field="file"):
+    """Parse a multipart/form-data body as it arrives, writing the file part to a temporary file in directory.
+    
+    body is an async iterator of the raw request body (request.stream()), so
+    nothing is spooled first: the file exists once on disk, is hashed on the
+    way, and UploadTooLarge is raised as soon as it passes max_bytes. Writes
+    go out in blocks of block_size. Raises InvalidUpload for a malformed form,
+    a missing file or a file type outside allowed_types. Returns (fields,
+    upload): the other form values, and {"filename", "tmp_path",
+    "content_hash", "size"}.
+    """
+    from python_multipart.multipart import MultipartParser, parse_options_header
+    from python_multipart.exceptions import MultipartParseError
+    from app.services.executors import run_io
+    import hashlib
+    import os
+    import uuid
+    
+    mime_type, params = parse_options_header(content_type)
+    if mime_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise InvalidUpload("Expected a multipart/form-data upload")
+    
+    # The parser's callbacks only queue events; they are handled between writes
+    events = []
+    header = {"field": b"", "value": b""}
+    headers = {}
+    
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+    
+    def on_header_end():
+        headers[header["field"].lower()] = header["value"]
+        header["field"] = header["value"] = b""
+    
+    def on_headers_finished():
+        events.append(("part", dict(headers)))
+        headers.clear()
+    
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", bytes(data[start:end]))),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+    
+    fields = {}
+    upload = None
+    part = None
+    hasher = hashlib.sha256()
+    f = None
+    pending = bytearray()
+    
+    async def handle(kind, payload):
+        nonlocal upload, part, f, pending
+        if kind == "part":
+            _, disposition = parse_options_header(payload.get(b"content-disposition"))
+            name = disposition.get(b"name", b"").decode("utf-8", "replace")
+            filename = disposition.get(b"filename")
+            if name == file_field and filename is not None:
+                if upload is not None:
+                    raise InvalidUpload("Only one file can be uploaded at a time")
+                filename = os.path.basename(filename.decode("utf-8", "replace"))
+                file_type = os.path.splitext(filename)[1].lower()
+                if allowed_types is not None and file_type not in allowed_types:
+                    raise InvalidUpload(f"Unsupported file type. Allowed: {', '.join(allowed_types)}")
+                upload = {"filename": filename, "tmp_path": os.path.join(directory, f".upload-{uuid.uuid4()}.part"), "size": 0}
+                f = await run_io(open, upload["tmp_path"], "wb")
+                part = None
+            else:
+                part = [name, bytearray()]
+        elif kind == "data":
+            if part is not None:
+                part[1] += payload
+                if len(part[1]) > MAX_FORM_FIELD_BYTES:
+                    raise InvalidUpload(f"Form field {part[0]!r} is too large")
+                return
+            if f is None:
+                return
+            upload["size"] += len(payload)
+            if upload["size"] > max_bytes:
+                raise UploadTooLarge(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+            hasher.update(payload)
+            pending += payload
+            if len(pending) >= block_size:
+                block, pending = bytes(pending), bytearray()
+                await run_io(f.write, block)
+        elif part is not None:
+            fields[part[0]] = part[1].decode("utf-8", "replace")
+            part = None
+        elif f is not None:
+            if pending:
+                await run_io(f.write, bytes(pending))
+                pending = bytearray()
+            await run_io(f.close)
+            f = None
+    
+    try:
+        try:
+            async for chunk in body:
+                parser.write(chunk)
+                for event in events:
+                    await handle(*event)
+                events.clear()
+            parser.finalize()
+            for event in events:
+                await handle(*event)
+        except MultipartParseError as e:
+            raise InvalidUpload(f"Malformed upload: {e}") from e
+        if upload is None or f is not None:
+            raise InvalidUpload("No complete file in the upload")
+        os.chmod(upload["tmp_path"], 0o644)
+    except BaseException:
+        if f is not None:
+            f.close()
+        if upload and os.path.exists(upload["tmp_path"]):
+            os.remove(upload["tmp_path"])
+        raise
+    upload["content_hash"] = hasher.hexdigest()
+    return fields, upload
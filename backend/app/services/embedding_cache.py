@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from app.config import settings
+
+embedding_cache = None
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+# Disk hits and memory hits only record their access time here; the times are
+# written to SQLite in batches of this many, and before every disk eviction
+TOUCH_FLUSH_SIZE = 256
+
+class EmbeddingCache:
+    """Two-level embedding cache: an in-memory LRU in front of a SQLite table.
+
+    Vectors are stored as float32 blobs keyed by a hash of the embedding
+    deployment and the normalized text. Both levels are bounded in bytes and
+    evict the least recently used vectors first. The memory level has its own
+    lock, never held during SQLite calls, so get_memory and remember_many are
+    safe to call from the event loop; the other methods touch the disk.
+    """
+
+    def __init__(self, path, memory_max_bytes, disk_max_bytes):
+        self.path = path
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._touched = {}
+        self._memory_lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM embeddings").fetchone()
+        self._disk_bytes, self._disk_count = row
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(deployment: str, text: str) -> str:
+        return hashlib.sha256(f"{deployment}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+        while self._memory_bytes > self.memory_max_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def get_memory(self, keys):
+        """Return a list of float32 vectors (or None where not in memory) in key order, without touching the disk."""
+        results = [None] * len(keys)
+        now = time.time()
+        with self._memory_lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self._touched[key] = now
+                    results[i] = vector
+                    self.stats["memory_hits"] += 1
+        return results
+
+    def get_disk(self, keys):
+        """Look keys up in SQLite and return {key: vector} for those found; they are also kept in memory."""
+        found = {}
+        lookup_keys = list(dict.fromkeys(keys))
+        with self._disk_lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(lookup_keys), 500):
+                batch = lookup_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        now = time.time()
+        with self._memory_lock:
+            for key, vector in found.items():
+                self._remember(key, vector)
+                self._touched[key] = now
+            self.stats["disk_hits"] += sum(1 for key in keys if key in found)
+            self.stats["misses"] += sum(1 for key in keys if key not in found)
+            flush = len(self._touched) >= TOUCH_FLUSH_SIZE
+        if flush:
+            self.flush_touches()
+        return found
+
+    def get_many(self, keys):
+        """Return a list of float32 vectors (or None for misses) in key order."""
+        results = self.get_memory(keys)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            found = self.get_disk([keys[i] for i in missing])
+            for i in missing:
+                results[i] = found.get(keys[i])
+        return results
+
+    def remember_many(self, keys, vectors):
+        """Keep vectors in the memory level only; store_many writes them to disk."""
+        with self._memory_lock:
+            for key, vec in zip(keys, vectors):
+                self._remember(key, np.asarray(vec, dtype=np.float32))
+
+    def store_many(self, keys, vectors):
+        now = time.time()
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes(), now) for key, vec in zip(keys, vectors)]
+        if not rows:
+            return
+        self.flush_touches()
+        with self._disk_lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings(key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            inserted = self._conn.total_changes - before
+            if inserted:
+                self._disk_count += inserted
+                self._disk_bytes += inserted * len(rows[0][1])
+            self._conn.commit()
+            self._evict_disk()
+
+    def put_many(self, keys, vectors):
+        self.remember_many(keys, vectors)
+        self.store_many(keys, vectors)
+
+    def flush_touches(self):
+        """Write the access times recorded since the last flush."""
+        with self._memory_lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        with self._disk_lock:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?", [(t, key) for key, t in touched.items()]
+            )
+            self._conn.commit()
+
+    def _evict_disk(self):
+        if self._disk_bytes <= self.disk_max_bytes or not self._disk_count:
+            return
+        avg_size = self._disk_bytes / self._disk_count
+        # Evict down to 90% of the limit so we don't evict on every insert
+        excess = self._disk_bytes - int(self.disk_max_bytes * 0.9)
+        count = max(1, int(excess / avg_size) + 1)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (count,),
+        )
+        self._conn.commit()
+        self._disk_bytes, self._disk_count = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM embeddings"
+        ).fetchone()
+        self.stats["evictions"] += count
+
+    def get_stats(self):
+        with self._memory_lock:
+            lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            return {
+                **self.stats,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": self._disk_count,
+                "disk_bytes": self._disk_bytes,
+            }
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an EmbeddingCache.
+
+    The async methods check the memory level on the event loop and do the
+    disk lookup in the db pool; new vectors are written back to disk there in
+    the background.
+    """
+
+    def __init__(self, embedder, cache, deployment):
+        self.embedder = embedder
+        self.cache = cache
+        self.deployment = deployment
+        # Query embeddings being fetched, so concurrent callers (router, answer
+        # cache, retrieval) share one request
+        self._inflight = {}
+
+    def _keys(self, texts):
+        texts = [normalize_text(t) for t in texts]
+        return texts, [EmbeddingCache.make_key(self.deployment, t) for t in texts]
+
+    def _split(self, texts):
+        texts, keys = self._keys(texts)
+        cached = self.cache.get_many(keys)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        return texts, keys, cached, missing
+
+    async def _asplit(self, texts):
+        from app.services.executors import run_db
+        texts, keys = self._keys(texts)
+        cached = self.cache.get_memory(keys)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            found = await run_db(self.cache.get_disk, [keys[i] for i in missing])
+            for i in missing:
+                cached[i] = found.get(keys[i])
+            missing = [i for i in missing if cached[i] is None]
+        return texts, keys, cached, missing
+
+    @staticmethod
+    def _fill(cached, missing, new_vectors):
+        for i, vec in zip(missing, new_vectors):
+            cached[i] = vec
+        return [v.tolist() if isinstance(v, np.ndarray) else list(v) for v in cached]
+
+    def _merge(self, keys, cached, missing, new_vectors):
+        self.cache.put_many([keys[i] for i in missing], new_vectors)
+        return self._fill(cached, missing, new_vectors)
+
+    def _amerge(self, keys, cached, missing, new_vectors):
+        if missing:
+            from app.services.executors import get_pool
+            missing_keys = [keys[i] for i in missing]
+            self.cache.remember_many(missing_keys, new_vectors)
+            get_pool("db").submit(self._write_back, missing_keys, new_vectors)
+        return self._fill(cached, missing, new_vectors)
+
+    def _write_back(self, keys, vectors):
+        try:
+            self.cache.store_many(keys, vectors)
+        except Exception as e:
+            print(f"⚠️ Failed to write {len(keys)} embeddings to the cache: {e}")
+
+    def embed_documents(self, texts):
+        texts, keys, cached, missing = self._split(texts)
+        new_vectors = self.embedder.embed_documents([texts[i] for i in missing]) if missing else []
+        return self._merge(keys, cached, missing, new_vectors)
+
+    def embed_query(self, text):
+        texts, keys, cached, missing = self._split([text])
+        new_vectors = [self.embedder.embed_query(texts[0])] if missing else []
+        return self._merge(keys, cached, missing, new_vectors)[0]
+
+    async def aembed_documents(self, texts):
+        texts, keys, cached, missing = await self._asplit(texts)
+        new_vectors = await self.embedder.aembed_documents([texts[i] for i in missing]) if missing else []
+        return self._amerge(keys, cached, missing, new_vectors)
+
+    async def aembed_query(self, text):
+        texts, keys, cached, missing = await self._asplit([text])
+        if not missing:
+            return self._fill(cached, missing, [])[0]
+        key = keys[0]
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = self._inflight[key] = asyncio.ensure_future(self.embedder.aembed_query(texts[0]))
+            pending.add_done_callback(lambda f: self._request_done(key, f))
+        # A cancelled caller must not cancel the request the others are waiting on
+        vec = await asyncio.shield(pending)
+        return self._amerge(keys, cached, missing, [vec])[0]
+
+    def _request_done(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # Mark a failure as seen when every caller has gone away
+            future.exception()
+
+def get_embedding_cache():
+    global embedding_cache
+    if embedding_cache is None:
+        os.makedirs(os.path.dirname(os.path.abspath(settings.EMBED_CACHE_PATH)), exist_ok=True)
+        embedding_cache = EmbeddingCache(
+            settings.EMBED_CACHE_PATH,
+            memory_max_bytes=settings.EMBED_CACHE_MEMORY_MB * 1024 * 1024,
+            disk_max_bytes=settings.EMBED_CACHE_DISK_MB * 1024 * 1024,
+        )
+    return embedding_cache
+
+def get_embedding_cache_stats():
+    if embedding_cache is None:
+        return None
+    return embedding_cache.get_stats()
+
+def flush_embedding_cache():
+    """Write the cache's pending access times; call on shutdown."""
+    if embedding_cache is not None:
+        embedding_cache.flush_touches()
@@ -0,0 +1,249 @@
+import asyncio
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, InvalidStateError
+from app.config import settings
+
+# Blocking work started from async handlers runs in one of three shared pools:
+#   io  - file system and blocking network SDK calls
+#   db  - sqlite queries
+#   cpu - CPU-heavy parsing, in worker processes so it does not hold the GIL
+# A pool's worker count is its concurrency limit; calls beyond it wait in the
+# pool's queue, whose depth and wait times are reported by get_executor_stats.
+
+_pools = {}
+_pools_lock = threading.Lock()
+_manager = None
+_loop_lag = {"samples": 0, "stalls": 0, "last_ms": 0.0, "max_ms": 0.0, "threshold_ms": 0.0}
+
+def _timed_call(fn, args, kwargs):
+    # Module level so process pools can pickle it; returns when the call started
+    return time.time(), fn(*args, **kwargs)
+
+class WorkerPool:
+    """A fixed-size thread or process pool with queue-depth and wait-time counters."""
+
+    def __init__(self, name, workers, processes=False):
+        self.name = name
+        self.workers = workers
+        self.processes = processes
+        if processes:
+            # spawn, not fork: the parent has live threads and sockets
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_queued = max(self.max_queued, self.in_flight - self.workers)
+
+    def _exit(self, submitted_at, started_at):
+        with self._lock:
+            self.in_flight -= 1
+            if started_at is None:
+                self.failed += 1
+                return
+            self.completed += 1
+            wait = max(0.0, started_at - submitted_at)
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def submit(self, fn, *args, **kwargs):
+        """Submit fn and return a concurrent.futures.Future of its result."""
+        from concurrent.futures import Future
+        submitted_at = time.time()
+        self._enter()
+        inner = self.executor.submit(_timed_call, fn, args, kwargs)
+        outer = Future()
+
+        def done(f):
+            if f.cancelled():
+                self._exit(submitted_at, None)
+                outer.cancel()
+                return
+            error = f.exception()
+            if error is None:
+                started_at, result = f.result()
+                self._exit(submitted_at, started_at)
+            else:
+                self._exit(submitted_at, None)
+            try:
+                if error is None:
+                    outer.set_result(result)
+                else:
+                    outer.set_exception(error)
+            except InvalidStateError:
+                # The caller gave up while the call was running
+                pass
+        inner.add_done_callback(done)
+        # Cancelling the outer future drops the call if it has not started yet
+        outer.add_done_callback(lambda f: f.cancelled() and inner.cancel())
+        return outer
+
+    async def run(self, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) in the pool. Cancelling the caller drops a call still queued."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def iterate(self, gen_fn, *args, batch_size=64, max_batches=8):
+        """Run the generator function gen_fn(*args) in the pool and yield its items here.
+
+        Items cross in batches of batch_size with at most max_batches in
+        transit, so a slow consumer holds back the producer. Exceptions raised
+        by gen_fn are re-raised in the consumer; closing the generator early
+        stops the producer.
+        """
+        if not self.processes:
+            yield from gen_fn(*args)
+            return
+        manager = _get_manager()
+        items = manager.Queue(max_batches)
+        stop = manager.Event()
+        future = self.submit(_produce, items, stop, gen_fn, args, batch_size)
+        finished = False
+        try:
+            while True:
+                try:
+                    kind, payload = items.get(timeout=1.0)
+                except queue.Empty:
+                    if future.done():
+                        future.result()
+                        raise RuntimeError(f"{self.name} pool worker exited without finishing")
+                    continue
+                if kind == "items":
+                    yield from payload
+                elif kind == "error":
+                    raise payload
+                else:
+                    finished = True
+                    break
+            future.result()
+        finally:
+            if not finished:
+                stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "kind": "process" if self.processes else "thread",
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(1000 * self.total_wait / self.completed, 2) if self.completed else 0.0,
+                "max_wait_ms": round(1000 * self.max_wait, 2)
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def _produce(items, stop, gen_fn, args, batch_size):
+    """Process-side half of WorkerPool.iterate."""
+    def put(message):
+        while not stop.is_set():
+            try:
+                items.put(message, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    batch = []
+    try:
+        for item in gen_fn(*args):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                if not put(("items", batch)):
+                    return
+                batch = []
+    except Exception as e:
+        put(("items", batch))
+        put(("error", e))
+        return
+    put(("items", batch))
+    put(("done", None))
+
+def _get_manager():
+    global _manager
+    with _pools_lock:
+        if _manager is None:
+            _manager = multiprocessing.get_context("spawn").Manager()
+        return _manager
+
+def _pool_sizes():
+    return {
+        "io": (settings.IO_POOL_WORKERS, False),
+        "db": (settings.DB_POOL_WORKERS, False),
+        # CPU_POOL_WORKERS=0 runs CPU work on an io thread instead of in processes
+        "cpu": (settings.CPU_POOL_WORKERS, True) if settings.CPU_POOL_WORKERS > 0 else (settings.IO_POOL_WORKERS, False),
+    }
+
+def get_pool(name):
+    """Return the shared pool called name ("io", "db" or "cpu"), starting it on first use."""
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                workers, processes = _pool_sizes()[name]
+                pool = _pools[name] = WorkerPool(name, workers, processes)
+    return pool
+
+def on_pool_thread(name):
+    """True when called from a worker thread of the shared pool called name."""
+    return threading.current_thread().name.startswith(f"{name}-pool")
+
+async def run_io(fn, *args, **kwargs):
+    return await get_pool("io").run(fn, *args, **kwargs)
+
+async def run_db(fn, *args, **kwargs):
+    return await get_pool("db").run(fn, *args, **kwargs)
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run fn in a worker process; fn and its arguments must be picklable."""
+    return await get_pool("cpu").run(fn, *args, **kwargs)
+
+def shutdown_executors():
+    global _manager
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        manager, _manager = _manager, None
+    for pool in pools:
+        pool.shutdown()
+    if manager:
+        manager.shutdown()
+
+async def monitor_loop_lag(interval_seconds=None, threshold_ms=None):
+    """Sleep in a loop and report whenever the event loop wakes up late by more than threshold_ms."""
+    interval = settings.LOOP_LAG_INTERVAL_SECONDS if interval_seconds is None else interval_seconds
+    threshold = settings.LOOP_LAG_THRESHOLD_MS if threshold_ms is None else threshold_ms
+    _loop_lag["threshold_ms"] = threshold
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag_ms = max(0.0, (loop.time() - start - interval) * 1000)
+        _loop_lag["samples"] += 1
+        _loop_lag["last_ms"] = round(lag_ms, 1)
+        _loop_lag["max_ms"] = round(max(_loop_lag["max_ms"], lag_ms), 1)
+        if lag_ms > threshold:
+            _loop_lag["stalls"] += 1
+            print(f"🐢 Event loop stalled for {lag_ms:.0f} ms (threshold {threshold:.0f} ms)")
+
+def get_executor_stats():
+    return {
+        "pools": {name: pool.stats() for name, pool in list(_pools.items())},
+        "loop_lag": dict(_loop_lag)
+    }
@@ -0,0 +1,207 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.services.chunk_store import persist_chunks, delete_chunks
+from app.services.bm25_index import index_chunks
+from app.services.query_router import invalidate_routing_cache
+from app.database import (
+    create_ingestion_job,
+    update_ingestion_job,
+    get_ingestion_job,
+    get_unfinished_ingestion_jobs,
+    get_uploaded_document,
+    set_uploaded_document_status,
+    get_document_blob,
+    set_document_blob_status,
+    set_document_centroid
+)
+
+executor = None
+_pending_jobs = 0
+_pending_lock = threading.Lock()
+
+class IngestionQueueFull(Exception):
+    pass
+
+class DocumentParseError(Exception):
+    pass
+
+def init_ingestion_workers():
+    """Start the worker pool and resume jobs left unfinished by a previous process."""
+    global executor
+    executor = ThreadPoolExecutor(
+        max_workers=settings.INGEST_WORKERS,
+        thread_name_prefix="ingest"
+    )
+    unfinished = get_unfinished_ingestion_jobs()
+    if unfinished:
+        print(f"🔄 Resuming {len(unfinished)} unfinished ingestion job(s)")
+    for job in unfinished:
+        _schedule(job["id"])
+
+def shutdown_ingestion_workers():
+    if executor:
+        # Queued and running jobs stay 'queued'/'running' in the database and resume on next start
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def submit_ingestion_job(doc_id, conversation_id, user_id, file_path, file_type, content_hash=None):
+    """Persist an ingestion job and hand it to the worker pool. Returns the job id."""
+    with _pending_lock:
+        if _pending_jobs >= settings.INGEST_MAX_QUEUE:
+            raise IngestionQueueFull(f"Ingestion queue is full ({settings.INGEST_MAX_QUEUE} jobs pending)")
+    job_id = create_ingestion_job(doc_id, conversation_id, user_id, file_path, file_type, content_hash)
+    _schedule(job_id)
+    return job_id
+
+def submit_tenant_sync(storage_key, user_id=None):
+    """Copy an already indexed document into the tenants of users who lack it, in the background."""
+    executor.submit(_sync_tenants, storage_key, user_id)
+
+def _sync_tenants(storage_key, released_user_id=None):
+    from app.services.weaviate_service import sync_document_tenants, release_document_tenant
+    try:
+        sync_document_tenants(storage_key)
+        if released_user_id is not None:
+            release_document_tenant(storage_key, released_user_id)
+    except Exception as e:
+        print(f"⚠️ Tenant sync for {storage_key[:12]} failed: {e}")
+
+def _schedule(job_id):
+    global _pending_jobs
+    with _pending_lock:
+        _pending_jobs += 1
+    executor.submit(_run_and_release, job_id)
+
+def _run_and_release(job_id):
+    global _pending_jobs
+    try:
+        run_ingestion_job(job_id)
+    finally:
+        with _pending_lock:
+            _pending_jobs -= 1
+
+def _iter_document_chunks(file_path, file_type):
+    """Parse and chunk a stored file; runs in a cpu pool worker process."""
+    from fastapi import HTTPException
+    from app.routers.documents import load_document_pages
+    from app.services.chunking_service import iter_chunks
+
+    try:
+        yield from iter_chunks(load_document_pages(file_path, file_type))
+    except Exception as e:
+        # Plain exceptions pickle reliably back to the parent process
+        raise DocumentParseError(e.detail if isinstance(e, HTTPException) else str(e)) from None
+
+def _parse_chunks(file_path, file_type, parsed):
+    """Stream chunks of a stored file, counting them and tagging parse failures."""
+    from app.services.executors import get_pool
+
+    try:
+        for chunk in get_pool("cpu").iterate(_iter_document_chunks, file_path, file_type):
+            parsed["count"] += 1
+            yield chunk
+    except DocumentParseError:
+        raise
+    except Exception as e:
+        raise DocumentParseError(str(e)) from e
+
+def run_ingestion_job(job_id):
+    from app.services.weaviate_service import embed_and_index_docs
+    from app.services.vector_store import tenant_for_user
+
+    job = get_ingestion_job(job_id)
+    if not job:
+        print(f"⚠️ Ingestion job {job_id} not found")
+        return
+    doc_id = job["doc_id"]
+    content_hash = job["content_hash"]
+
+    # Content-addressed documents are indexed once under their hash and shared
+    # by every uploaded_documents row that references it
+    if content_hash:
+        storage_key = content_hash
+        still_referenced = get_document_blob(content_hash) is not None
+    else:
+        storage_key = doc_id
+        still_referenced = get_uploaded_document(doc_id) is not None
+
+    def set_status(status):
+        if content_hash:
+            set_document_blob_status(content_hash, status)
+        else:
+            set_uploaded_document_status(doc_id, status)
+
+    if not still_referenced:
+        print(f"⚠️ Document {storage_key} was removed before ingestion job {job_id} ran")
+        update_ingestion_job(job_id, status="failed", error="Document was removed")
+        return
+
+    update_ingestion_job(job_id, status="running", error=None)
+
+    def report_progress(embedded=None, indexed=None, failed=None):
+        fields = {}
+        if embedded is not None:
+            fields["chunks_parsed"] = parsed["count"]
+            fields["chunks_embedded"] = embedded
+        if indexed is not None:
+            fields["chunks_indexed"] = indexed
+        if failed is not None:
+            fields["chunks_failed"] = failed
+        update_ingestion_job(job_id, **fields)
+
+    # Chunks are persisted and keyword-indexed as they stream past so the disk
+    # fallback never has to re-parse
+    delete_chunks(storage_key)
+    parsed = {"count": 0}
+    chunks = index_chunks(
+        storage_key,
+        persist_chunks(storage_key, _parse_chunks(job["file_path"], job["file_type"], parsed))
+    )
+    try:
+        result = embed_and_index_docs(
+            chunks,
+            doc_id=storage_key,
+            conversation_id=None if content_hash else job["conversation_id"],
+            progress_callback=report_progress,
+            tenant=tenant_for_user(job["user_id"])
+        )
+        if result is None:
+            # No vector store; still parse everything so bad files are reported
+            for _ in chunks:
+                pass
+        update_ingestion_job(job_id, chunks_parsed=parsed["count"])
+        if not parsed["count"]:
+            raise DocumentParseError("Document processing returned no content")
+
+        update_ingestion_job(job_id, status="completed")
+        set_status("ready")
+        print(f"✅ Ingestion job {job_id} completed for document: {storage_key}")
+        if result and result.get("centroid") is not None:
+            set_document_centroid(storage_key, result["centroid"].tobytes(), result["indexed"])
+            # Routes cached before the centroid existed were scored without it
+            if job["conversation_id"]:
+                invalidate_routing_cache(job["conversation_id"])
+        if result:
+            # Users who uploaded the same file meanwhile need it in their tenants,
+            # and the job's own user may have removed theirs
+            _sync_tenants(storage_key, job["user_id"])
+    except DocumentParseError as e:
+        print(f"⚠️ Ingestion job {job_id} failed to parse document: {e}")
+        update_ingestion_job(job_id, status="failed", error=str(e), chunks_parsed=parsed["count"])
+        set_status("failed")
+    except Exception as e:
+        print(f"⚠️ Ingestion job {job_id} failed to index document: {e}")
+        try:
+            # Finish filling the chunk store so the disk fallback can serve the document
+            for _ in chunks:
+                pass
+            set_status("ready")
+        except DocumentParseError as parse_error:
+            print(f"⚠️ Ingestion job {job_id} failed to parse document: {parse_error}")
+            set_status("failed")
+        update_ingestion_job(job_id, status="failed", error=str(e), chunks_parsed=parsed["count"])
+
+    if content_hash and get_document_blob(content_hash) is None:
+        # Every reference was removed while the job was running
+        from app.services.document_service import purge_document_storage
+        purge_document_storage(storage_key, job["file_type"])
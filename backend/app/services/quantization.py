@@ -0,0 +1,143 @@
+import os
+import numpy as np
+
+SCORE_BLOCK_ROWS = 65536
+
+def kmeans(data, n_clusters, iterations=10, seed=0):
+    """Plain (Euclidean) k-means; returns the centroids."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    n_clusters = min(n_clusters, len(data))
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroid(data, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_clusters)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(data[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+    return centroids
+
+def nearest_centroid(data, centroids):
+    # argmin |x - c|^2 == argmax (x.c - |c|^2 / 2)
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    return np.argmax(data @ centroids.T - half_norms, axis=1).astype(np.int32)
+
+class ScalarQuantizer:
+    """Per-dimension int8 quantization: 1 byte per dimension instead of 4.
+
+    Each dimension's range on the training sample is split into 256 steps;
+    x is approximated by lo + (code + 128) * step.
+    """
+    kind = "int8"
+
+    def __init__(self, lo, step):
+        self.lo = np.asarray(lo, dtype=np.float32)
+        self.step = np.asarray(step, dtype=np.float32)
+
+    @classmethod
+    def train(cls, sample):
+        sample = np.asarray(sample, dtype=np.float32)
+        lo = sample.min(axis=0)
+        hi = sample.max(axis=0)
+        step = np.maximum(hi - lo, 1e-12) / 255.0
+        return cls(lo, step)
+
+    @property
+    def code_size(self):
+        return len(self.lo)
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.rint((vectors - self.lo) / self.step) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def score(self, codes, q):
+        """Approximate dot products of the encoded vectors with q."""
+        weights = self.step * q
+        bias = float((self.lo + 128 * self.step) @ q)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weights + bias
+        return scores
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, kind=self.kind, lo=self.lo, step=self.step)
+        os.replace(tmp_path, path)
+
+class ProductQuantizer:
+    """Product quantization: the vector is cut into m sub-vectors, each replaced
+    by the index of its nearest of 256 sub-centroids (1 byte per sub-vector).
+
+    Dot products are computed from a per-query (m, 256) lookup table.
+    """
+    kind = "pq"
+
+    def __init__(self, codebooks):
+        # codebooks: (m, 256, dim // m)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @classmethod
+    def train(cls, sample, m, iterations=10, seed=0):
+        sample = np.asarray(sample, dtype=np.float32)
+        dim = sample.shape[1]
+        if dim % m:
+            raise ValueError(f"Vector dimension {dim} is not divisible into {m} sub-vectors")
+        sub = dim // m
+        codebooks = np.zeros((m, 256, sub), dtype=np.float32)
+        for j in range(m):
+            centroids = kmeans(sample[:, j * sub:(j + 1) * sub], 256, iterations, seed + j)
+            codebooks[j, :len(centroids)] = centroids
+        return cls(codebooks)
+
+    @property
+    def m(self):
+        return self.codebooks.shape[0]
+
+    @property
+    def code_size(self):
+        return self.m
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        sub = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = nearest_centroid(vectors[:, j * sub:(j + 1) * sub], self.codebooks[j])
+        return codes
+
+    def score(self, codes, q):
+        sub = self.codebooks.shape[2]
+        table = np.einsum("jks,js->jk", self.codebooks, q.reshape(self.m, sub))
+        scores = np.empty(len(codes), dtype=np.float32)
+        columns = np.arange(self.m)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = np.asarray(codes[start:start + SCORE_BLOCK_ROWS])
+            scores[start:start + len(block)] = table[columns, block].sum(axis=1)
+        return scores
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, kind=self.kind, codebooks=self.codebooks)
+        os.replace(tmp_path, path)
+
+def load_quantizer(path):
+    with np.load(path) as data:
+        kind = str(data["kind"])
+        if kind == ScalarQuantizer.kind:
+            return ScalarQuantizer(data["lo"], data["step"])
+        if kind == ProductQuantizer.kind:
+            return ProductQuantizer(data["codebooks"])
+    raise ValueError(f"Unknown quantizer kind: {kind}")
+
+def train_quantizer(kind, sample, pq_subvectors=0):
+    """Train an "int8" or "pq" quantizer; pq_subvectors 0 uses one per 16 dimensions."""
+    if kind == ScalarQuantizer.kind:
+        return ScalarQuantizer.train(sample)
+    if kind == ProductQuantizer.kind:
+        dim = np.asarray(sample).shape[1]
+        return ProductQuantizer.train(sample, pq_subvectors or max(1, dim // 16))
+    raise ValueError(f"Unknown quantizer kind: {kind}")
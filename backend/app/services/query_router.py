@@ -0,0 +1,238 @@
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from app.config import settings
+from app.database import (
+    add_routing_decision,
+    delete_routing_decisions_before,
+    get_document_centroids,
+    set_routing_decision_llm_route
+)
+from app.services.executors import run_db, run_io
+
+# Decides whether a message in a conversation with documents is about those
+# documents without an LLM round trip. The query embedding (cached, so RAG
+# retrieval reuses it) is compared with the centroids of the conversation's
+# documents and with labelled example queries. The best document-side
+# similarity minus the best general-side one is the margin; when it is
+# within ROUTER_MARGIN of zero the LLM classifier decides instead.
+
+GENERAL_GREETINGS = [
+    "hi", "hello", "hey", "good morning", "good afternoon", "good evening",
+    "how are you", "what's up", "thanks", "thank you", "bye", "goodbye"
+]
+
+DOCUMENT_PROTOTYPES = [
+    "What does the document say about this?",
+    "Summarize the uploaded document",
+    "According to the file, what is the deadline?",
+    "What are the key findings in the report?",
+    "Explain the procedure described in the document",
+    "List the requirements mentioned in the attachment",
+    "What does section 3 of the PDF cover?",
+    "According to the table, what is the total?",
+    "Who are the authors of this paper?",
+    "What conclusions does the text draw?",
+]
+
+GENERAL_PROTOTYPES = [
+    "How are you today?",
+    "What can you do?",
+    "Tell me a joke",
+    "What is the capital of India?",
+    "Who won the football world cup?",
+    "Write a poem about the sea",
+    "How do I reverse a list in Python?",
+    "What's the weather like?",
+    "Are you an AI?",
+    "Translate good morning into French",
+]
+
+_prototypes = None
+_prototype_lock = None
+# Audits still running; held so the tasks are not garbage collected
+_audit_tasks = set()
+
+# Routes cached by normalized query and the set of document types in the
+# conversation, so the same question asked in conversations with the same
+# kinds of files is routed once. Entries expire after ROUTER_CACHE_TTL_SECONDS;
+# adding or removing a conversation's documents drops every entry that
+# conversation used.
+_route_cache = OrderedDict()
+_conversation_keys = {}
+_route_cache_lock = threading.Lock()
+
+def is_greeting(query):
+    query_lower = query.lower().strip()
+    return query_lower in GENERAL_GREETINGS or any(query_lower.startswith(greeting) for greeting in GENERAL_GREETINGS)
+
+def normalize_query(query):
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+def document_fingerprint(uploaded_docs):
+    return ",".join(sorted({(doc.get("file_type") or "").lower() for doc in uploaded_docs}))
+
+def get_cached_route(query, uploaded_docs, conversation_id=None):
+    """The cached (route, method, scores) for this query and document set, or None."""
+    if settings.ROUTER_CACHE_SIZE <= 0:
+        return None
+    key = (normalize_query(query), document_fingerprint(uploaded_docs))
+    with _route_cache_lock:
+        entry = _route_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del _route_cache[key]
+            return None
+        _route_cache.move_to_end(key)
+        if conversation_id:
+            _conversation_keys.setdefault(conversation_id, set()).add(key)
+        return entry[1]
+
+def cache_route(query, uploaded_docs, conversation_id, decision):
+    if settings.ROUTER_CACHE_SIZE <= 0:
+        return
+    key = (normalize_query(query), document_fingerprint(uploaded_docs))
+    with _route_cache_lock:
+        _route_cache[key] = (time.time() + settings.ROUTER_CACHE_TTL_SECONDS, decision)
+        _route_cache.move_to_end(key)
+        while len(_route_cache) > settings.ROUTER_CACHE_SIZE:
+            _route_cache.popitem(last=False)
+        if conversation_id:
+            _conversation_keys.setdefault(conversation_id, set()).add(key)
+
+def invalidate_routing_cache(conversation_id=None):
+    """Forget the routes a conversation used, or every cached route if conversation_id is None."""
+    with _route_cache_lock:
+        if conversation_id is None:
+            _route_cache.clear()
+            _conversation_keys.clear()
+            return
+        for key in _conversation_keys.pop(conversation_id, ()):
+            _route_cache.pop(key, None)
+
+def get_routing_cache_stats():
+    with _route_cache_lock:
+        return {
+            "entries": len(_route_cache),
+            "max_entries": settings.ROUTER_CACHE_SIZE,
+            "ttl_seconds": settings.ROUTER_CACHE_TTL_SECONDS
+        }
+
+def _get_embedder():
+    from app.services import weaviate_service
+    return weaviate_service.embedder
+
+def _unit_rows(vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+async def _prototype_vectors(embedder):
+    """Embed the example queries once per embedder."""
+    global _prototypes, _prototype_lock
+    if _prototypes is not None and _prototypes[0] is embedder:
+        return _prototypes[1], _prototypes[2]
+    if _prototype_lock is None:
+        _prototype_lock = asyncio.Lock()
+    async with _prototype_lock:
+        if _prototypes is None or _prototypes[0] is not embedder:
+            vectors = _unit_rows(await run_io(embedder.embed_documents, DOCUMENT_PROTOTYPES + GENERAL_PROTOTYPES))
+            _prototypes = (embedder, vectors[:len(DOCUMENT_PROTOTYPES)], vectors[len(DOCUMENT_PROTOTYPES):])
+    return _prototypes[1], _prototypes[2]
+
+async def score_document_query(query, uploaded_docs):
+    """Similarity of the query to the documents side and to the general side.
+
+    Returns {"document_score", "general_score"}, or None when there is no
+    embedder or embedding fails.
+    """
+    embedder = _get_embedder()
+    if not embedder:
+        return None
+    try:
+        document_prototypes, general_prototypes = await _prototype_vectors(embedder)
+        vec = await asyncio.wait_for(embedder.aembed_query(query), settings.EMBED_QUERY_TIMEOUT)
+        centroids = await run_db(get_document_centroids, [doc["storage_key"] for doc in uploaded_docs])
+    except Exception as e:
+        print(f"⚠️ Router could not embed query, falling back to LLM: {e}")
+        return None
+    q = np.asarray(vec, dtype=np.float32)
+    q = q / (np.linalg.norm(q) or 1.0)
+    document_score = float((document_prototypes @ q).max())
+    if centroids:
+        centroid_matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for blob in centroids.values()])
+        if centroid_matrix.shape[1] == len(q):
+            document_score = max(document_score, float((centroid_matrix @ q).max()))
+    return {"document_score": document_score, "general_score": float((general_prototypes @ q).max())}
+
+async def classify_document_query(query, uploaded_docs, llm_classify):
+    """Decide whether query is about uploaded_docs, locally when the embeddings are clear.
+
+    llm_classify is an async function of the query returning True for
+    document questions; it is only awaited when the margin is below
+    ROUTER_MARGIN, no embedding is available or ROUTER_MODE is "llm".
+    Returns (is_about_docs, method, scores).
+    """
+    scores = None
+    if settings.ROUTER_MODE != "llm":
+        scores = await score_document_query(query, uploaded_docs)
+    if scores:
+        margin = scores["document_score"] - scores["general_score"]
+        if abs(margin) >= settings.ROUTER_MARGIN:
+            return margin > 0, "embedding", scores
+    return await llm_classify(query), "llm", scores
+
+async def _audit(decision_id, route, llm_classify, query):
+    try:
+        llm_route = "rag" if await llm_classify(query) else "llm"
+        await run_db(set_routing_decision_llm_route, decision_id, llm_route)
+        if llm_route != route:
+            print(f"🧭 Router audit disagreed: local {route}, LLM {llm_route} for {query[:60]!r}")
+    except Exception as e:
+        print(f"⚠️ Router audit failed: {e}")
+
+async def record_decision(conversation_id, query, route, method, started, scores=None, llm_classify=None, cached=False):
+    """Log a routing decision; a ROUTER_AUDIT_RATE share of fresh embedding decisions are re-checked by the LLM in the background."""
+    latency_ms = int((time.time() - started) * 1000)
+    scores = scores or {}
+    llm_route = route if method == "llm" else None
+    score_text = ""
+    if scores:
+        score_text = f", doc {scores['document_score']:.3f} vs general {scores['general_score']:.3f}"
+    source = f"cache ({method})" if cached else method
+    print(f"🧭 Routed to {route} by {source} in {latency_ms}ms{score_text}")
+    try:
+        decision_id = await run_db(
+            add_routing_decision,
+            conversation_id,
+            query,
+            route,
+            method,
+            scores.get("document_score"),
+            scores.get("general_score"),
+            llm_route,
+            latency_ms,
+            cached
+        )
+    except Exception as e:
+        print(f"⚠️ Failed to log routing decision: {e}")
+        return
+    if method == "embedding" and not cached and llm_classify and random.random() < settings.ROUTER_AUDIT_RATE:
+        task = asyncio.create_task(_audit(decision_id, route, llm_classify, query))
+        _audit_tasks.add(task)
+        task.add_done_callback(_audit_tasks.discard)
+
+async def routing_log_sweeper(interval_seconds=3600):
+    """Periodically delete routing decisions older than ROUTER_LOG_RETENTION_DAYS."""
+    while True:
+        try:
+            deleted = await run_db(delete_routing_decisions_before, settings.ROUTER_LOG_RETENTION_DAYS)
+            if deleted:
+                print(f"🧹 Deleted {deleted} routing decisions older than {settings.ROUTER_LOG_RETENTION_DAYS:g} days")
+        except Exception as e:
+            print(f"⚠️ Routing log sweep failed: {e}")
+        await asyncio.sleep(interval_seconds)
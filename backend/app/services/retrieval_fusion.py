@@ -0,0 +1,41 @@
+import hashlib
+
+def chunk_key(doc):
+    """Identity of a retrieved chunk, shared by the vector and keyword result lists."""
+    metadata = doc.metadata or {}
+    if metadata.get("storage_key") and metadata.get("chunk_index") is not None:
+        return (metadata["storage_key"], int(metadata["chunk_index"]))
+    return ("text", hashlib.sha1(doc.page_content.strip().encode("utf-8")).hexdigest())
+
+def reciprocal_rank_fusion(result_lists, weights=None, rrf_k=60):
+    """Merge ranked lists of Documents by weighted reciprocal rank.
+
+    Each document scores sum(weight / (rrf_k + rank)) over the lists it appears
+    in. Returns the fused documents best first.
+    """
+    weights = weights or [1.0] * len(result_lists)
+    scores = {}
+    docs = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, doc in enumerate(results, start=1):
+            key = chunk_key(doc)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+def relative_score_fusion(scored_lists, weights=None):
+    """Merge lists of (Document, score) after min-max normalizing each list's scores."""
+    weights = weights or [1.0] * len(scored_lists)
+    scores = {}
+    docs = {}
+    for results, weight in zip(scored_lists, weights):
+        if not results:
+            continue
+        values = [score for _, score in results]
+        low, high = min(values), max(values)
+        for doc, score in results:
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            key = chunk_key(doc)
+            scores[key] = scores.get(key, 0.0) + weight * normalized
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
@@ -1,11 +1,11 @@
 import sqlite3
 import warnings
-from langchain_openai import AzureChatOpenAI
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain_community.utilities import SQLDatabase
 from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.prebuilt import create_react_agent
 from app.config import settings
+from app.services.clients import get_chat_model
 
 sql_agent = None
 sql_db = None
@@ -18,13 +18,7 @@ def init_sql_agent():
     try:
         sql_db = SQLDatabase.from_uri(f"sqlite:///{settings.DATA_DB_PATH}")
         
-        llm = AzureChatOpenAI(
-            azure_deployment=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
-            openai_api_key=settings.AZURE_OPENAI_API_KEY,
-            openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            temperature=0
-        )
+        llm = get_chat_model(temperature=0)
         
         toolkit = SQLDatabaseToolkit(db=sql_db, llm=llm)
         tools = toolkit.get_tools()
@@ -0,0 +1,820 @@
+import json
+import os
+import re
+import threading
+import time
+from array import array
+import numpy as np
+from app.config import settings
+
+COLLECTION_NAME = "DocumentChunk"
+
+def tenant_for_user(user_id):
+    """Weaviate tenant name for a user; documents without an owner share one tenant."""
+    if not user_id:
+        return "shared"
+    return "user-" + re.sub(r"[^A-Za-z0-9_-]", "_", str(user_id))[:58]
+
+class VectorStore:
+    """Interface shared by the vector store backends.
+
+    Objects are a vector plus a flat properties dict holding at least text,
+    doc_id (the document's storage key) and chunk_index. Scores are cosine
+    similarities, higher is better.
+
+    Stores with multi_tenant set keep a separate index per tenant and need the
+    tenant on every call; the others ignore it.
+    """
+    name = None
+    multi_tenant = False
+
+    def batch_writer(self, tenant=None):
+        """Return a context manager with add(properties, vector, uuid).
+
+        Its `failed` attribute holds the number of objects that could not be
+        stored once the context has exited.
+        """
+        raise NotImplementedError
+
+    def query(self, vector, limit, storage_keys=None, tenant=None):
+        """Return up to limit (properties, score) pairs, best first, optionally
+        restricted to the given storage keys."""
+        raise NotImplementedError
+
+    def fetch(self, storage_keys, limit, tenant=None):
+        """Return the properties of up to limit objects of the given storage keys."""
+        raise NotImplementedError
+
+    def vectors(self, uuids, tenant=None):
+        """Return {uuid: vector} for the stored objects among uuids."""
+        return {}
+
+    async def aquery(self, vector, limit, storage_keys=None, tenant=None):
+        """Async query; backends without an async client run query on the io pool."""
+        from app.services.executors import run_io
+        return await run_io(self.query, vector, limit, storage_keys, tenant)
+
+    async def afetch(self, storage_keys, limit, tenant=None):
+        from app.services.executors import run_io
+        return await run_io(self.fetch, storage_keys, limit, tenant)
+
+    async def avectors(self, uuids, tenant=None):
+        from app.services.executors import run_io
+        return await run_io(self.vectors, uuids, tenant)
+
+    def delete(self, storage_key, tenant=None):
+        """Delete a document's objects from one tenant, or from every tenant if tenant is None."""
+        raise NotImplementedError
+
+    def has_document(self, storage_key, tenant=None):
+        return bool(self.fetch([storage_key], 1, tenant=tenant))
+
+    def copy_document(self, storage_key, source_tenant, target_tenant):
+        """Copy a document's objects between tenants. Returns the number copied."""
+        return 0
+
+class _WeaviateBatchWriter:
+    def __init__(self, collection, on_success=None):
+        self._collection = collection
+        self._on_success = on_success
+        self._batch = None
+        self._added = set()
+        self.failed = 0
+
+    def __enter__(self):
+        self._batch = self._collection.batch.fixed_size(
+            batch_size=settings.WEAVIATE_BATCH_SIZE,
+            concurrent_requests=settings.WEAVIATE_BATCH_CONCURRENCY,
+        )
+        self._batch.__enter__()
+        return self
+
+    def add(self, properties, vector, uuid):
+        self._batch.add_object(properties=properties, vector=vector, uuid=uuid)
+        self._added.add(properties.get("doc_id", ""))
+
+    def __exit__(self, exc_type, exc, tb):
+        self._batch.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            failed_objects = self._collection.batch.failed_objects
+            if failed_objects:
+                print(f"⚠️ {len(failed_objects)} chunks rejected by batch import, retrying individually")
+                self.failed = _retry_failed_objects(self._collection, failed_objects)
+            if self._on_success:
+                for storage_key in self._added:
+                    self._on_success(storage_key)
+        return False
+
+def _retry_failed_objects(collection, failed_objects):
+    """Re-insert objects rejected by the batch API one at a time. Returns the number still failing."""
+    still_failed = 0
+    for failed in failed_objects:
+        obj = failed.object_
+        for attempt in range(settings.INDEX_MAX_RETRIES):
+            try:
+                collection.data.insert(properties=obj.properties, vector=obj.vector, uuid=obj.uuid)
+                break
+            except Exception as e:
+                if "already exists" in str(e):
+                    break
+                if attempt == settings.INDEX_MAX_RETRIES - 1:
+                    print(f"⚠️ Giving up on chunk {obj.uuid}: {e}")
+                    still_failed += 1
+                else:
+                    time.sleep(0.5 * (2 ** attempt))
+    return still_failed
+
+class WeaviateVectorStore(VectorStore):
+    """Vectors in Weaviate.
+
+    With multi_tenant set, objects live in a multi-tenant collection with one
+    tenant per user (see tenant_for_user), so a scoped search runs against
+    that user's small index instead of filtering the whole collection by
+    doc_id. document_blob_tenants records which tenants hold each document.
+    Tenants are created and reactivated automatically on use; ones idle for
+    a while can be deactivated with deactivate_idle_tenants.
+
+    async_client, once set, serves aquery and afetch natively on the event
+    loop; writes and schema changes always go through the sync client.
+    """
+    name = "weaviate"
+
+    def __init__(self, client, collection=COLLECTION_NAME, multi_tenant=False, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.collection_name = collection
+        self.multi_tenant = multi_tenant
+        self._tenant_last_used = {}
+        self._tenants_lock = threading.Lock()
+
+    def ensure_schema(self):
+        from weaviate.classes.config import Configure, Property, DataType
+        if not self.client.collections.exists(self.collection_name):
+            self.client.collections.create(
+                name=self.collection_name,
+                properties=[
+                    Property(name="text", data_type=DataType.TEXT),
+                    Property(name="doc_id", data_type=DataType.TEXT),
+                    Property(name="conversation_id", data_type=DataType.TEXT),
+                    Property(name="chunk_index", data_type=DataType.INT),
+                    Property(name="page", data_type=DataType.INT)
+                ],
+                multi_tenancy_config=Configure.multi_tenancy(
+                    enabled=True, auto_tenant_creation=True, auto_tenant_activation=True
+                ) if self.multi_tenant else None
+            )
+            if self.multi_tenant:
+                print(f"✅ Created multi-tenant collection {self.collection_name}")
+
+    def _collection(self, tenant=None):
+        self.ensure_schema()
+        return self._scoped(self.client.collections.get(self.collection_name), tenant)
+
+    def _async_collection(self, tenant=None):
+        # The schema is created at startup by the sync client
+        return self._scoped(self.async_client.collections.get(self.collection_name), tenant)
+
+    def _scoped(self, collection, tenant):
+        if self.multi_tenant:
+            if not tenant:
+                raise ValueError(f"{self.collection_name} is multi-tenant; a tenant is required")
+            with self._tenants_lock:
+                self._tenant_last_used[tenant] = time.monotonic()
+            collection = collection.with_tenant(tenant)
+        return collection
+
+    def _doc_filter(self, storage_keys, tenant):
+        """Filter for storage_keys, or None when the tenant holds nothing else."""
+        from weaviate.classes.query import Filter
+        if self.multi_tenant:
+            from app.database import get_tenant_storage_keys
+            if set(get_tenant_storage_keys(tenant)) <= set(storage_keys):
+                return None
+        return Filter.by_property("doc_id").contains_any(list(storage_keys))
+
+    def _tenant_has_any(self, storage_keys, tenant):
+        from app.database import get_tenant_storage_keys
+        return bool(set(get_tenant_storage_keys(tenant)) & set(storage_keys))
+
+    def batch_writer(self, tenant=None):
+        on_success = None
+        if self.multi_tenant:
+            from app.database import add_document_blob_tenant
+            on_success = lambda storage_key: add_document_blob_tenant(storage_key, tenant)
+        return _WeaviateBatchWriter(self._collection(tenant), on_success)
+
+    def query(self, vector, limit, storage_keys=None, tenant=None):
+        from weaviate.classes.query import MetadataQuery
+        if storage_keys is not None:
+            if not storage_keys:
+                return []
+            if self.multi_tenant and not self._tenant_has_any(storage_keys, tenant):
+                return []
+        res = self._collection(tenant).query.near_vector(
+            near_vector=vector,
+            limit=limit,
+            filters=self._doc_filter(storage_keys, tenant) if storage_keys else None,
+            return_metadata=MetadataQuery(distance=True)
+        )
+        return [(o.properties, 1.0 - (o.metadata.distance or 0.0)) for o in res.objects]
+
+    def fetch(self, storage_keys, limit, tenant=None):
+        if not storage_keys:
+            return []
+        if self.multi_tenant and not self._tenant_has_any(storage_keys, tenant):
+            return []
+        res = self._collection(tenant).query.fetch_objects(
+            limit=limit,
+            filters=self._doc_filter(storage_keys, tenant)
+        )
+        return [o.properties for o in res.objects]
+
+    def _vectors_by_uuid(self, objects):
+        return {
+            str(o.uuid): o.vector.get("default") if isinstance(o.vector, dict) else o.vector
+            for o in objects
+        }
+
+    def vectors(self, uuids, tenant=None):
+        from weaviate.classes.query import Filter
+        if not uuids:
+            return {}
+        res = self._collection(tenant).query.fetch_objects(
+            limit=len(uuids),
+            filters=Filter.by_id().contains_any(list(uuids)),
+            include_vector=True
+        )
+        return self._vectors_by_uuid(res.objects)
+
+    async def aquery(self, vector, limit, storage_keys=None, tenant=None):
+        from weaviate.classes.query import MetadataQuery
+        if not self.async_client:
+            return await super().aquery(vector, limit, storage_keys, tenant)
+        if storage_keys is not None:
+            if not storage_keys:
+                return []
+            if self.multi_tenant and not self._tenant_has_any(storage_keys, tenant):
+                return []
+        res = await self._async_collection(tenant).query.near_vector(
+            near_vector=vector,
+            limit=limit,
+            filters=self._doc_filter(storage_keys, tenant) if storage_keys else None,
+            return_metadata=MetadataQuery(distance=True)
+        )
+        return [(o.properties, 1.0 - (o.metadata.distance or 0.0)) for o in res.objects]
+
+    async def afetch(self, storage_keys, limit, tenant=None):
+        if not self.async_client:
+            return await super().afetch(storage_keys, limit, tenant)
+        if not storage_keys:
+            return []
+        if self.multi_tenant and not self._tenant_has_any(storage_keys, tenant):
+            return []
+        res = await self._async_collection(tenant).query.fetch_objects(
+            limit=limit,
+            filters=self._doc_filter(storage_keys, tenant)
+        )
+        return [o.properties for o in res.objects]
+
+    async def avectors(self, uuids, tenant=None):
+        from weaviate.classes.query import Filter
+        if not self.async_client:
+            return await super().avectors(uuids, tenant)
+        if not uuids:
+            return {}
+        res = await self._async_collection(tenant).query.fetch_objects(
+            limit=len(uuids),
+            filters=Filter.by_id().contains_any(list(uuids)),
+            include_vector=True
+        )
+        return self._vectors_by_uuid(res.objects)
+
+    def delete(self, storage_key, tenant=None):
+        from weaviate.classes.query import Filter
+        if not self.multi_tenant:
+            # One collection serves every user, so a single tenant's copy is never removed alone
+            if tenant is not None:
+                return
+            self._collection().data.delete_many(
+                where=Filter.by_property("doc_id").equal(storage_key)
+            )
+            return
+        from app.database import get_document_blob_tenants, remove_document_blob_tenant
+        tenants = [tenant] if tenant else get_document_blob_tenants(storage_key)
+        for t in tenants:
+            self._collection(t).data.delete_many(
+                where=Filter.by_property("doc_id").equal(storage_key)
+            )
+            remove_document_blob_tenant(storage_key, t)
+
+    def copy_document(self, storage_key, source_tenant, target_tenant, page_size=500):
+        from weaviate.classes.query import Filter
+        if not self.multi_tenant or source_tenant == target_tenant:
+            return 0
+        source = self._collection(source_tenant)
+        copied = 0
+        with self.batch_writer(target_tenant) as batch:
+            while True:
+                res = source.query.fetch_objects(
+                    limit=page_size,
+                    offset=copied,
+                    filters=Filter.by_property("doc_id").equal(storage_key),
+                    include_vector=True
+                )
+                for o in res.objects:
+                    vector = o.vector.get("default") if isinstance(o.vector, dict) else o.vector
+                    batch.add(properties=o.properties, vector=vector, uuid=o.uuid)
+                copied += len(res.objects)
+                if len(res.objects) < page_size:
+                    break
+        return copied - batch.failed
+
+    def deactivate_idle_tenants(self, max_idle_seconds, action="deactivate"):
+        """Deactivate (or offload) tenants not used for max_idle_seconds. Returns their names."""
+        if not self.multi_tenant:
+            return []
+        now = time.monotonic()
+        with self._tenants_lock:
+            idle = [t for t, last_used in self._tenant_last_used.items() if now - last_used > max_idle_seconds]
+            for t in idle:
+                del self._tenant_last_used[t]
+        if idle:
+            tenants = self.client.collections.get(self.collection_name).tenants
+            if action == "offload":
+                tenants.offload(idle)
+            else:
+                tenants.deactivate(idle)
+            print(f"💤 {action.capitalize()}d {len(idle)} idle tenant(s)")
+        return idle
+
+    def track_active_tenants(self):
+        """Start the idle clock for tenants that were active before this process started."""
+        from weaviate.classes.tenants import TenantActivityStatus
+        if not self.multi_tenant or not self.client.collections.exists(self.collection_name):
+            return
+        now = time.monotonic()
+        tenants = self.client.collections.get(self.collection_name).tenants.get()
+        with self._tenants_lock:
+            for name, tenant in tenants.items():
+                if tenant.activity_status in (TenantActivityStatus.ACTIVE, TenantActivityStatus.HOT):
+                    self._tenant_last_used.setdefault(name, now)
+
+class _LocalBatchWriter:
+    def __init__(self, store):
+        self._store = store
+        self._pending = []
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def add(self, properties, vector, uuid):
+        self._pending.append((str(uuid), vector, properties))
+        if len(self._pending) >= settings.WEAVIATE_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        objects, self._pending = self._pending, []
+        self._store.add(objects)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self._pending:
+            self._flush()
+        return False
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store backed by two append-only files per collection.
+
+    <collection>.f32 is a row-major float32 matrix of unit-length vectors that
+    queries read through np.memmap. <collection>.jsonl is the sidecar: a
+    {"dim": n} header, one {"uuid", "properties"} line per matrix row and
+    {"deleted": [rows]} tombstone lines. Only the uuid, storage key and sidecar
+    offset of each row are held in memory; properties are read back for the
+    rows a query returns. Re-adding a uuid tombstones its previous row.
+
+    Once the collection holds settings.LOCAL_ANN_MIN_VECTORS vectors, large
+    queries go through an IVF index (<collection>.ivf.npz) instead of a full
+    scan; queries filtered to fewer rows than that stay exact. The index is
+    trained on the io pool, and queries stay exact (or keep using the previous
+    index) until it is ready.
+
+    With settings.LOCAL_VECTOR_QUANTIZATION set, every row also gets an int8 or
+    PQ code (<collection>.codes, parameters in <collection>.quant.npz). Rows
+    are ranked on the codes and only a shortlist is rescored from the float
+    matrix, so the hot data is the codes rather than the full vectors.
+
+    The files are owned by a single process; writes are serialized by a lock.
+    """
+    name = "local"
+
+    def __init__(self, directory, collection=COLLECTION_NAME):
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, f"{collection}.f32")
+        self.meta_path = os.path.join(directory, f"{collection}.jsonl")
+        self.ann_path = os.path.join(directory, f"{collection}.ivf.npz")
+        self.codes_path = os.path.join(directory, f"{collection}.codes")
+        self.quantizer_path = os.path.join(directory, f"{collection}.quant.npz")
+        self.dim = None
+        self.nprobe = settings.LOCAL_ANN_NPROBE
+        self._lock = threading.RLock()
+        # Bumped whenever row numbers change, so a stale training result is dropped
+        self._generation = 0
+        self._ann_training = None
+        self._reset()
+        self._load()
+        self._schedule_ann()
+
+    def _reset(self):
+        self._offsets = array("q")
+        self._row_uuids = []
+        self._uuid_rows = {}
+        self._key_rows = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._matrix = None
+        self._ann = None
+        self._ann_trained_rows = 0
+        self._ann_saved_rows = 0
+        self._quantizer = None
+        self._codes = None
+
+    @property
+    def live_count(self):
+        return int(self._alive.sum())
+
+    @property
+    def count(self):
+        return len(self._offsets)
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        alive = bytearray()
+        deleted = []
+        offset = 0
+        with open(self.meta_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn write at the end of the sidecar
+                    break
+                if "dim" in record:
+                    self.dim = record["dim"]
+                elif "deleted" in record:
+                    deleted.extend(record["deleted"])
+                else:
+                    self._append_row(record["uuid"], record["properties"].get("doc_id", ""), offset)
+                    alive.append(1)
+                offset += len(line)
+        if offset < os.path.getsize(self.meta_path):
+            with open(self.meta_path, "r+b") as f:
+                f.truncate(offset)
+
+        rows = self.count
+        if self.dim:
+            stored_rows = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+            if stored_rows < rows:
+                print(f"⚠️ Local vector store is missing {rows - stored_rows} vectors, dropping their rows")
+                deleted.extend(range(stored_rows, rows))
+            elif stored_rows > rows:
+                with open(self.vectors_path, "r+b") as f:
+                    f.truncate(rows * 4 * self.dim)
+        self._alive = np.frombuffer(bytes(alive), dtype=bool).copy()
+        for row in deleted:
+            self._kill(row)
+        self._load_quantizer()
+        self._load_ann()
+        print(f"✅ Local vector store loaded {self.live_count} vectors from {self.meta_path}")
+
+    def _load_ann(self):
+        from app.services.ann_index import IVFIndex
+        if not os.path.exists(self.ann_path):
+            return
+        try:
+            ann = IVFIndex.load(self.ann_path)
+        except Exception as e:
+            print(f"⚠️ Could not load IVF index, it will be rebuilt: {e}")
+            return
+        if ann.n_rows > self.count or ann.centroids.shape[1] != self.dim:
+            print("⚠️ IVF index does not match the stored vectors, it will be rebuilt")
+            return
+        # Rows appended after the last save
+        ann.add(self._get_matrix()[ann.n_rows:], ann.n_rows)
+        self._ann = ann
+        self._ann_trained_rows = self._ann_saved_rows = ann.n_rows
+
+    def _load_quantizer(self):
+        from app.services.quantization import load_quantizer
+        kind = settings.LOCAL_VECTOR_QUANTIZATION
+        if kind == "none" or not self.count:
+            return
+        if os.path.exists(self.quantizer_path):
+            try:
+                quantizer = load_quantizer(self.quantizer_path)
+                if quantizer.kind == kind:
+                    self._quantizer = quantizer
+            except Exception as e:
+                print(f"⚠️ Could not load vector quantizer, it will be retrained: {e}")
+        if self._quantizer is None:
+            self._ensure_quantizer()
+            return
+        code_size = self._quantizer.code_size
+        stored_rows = os.path.getsize(self.codes_path) // code_size if os.path.exists(self.codes_path) else 0
+        if stored_rows > self.count:
+            with open(self.codes_path, "r+b") as f:
+                f.truncate(self.count * code_size)
+        elif stored_rows < self.count:
+            # Rows added after the codes were last written, or the whole file after compaction
+            self._append_codes(self._get_matrix()[stored_rows:])
+
+    def _ensure_quantizer(self):
+        """Train the quantizer once the collection reaches LOCAL_QUANTIZE_MIN_VECTORS and encode every row."""
+        from app.services.quantization import train_quantizer
+        kind = settings.LOCAL_VECTOR_QUANTIZATION
+        if kind == "none" or self._quantizer is not None or self.count < settings.LOCAL_QUANTIZE_MIN_VECTORS:
+            return
+        matrix = self._get_matrix()
+        sample = np.sort(np.random.default_rng(0).choice(self.count, min(self.count, 20000), replace=False))
+        print(f"🔄 Training {kind} vector quantizer on {len(sample)} of {self.count} vectors")
+        try:
+            self._quantizer = train_quantizer(kind, matrix[sample], settings.LOCAL_PQ_SUBVECTORS)
+        except ValueError as e:
+            print(f"⚠️ Vector quantization disabled: {e}")
+            return
+        self._quantizer.save(self.quantizer_path)
+        if os.path.exists(self.codes_path):
+            os.remove(self.codes_path)
+        self._append_codes(matrix)
+
+    def _append_codes(self, vectors):
+        with open(self.codes_path, "ab") as f:
+            for start in range(0, len(vectors), 65536):
+                f.write(self._quantizer.encode(vectors[start:start + 65536]).tobytes())
+        self._codes = None
+
+    def _get_codes(self):
+        if self._codes is None and self._quantizer is not None and self.count:
+            dtype = np.int8 if self._quantizer.kind == "int8" else np.uint8
+            self._codes = np.memmap(self.codes_path, dtype=dtype, mode="r", shape=(self.count, self._quantizer.code_size))
+        return self._codes
+
+    def _schedule_ann(self):
+        """Start training the IVF index on the io pool once the collection is large
+        enough, and again after it has grown fourfold since training. Called with
+        the lock held; training itself runs without it."""
+        from app.services.executors import get_pool
+        if self._ann_training is not None or self.count < settings.LOCAL_ANN_MIN_VECTORS:
+            return
+        if self._ann is not None and self.count <= 4 * self._ann_trained_rows:
+            return
+        nlist = settings.LOCAL_ANN_NLIST or int(4 * np.sqrt(self.count))
+        print(f"🔄 Training IVF index with {nlist} lists over {self.count} vectors")
+        self._ann_training = get_pool("io").submit(self._train_ann, self._get_matrix(), nlist, self._generation)
+
+    def _train_ann(self, matrix, nlist, generation):
+        from app.services.ann_index import IVFIndex
+        try:
+            ann = IVFIndex.train(matrix, nlist)
+        except Exception as e:
+            print(f"⚠️ IVF index training failed: {e}")
+            ann = None
+        with self._lock:
+            self._ann_training = None
+            if ann is None:
+                return
+            if generation != self._generation:
+                # Compacted while training; the rows it filed no longer exist
+                self._schedule_ann()
+                return
+            # Rows added while training
+            ann.add(self._get_matrix()[ann.n_rows:], ann.n_rows)
+            self._ann = ann
+            self._ann_trained_rows = len(matrix)
+            self._save_ann()
+            self._schedule_ann()
+
+    def _save_ann(self):
+        self._ann.save(self.ann_path)
+        self._ann_saved_rows = self._ann.n_rows
+
+    def _append_row(self, uuid, storage_key, offset):
+        row = self.count
+        old_row = self._uuid_rows.get(uuid)
+        self._offsets.append(offset)
+        self._row_uuids.append(uuid)
+        self._uuid_rows[uuid] = row
+        self._key_rows.setdefault(storage_key, []).append(row)
+        return old_row
+
+    def _kill(self, row):
+        if row < len(self._alive) and self._alive[row]:
+            self._alive[row] = False
+            uuid = self._row_uuids[row]
+            if self._uuid_rows.get(uuid) == row:
+                del self._uuid_rows[uuid]
+
+    def add(self, objects):
+        """Append (uuid, vector, properties) objects, replacing any with the same uuid."""
+        if not objects:
+            return
+        vectors = np.asarray([vector for _, vector, _ in objects], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1.0)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, "ab") as f:
+                    f.write(json.dumps({"dim": self.dim}).encode("utf-8") + b"\n")
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match the store's {self.dim}")
+
+            # Vectors go first so a crash never leaves sidecar rows without a vector
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            replaced = []
+            with open(self.meta_path, "ab") as f:
+                offset = f.tell()
+                for uuid, _, properties in objects:
+                    line = json.dumps({"uuid": uuid, "properties": properties}).encode("utf-8") + b"\n"
+                    old_row = self._append_row(uuid, properties.get("doc_id", ""), offset)
+                    if old_row is not None:
+                        replaced.append(old_row)
+                    f.write(line)
+                    offset += len(line)
+                if replaced:
+                    f.write(json.dumps({"deleted": replaced}).encode("utf-8") + b"\n")
+            first_row = len(self._alive)
+            self._alive = np.concatenate([self._alive, np.ones(len(objects), dtype=bool)])
+            for row in replaced:
+                self._alive[row] = False
+            self._matrix = None
+            if self._quantizer is not None:
+                self._append_codes(vectors)
+            else:
+                self._ensure_quantizer()
+            if self._ann is not None:
+                self._ann.add(vectors, first_row)
+                if self._ann.n_rows - self._ann_saved_rows >= 10000:
+                    self._save_ann()
+            self._schedule_ann()
+
+    def _get_matrix(self):
+        if self._matrix is None and self.count:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+        return self._matrix
+
+    def _read_properties(self, rows):
+        results = []
+        with open(self.meta_path, "rb") as f:
+            for row in rows:
+                f.seek(self._offsets[row])
+                results.append(json.loads(f.readline())["properties"])
+        return results
+
+    def _rows_for(self, storage_keys):
+        rows = [self._key_rows.get(key, ()) for key in storage_keys]
+        rows = np.sort(np.fromiter((row for key_rows in rows for row in key_rows), dtype=np.int64))
+        return rows[self._alive[rows]]
+
+    @staticmethod
+    def _score_rows(matrix, rows, q):
+        """Dot q with the given sorted rows.
+
+        A document's chunks are written together, so rows mostly form a few
+        contiguous runs; scoring each run on a slice of the memmap avoids
+        gathering the rows into a copy first.
+        """
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        if len(breaks) > len(rows) // 8:
+            return matrix[rows] @ q
+        starts = np.concatenate([[0], breaks])
+        ends = np.concatenate([breaks, [len(rows)]])
+        return np.concatenate([matrix[rows[s]:rows[e - 1] + 1] @ q for s, e in zip(starts, ends)])
+
+    def _top_k(self, matrix, rows, q, limit):
+        """Best limit of the given sorted rows (None for every live row) as (rows, scores).
+
+        With a quantizer, rows are ranked on their codes and only the best
+        limit * LOCAL_RESCORE_FACTOR are rescored exactly.
+        """
+        n_rows = self.count if rows is None else len(rows)
+        if self._quantizer is not None:
+            rescore_factor = settings.LOCAL_RESCORE_FACTOR or (4 if self._quantizer.kind == "int8" else 16)
+            shortlist = limit * rescore_factor
+        if self._quantizer is not None and n_rows > shortlist:
+            codes = self._get_codes()
+            if rows is None:
+                approx = self._quantizer.score(codes, q)
+                approx[~self._alive] = -np.inf
+                keep = np.argpartition(-approx, shortlist - 1)[:shortlist]
+                rows = np.sort(keep[self._alive[keep]])
+            else:
+                approx = self._quantizer.score(codes[rows], q)
+                rows = np.sort(rows[np.argpartition(-approx, shortlist - 1)[:shortlist]])
+            scores = matrix[rows] @ q
+        elif rows is None:
+            rows = np.flatnonzero(self._alive)
+            scores = (matrix @ q)[rows]
+        else:
+            scores = self._score_rows(matrix, rows, q)
+        if not len(rows):
+            return rows, scores
+        top = min(limit, len(rows))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return rows[best], scores[best]
+
+    def batch_writer(self, tenant=None):
+        return _LocalBatchWriter(self)
+
+    def query(self, vector, limit, storage_keys=None, tenant=None):
+        q = np.asarray(vector, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        with self._lock:
+            matrix = self._get_matrix()
+            if matrix is None or limit <= 0:
+                return []
+            ann = self._ann
+            if storage_keys is not None:
+                rows = self._rows_for(storage_keys)
+                if ann is not None and len(rows) >= settings.LOCAL_ANN_MIN_VECTORS:
+                    mask = np.zeros(self.count, dtype=bool)
+                    mask[rows] = True
+                    rows = ann.candidates(q, self.nprobe, mask)
+            elif ann is not None:
+                rows = ann.candidates(q, self.nprobe, self._alive)
+            else:
+                rows = None
+            if rows is not None and not len(rows):
+                return []
+            rows, scores = self._top_k(matrix, rows, q, limit)
+            properties = self._read_properties(rows)
+        return list(zip(properties, scores.tolist()))
+
+    def fetch(self, storage_keys, limit, tenant=None):
+        with self._lock:
+            rows = self._rows_for(storage_keys)[:limit]
+            return self._read_properties(rows)
+
+    def vectors(self, uuids, tenant=None):
+        with self._lock:
+            matrix = self._get_matrix()
+            found = [(str(u), self._uuid_rows.get(str(u))) for u in uuids]
+            found = [(u, row) for u, row in found if row is not None and self._alive[row]]
+            if matrix is None or not found:
+                return {}
+            rows = np.array([row for _, row in found], dtype=np.int64)
+            return dict(zip((u for u, _ in found), np.asarray(matrix[rows])))
+
+    def delete(self, storage_key, tenant=None):
+        # One index serves every user, so a single tenant's copy is never removed alone
+        if tenant is not None:
+            return
+        with self._lock:
+            rows = self._key_rows.pop(storage_key, [])
+            rows = [row for row in rows if self._alive[row]]
+            if not rows:
+                return
+            for row in rows:
+                self._kill(row)
+            with open(self.meta_path, "ab") as f:
+                f.write(json.dumps({"deleted": rows}).encode("utf-8") + b"\n")
+            if self.count - self.live_count > max(1000, self.count // 2):
+                self.compact()
+
+    def compact(self):
+        """Rewrite both files without tombstoned rows."""
+        with self._lock:
+            live = np.flatnonzero(self._alive)
+            matrix = self._get_matrix()
+            properties = self._read_properties(live)
+            vectors_tmp = f"{self.vectors_path}.tmp"
+            meta_tmp = f"{self.meta_path}.tmp"
+            with open(vectors_tmp, "wb") as f:
+                for start in range(0, len(live), 10000):
+                    f.write(np.ascontiguousarray(matrix[live[start:start + 10000]]).tobytes())
+            uuids = [self._row_uuids[row] for row in live]
+            with open(meta_tmp, "wb") as f:
+                f.write(json.dumps({"dim": self.dim}).encode("utf-8") + b"\n")
+                for uuid, props in zip(uuids, properties):
+                    f.write(json.dumps({"uuid": uuid, "properties": props}).encode("utf-8") + b"\n")
+            ann = self._ann
+            self._generation += 1
+            self._matrix = None
+            matrix = None
+            os.replace(vectors_tmp, self.vectors_path)
+            os.replace(meta_tmp, self.meta_path)
+            for derived_path in (self.ann_path, self.codes_path):
+                if os.path.exists(derived_path):
+                    os.remove(derived_path)
+            self._reset()
+            self._load()
+            if ann is not None and self.count:
+                # Row numbers changed; keep the trained centroids
+                ann.reassign(self._get_matrix())
+                self._ann = ann
+                self._ann_trained_rows = self.count
+                self._save_ann()
+            self._schedule_ann()
+            print(f"🧹 Compacted local vector store to {self.live_count} vectors")
@@ -1,23 +1,30 @@
+import asyncio
+import os
 import weaviate
 from weaviate.classes.init import Auth
-from weaviate.classes.config import Property, DataType
+from weaviate.util import generate_uuid5
 from app.config import settings
-from langchain_openai import AzureOpenAIEmbeddings
+from app.services.executors import run_io, run_db, get_pool, on_pool_thread
+from app.utils.tokens import count_tokens
+from app.services.clients import get_embeddings_model
 
 client = None
+async_client = None
 embedder = None
+vector_store = None
 
 def init_weaviate_client():
     global client, embedder
     
     if settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME:
-        embedder = AzureOpenAIEmbeddings(
-            azure_deployment=settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME,
-            api_key=settings.AZURE_OPENAI_API_KEY,
-            api_version=settings.AZURE_OPENAI_API_VERSION,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            model=settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME
-        )
+        embedder = get_embeddings_model()
+        if settings.EMBED_CACHE_ENABLED:
+            from app.services.embedding_cache import CachedEmbeddings, get_embedding_cache
+            embedder = CachedEmbeddings(
+                embedder,
+                get_embedding_cache(),
+                settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME
+            )
     else:
         print("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME not set. Embeddings will fail.")
     
@@ -30,29 +37,141 @@ def init_weaviate_client():
             print("✅ Weaviate client connected successfully")
         except Exception as e:
             print(f"⚠️ Failed to connect to Weaviate: {e}")
-            print("⚠️ Vector search will be disabled. BM25 search will still work.")
             client = None
     else:
-        print("⚠️ WEAVIATE_URL not set. Vector search will be disabled. BM25 search will still work.")
+        print("⚠️ WEAVIATE_URL not set.")
+    
+    init_vector_store()
 
-def ensure_weaviate_schema():
-    if not client:
+async def init_async_weaviate_client():
+    """Open the shared async Weaviate connection used by aretrieve_docs."""
+    global async_client
+    if not settings.WEAVIATE_URL or not client:
+        return
+    try:
+        async_client = weaviate.use_async_with_weaviate_cloud(
+            cluster_url=settings.WEAVIATE_URL,
+            auth_credentials=Auth.api_key(settings.WEAVIATE_API_KEY) if settings.WEAVIATE_API_KEY else None,
+        )
+        await async_client.connect()
+        print("✅ Async Weaviate client connected")
+    except Exception as e:
+        print(f"⚠️ Failed to connect async Weaviate client, retrieval will use the io pool: {e}")
+        async_client = None
+    if vector_store and vector_store.name == "weaviate":
+        vector_store.async_client = async_client
+
+async def close_async_weaviate_client():
+    global async_client
+    if async_client:
+        await async_client.close()
+        async_client = None
+    if vector_store and vector_store.name == "weaviate":
+        vector_store.async_client = None
+
+def init_vector_store():
+    """Pick the vector store backend from settings.VECTOR_STORE."""
+    global vector_store
+    from app.services.vector_store import WeaviateVectorStore, LocalVectorStore
+    
+    backend = settings.VECTOR_STORE
+    if backend in ("weaviate", "auto") and client:
+        if settings.WEAVIATE_MULTI_TENANCY:
+            vector_store = WeaviateVectorStore(
+                client, settings.WEAVIATE_TENANT_COLLECTION, multi_tenant=True, async_client=async_client
+            )
+            try:
+                vector_store.track_active_tenants()
+            except Exception as e:
+                print(f"⚠️ Could not list Weaviate tenants: {e}")
+            _warn_about_legacy_collection()
+        else:
+            vector_store = WeaviateVectorStore(client, async_client=async_client)
+    elif backend in ("local", "auto"):
+        vector_store = LocalVectorStore(os.path.abspath(settings.VECTOR_STORE_DIR))
+        print("✅ Using the local vector store")
+    else:
+        vector_store = None
+        print("⚠️ Vector search will be disabled. BM25 search will still work.")
+
+def _warn_about_legacy_collection():
+    """Warn when multi-tenancy is on but the shared collection still holds objects it no longer searches."""
+    from app.services.vector_store import COLLECTION_NAME
+    try:
+        if not client.collections.exists(COLLECTION_NAME):
+            return
+        count = client.collections.get(COLLECTION_NAME).aggregate.over_all(total_count=True).total_count
+    except Exception as e:
+        print(f"⚠️ Could not check the {COLLECTION_NAME} collection: {e}")
         return
-    if not client.collections.exists("DocumentChunk"):
-        client.collections.create(
-            name="DocumentChunk",
-            properties=[
-                Property(name="text", data_type=DataType.TEXT),
-                Property(name="doc_id", data_type=DataType.TEXT),
-                Property(name="conversation_id", data_type=DataType.TEXT)
-            ]
+    if count:
+        print(
+            f"⚠️ WEAVIATE_MULTI_TENANCY is on but {COLLECTION_NAME} still holds {count} objects; their documents "
+            f"get keyword search only until python -m scripts.migrate_weaviate_tenants copies them into tenants"
         )
 
-def embed_and_index_docs(docs, doc_id=None, conversation_id=None):
+def ensure_weaviate_schema():
+    if vector_store and vector_store.name == "weaviate":
+        vector_store.ensure_schema()
+
+def _iter_embedding_batches(docs, max_tokens, max_items):
+    """Group non-empty chunks into batches bounded by token count and size."""
+    batch = []
+    batch_tokens = 0
+    for i, doc in enumerate(docs):
+        content = (doc.page_content or "").strip()
+        if not content:
+            print(f"⚠️ Skipping empty document chunk {i+1}")
+            continue
+        tokens = count_tokens(content)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append((doc.metadata.get("chunk_index", i), content, doc.metadata.get("page")))
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _embed_batch(texts):
+    """Embed a batch in one call, falling back to per-text calls if the batch fails."""
+    try:
+        return embedder.embed_documents(texts)
+    except Exception as batch_error:
+        print(f"⚠️ Batch embedding of {len(texts)} chunks failed: {batch_error}, retrying per chunk")
+    vectors = []
+    for text in texts:
+        try:
+            vectors.append(embedder.embed_query(text))
+        except Exception as chunk_error:
+            print(f"⚠️ Error embedding chunk: {chunk_error}")
+            vectors.append(None)
+    return vectors
+
+def _normalize(vec):
+    import numpy as np
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+def embed_and_index_docs(docs, doc_id=None, conversation_id=None, progress_callback=None, tenant=None):
+    """Embed chunks in token-bounded batches and bulk import them into the vector store.
+    
+    tenant is the tenant that receives the vectors when the store is multi-tenant.
+    
+    progress_callback, if given, is called as progress_callback(embedded=n)
+    after every embedding batch and progress_callback(indexed=n, failed=m)
+    once the import has been flushed.
+    
+    Returns a dict with the number of chunks indexed and failed and the
+    document's centroid (the normalized mean of its chunk vectors, None if no
+    chunk was embedded), or None when there is nothing to index or no vector
+    store is available.
+    """
     if not embedder:
         raise RuntimeError("Azure OpenAI embeddings not configured")
-    if not client:
-        print("⚠️ Weaviate client not available. Skipping vector indexing.")
+    if not vector_store:
+        print("⚠️ Vector store not available. Skipping vector indexing.")
         return None
     
     if not docs:
@@ -60,37 +179,48 @@ def embed_and_index_docs(docs, doc_id=None, conversation_id=None):
         return None
     
     try:
-        ensure_weaviate_schema()
-        collection = client.collections.get("DocumentChunk")
-        
-        indexed_count = 0
-        for i, doc in enumerate(docs):
-            try:
-                content = doc.page_content.strip()
-                if not content:
-                    print(f"⚠️ Skipping empty document chunk {i+1}")
-                    continue
-                
-                # Generate embedding
-                vec = embedder.embed_query(content)
-                
-                # Insert into Weaviate
-                collection.data.insert(
-                    properties={
+        embedded_count = 0
+        failed_count = 0
+        vector_sum = None
+        with vector_store.batch_writer(tenant) as batch:
+            for chunk_batch in _iter_embedding_batches(
+                docs, settings.EMBED_BATCH_MAX_TOKENS, settings.EMBED_BATCH_MAX_ITEMS
+            ):
+                vectors = _embed_batch([content for _, content, _ in chunk_batch])
+                for (chunk_index, content, page), vec in zip(chunk_batch, vectors):
+                    if vec is None:
+                        failed_count += 1
+                        continue
+                    properties = {
                         "text": content,
                         "doc_id": doc_id or "",
-                        "conversation_id": conversation_id or ""
-                    },
-                    vector=vec
-                )
-                indexed_count += 1
-                
-            except Exception as chunk_error:
-                print(f"⚠️ Error indexing chunk {i+1}: {chunk_error}")
-                continue
+                        "conversation_id": conversation_id or "",
+                        "chunk_index": chunk_index
+                    }
+                    if page is not None:
+                        properties["page"] = page
+                    batch.add(
+                        properties=properties,
+                        vector=vec,
+                        uuid=generate_uuid5(f"{doc_id}:{chunk_index}")
+                    )
+                    embedded_count += 1
+                    unit = _normalize(vec)
+                    vector_sum = unit if vector_sum is None else vector_sum + unit
+                if progress_callback:
+                    progress_callback(embedded=embedded_count)
+        
+        embedded_count -= batch.failed
+        failed_count += batch.failed
         
-        print(f"✅ Successfully indexed {indexed_count}/{len(docs)} document chunks for doc_id: {doc_id}")
-        return collection
+        if progress_callback:
+            progress_callback(indexed=embedded_count, failed=failed_count)
+        print(f"✅ Successfully indexed {embedded_count}/{embedded_count + failed_count} document chunks for doc_id: {doc_id}")
+        return {
+            "indexed": embedded_count,
+            "failed": failed_count,
+            "centroid": _normalize(vector_sum) if vector_sum is not None else None
+        }
         
     except Exception as e:
         print(f"⚠️ Error in embed_and_index_docs: {e}")
@@ -98,72 +228,162 @@ def embed_and_index_docs(docs, doc_id=None, conversation_id=None):
         traceback.print_exc()
         raise
 
-def retrieve_docs_from_disk(conversation_id, query, k=4):
-    """Fallback: Read documents directly from disk when Weaviate is unavailable"""
-    if not conversation_id:
-        return []
+def _object_to_document(properties, docs_by_key=None):
+    from langchain_core.documents import Document
+    storage_key = properties.get("doc_id", "")
+    record = (docs_by_key or {}).get(storage_key)
+    if record:
+        metadata = {"doc_id": record["id"], "source": record.get("name", "")}
+    else:
+        metadata = {"doc_id": storage_key, "source": storage_key}
+    metadata["storage_key"] = storage_key
+    metadata["chunk_index"] = properties.get("chunk_index")
+    return Document(page_content=properties["text"], metadata=metadata)
+
+def _vector_search(query, limit, store, docs_by_key, tenant=None, vec=None):
+    if vec is None:
+        vec = embedder.embed_query(query)
+    return [
+        (_object_to_document(properties, docs_by_key), score)
+        for properties, score in store.query(vec, limit, list(docs_by_key), tenant=tenant)
+        if properties.get("doc_id") in docs_by_key and properties.get("text", "").strip()
+    ]
+
+def _hybrid_search(query, k, store, docs_by_key, alpha, fusion, tenant=None, vec=None):
+    """Run vector and BM25 searches concurrently and fuse the two rankings.
     
+    alpha weights the vector side (1.0 = vector only, 0.0 = keyword only).
+    """
+    limit = k * settings.HYBRID_CANDIDATE_MULTIPLIER
+    # The vector side runs in the io pool while this thread searches BM25; on
+    # an io worker both run here, so callers cannot fill the pool waiting on it
+    vector_future = None
+    if store and not on_pool_thread("io"):
+        vector_future = get_pool("io").submit(_vector_search, query, limit, store, docs_by_key, tenant, vec)
     try:
-        from app.database import get_uploaded_documents
-        from app.config import settings
-        from app.routers.documents import process_document
-        from langchain_core.documents import Document
-        import os
-        
-        doc_records = get_uploaded_documents(conversation_id)
-        if not doc_records:
-            return []
-        
-        all_docs = []
-        documents_dir = os.path.abspath(settings.DOCUMENTS_DIR)
-        
-        for doc_record in doc_records:
-            doc_id = doc_record["id"]
-            file_type = doc_record.get("file_type", "")
-            file_path = os.path.join(documents_dir, f"{doc_id}{file_type}")
-            
-            if os.path.exists(file_path):
-                try:
-                    with open(file_path, "rb") as f:
-                        file_content = f.read()
-                    
-                    # Process the document
-                    processed_docs = process_document(file_content, file_type)
-                    for doc in processed_docs:
-                        all_docs.append(Document(
-                            page_content=doc.page_content,
-                            metadata={"doc_id": doc_id, "source": doc_record.get("name", "")}
-                        ))
-                except Exception as e:
-                    print(f"⚠️ Error reading document {doc_id}: {e}")
-                    continue
-        
-        if not all_docs:
-            return []
-        
-        # Simple keyword-based ranking (fallback when no vector search)
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
-        
-        scored_docs = []
-        for doc in all_docs:
-            content_lower = doc.page_content.lower()
-            # Count matching words
-            matches = sum(1 for word in query_words if word in content_lower)
-            if matches > 0:
-                scored_docs.append((matches, doc))
-        
-        # Sort by match count and return top k
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
-        return [doc for _, doc in scored_docs[:k]]
-        
-    except Exception as e:
-        print(f"⚠️ Error in disk fallback retrieval: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
+        keyword_results = _keyword_search(query, limit, docs_by_key)
+    except Exception as kw_error:
+        print(f"⚠️ Keyword side of hybrid search failed: {kw_error}")
+        keyword_results = []
+    
+    vector_results = []
+    if store:
+        try:
+            vector_results = vector_future.result() if vector_future else _vector_search(
+                query, limit, store, docs_by_key, tenant, vec
+            )
+        except Exception as vec_error:
+            print(f"⚠️ Vector side of hybrid search failed: {vec_error}")
+    
+    return _fuse(vector_results, keyword_results, k, alpha, fusion)
+
+def _fuse(vector_results, keyword_results, k, alpha, fusion):
+    from app.services.retrieval_fusion import reciprocal_rank_fusion, relative_score_fusion
+    
+    print(f"🔍 Hybrid search: {len(vector_results)} vector + {len(keyword_results)} keyword candidates ({fusion}, alpha={alpha})")
+    if fusion == "relative_score":
+        fused = relative_score_fusion([vector_results, keyword_results], [alpha, 1.0 - alpha])
+    else:
+        fused = reciprocal_rank_fusion(
+            [[doc for doc, _ in vector_results], [doc for doc, _ in keyword_results]],
+            [alpha, 1.0 - alpha],
+            rrf_k=settings.RRF_K
+        )
+    return fused[:k]
+
+def _dedupe_by_content(docs):
+    """Drop chunks whose normalized text was already seen, keeping the best ranked copy."""
+    from app.services.diversify import content_hash
+    seen = set()
+    unique = []
+    for doc in docs:
+        key = content_hash(doc.page_content)
+        if key not in seen:
+            seen.add(key)
+            unique.append(doc)
+    return unique
+
+def _chunk_uuid(doc):
+    return generate_uuid5(f"{doc.metadata.get('storage_key')}:{doc.metadata.get('chunk_index')}")
+
+def _mmr_order(docs, vec, vectors_by_uuid, k, lambda_mult, ranked):
+    """Reorder ranked candidates by MMR over their stored vectors and keep k.
+    
+    With ranked set (fused hybrid results), relevance follows the given order,
+    spread over the candidates' cosine range so it stays comparable to the
+    redundancy term; otherwise relevance is the cosine with the query.
+    Candidates without a stored vector fill any remaining slots in order.
+    """
+    import numpy as np
+    from app.services.diversify import maximal_marginal_relevance, rank_relevance
+    
+    with_vectors = [(doc, vectors_by_uuid[_chunk_uuid(doc)]) for doc in docs if _chunk_uuid(doc) in vectors_by_uuid]
+    if not with_vectors:
+        return docs[:k]
+    candidates = np.asarray([v for _, v in with_vectors], dtype=np.float32)
+    relevance = None
+    if ranked:
+        q = np.asarray(vec, dtype=np.float32)
+        cosine = candidates @ q / (np.linalg.norm(candidates, axis=1) * (np.linalg.norm(q) or 1.0) + 1e-12)
+        relevance = rank_relevance(len(candidates), float(cosine.min()), float(cosine.max()))
+    picked = [with_vectors[i][0] for i in maximal_marginal_relevance(vec, candidates, k, lambda_mult, relevance)]
+    if len(picked) < k:
+        chosen = {id(doc) for doc in picked}
+        picked += [doc for doc in docs if id(doc) not in chosen][:k - len(picked)]
+    return picked
+
+def _diversify(docs, vec, k, store, tenant, lambda_mult, ranked):
+    docs = _dedupe_by_content(docs)
+    if len(docs) <= k:
+        return docs
+    vectors_by_uuid = store.vectors([_chunk_uuid(doc) for doc in docs], tenant=tenant)
+    return _mmr_order(docs, vec, vectors_by_uuid, k, lambda_mult, ranked)
 
-def retrieve_docs(query, k=4, conversation_id=None):
+async def _adiversify(docs, vec, k, store, tenant, lambda_mult, ranked):
+    docs = _dedupe_by_content(docs)
+    if len(docs) <= k:
+        return docs
+    vectors_by_uuid = await asyncio.wait_for(
+        store.avectors([_chunk_uuid(doc) for doc in docs], tenant=tenant),
+        settings.VECTOR_QUERY_TIMEOUT
+    )
+    return _mmr_order(docs, vec, vectors_by_uuid, k, lambda_mult, ranked)
+
+def _retrieval_scope(conversation_id, store):
+    """Return the conversation's indexed documents by storage key, and the tenant to search."""
+    from app.database import get_uploaded_documents
+    doc_records = get_uploaded_documents(conversation_id)
+    # Documents still being ingested have no (or partial) vectors yet.
+    # Vectors are stored under the shared storage key, not the per-upload id.
+    docs_by_key = {doc["storage_key"]: doc for doc in doc_records if doc["status"] == "ready"}
+    tenant = None
+    if store.multi_tenant:
+        from app.database import get_conversation_user
+        from app.services.vector_store import tenant_for_user
+        tenant = tenant_for_user(get_conversation_user(conversation_id))
+    return docs_by_key, tenant
+
+def _retrieval_options(mode, alpha, fusion, diversify, mmr_lambda):
+    return (
+        mode or settings.RETRIEVAL_MODE,
+        settings.HYBRID_ALPHA if alpha is None else min(max(float(alpha), 0.0), 1.0),
+        fusion or settings.HYBRID_FUSION,
+        settings.RETRIEVAL_DIVERSIFY if diversify is None else bool(diversify),
+        settings.MMR_LAMBDA if mmr_lambda is None else min(max(float(mmr_lambda), 0.0), 1.0)
+    )
+
+def retrieve_docs(query, k=4, conversation_id=None, mode=None, alpha=None, fusion=None, diversify=None, mmr_lambda=None):
+    """Retrieve the k most relevant chunks, scoped to a conversation's documents if given.
+    
+    mode is "vector" or "hybrid" (vector + BM25 fused by fusion, either "rrf" or
+    "relative_score", with alpha weighting the vector side). With diversify,
+    k * MMR_FETCH_MULTIPLIER candidates are fetched, chunks with duplicate
+    text dropped, and k picked by maximal marginal relevance (mmr_lambda 1.0
+    is pure relevance, lower favours variety). Defaults come from settings.
+    """
+    mode, alpha, fusion, diversify, mmr_lambda = _retrieval_options(mode, alpha, fusion, diversify, mmr_lambda)
+    fetch_k = k * settings.MMR_FETCH_MULTIPLIER if diversify else k
+    
     if not embedder:
         print("⚠️ Embedder not initialized")
         # Try disk fallback
@@ -171,8 +391,9 @@ def retrieve_docs(query, k=4, conversation_id=None):
             print("🔄 Trying disk fallback retrieval...")
             return retrieve_docs_from_disk(conversation_id, query, k)
         return []
-    if not client:
-        print("⚠️ Weaviate client not initialized")
+    store = vector_store
+    if not store:
+        print("⚠️ Vector store not initialized")
         # Try disk fallback
         if conversation_id:
             print("🔄 Trying disk fallback retrieval...")
@@ -180,53 +401,52 @@ def retrieve_docs(query, k=4, conversation_id=None):
         return []
     
     try:
-        ensure_weaviate_schema()
-        
-        if not client.collections.exists("DocumentChunk"):
-            print("⚠️ DocumentChunk collection does not exist")
-            # Try disk fallback
-            if conversation_id:
-                print("🔄 Trying disk fallback retrieval...")
-                return retrieve_docs_from_disk(conversation_id, query, k)
-            return []
-        
-        collection = client.collections.get("DocumentChunk")
-        
         if conversation_id:
-            from app.database import get_uploaded_documents
-            doc_records = get_uploaded_documents(conversation_id)
-            doc_ids = [doc["id"] for doc in doc_records]
+            docs_by_key, tenant = _retrieval_scope(conversation_id, store)
+            doc_ids = list(docs_by_key)
             
             print(f"🔍 Retrieving docs for conversation {conversation_id}, doc_ids: {doc_ids}")
             
             if not doc_ids:
-                print("⚠️ No document IDs found for conversation")
+                print("⚠️ No indexed document IDs found for conversation")
                 return []
             
+            vec = None
+            if diversify:
+                try:
+                    vec = embedder.embed_query(query)
+                except Exception as embed_error:
+                    print(f"⚠️ Query embedding failed, skipping diversification: {embed_error}")
+                    diversify, fetch_k = False, k
+            
+            def narrow(docs, ranked):
+                if not diversify:
+                    return docs[:k]
+                try:
+                    return _diversify(docs, vec, k, store, tenant, mmr_lambda, ranked)
+                except Exception as mmr_error:
+                    print(f"⚠️ Diversification failed: {mmr_error}")
+                    return _dedupe_by_content(docs)[:k]
+            
+            if mode == "hybrid":
+                try:
+                    hybrid_docs = narrow(_hybrid_search(query, fetch_k, store, docs_by_key, alpha, fusion, tenant, vec), ranked=True)
+                    if hybrid_docs:
+                        print(f"✅ Hybrid search found {len(hybrid_docs)} documents")
+                        return hybrid_docs
+                    print("⚠️ Hybrid search returned no matching documents, trying fallback...")
+                except Exception as hybrid_error:
+                    print(f"⚠️ Hybrid search failed: {hybrid_error}, trying fallback...")
+            
             # Try vector search first
             try:
-                vec = embedder.embed_query(query)
-                from weaviate.classes.query import Filter
-                
-                res = collection.query.near_vector(
-                    near_vector=vec,
-                    limit=k * 3,  # Get more results to filter
-                    filters=Filter.by_property("doc_id").contains_any(doc_ids)
-                )
-                
-                from langchain_core.documents import Document
                 filtered_docs = [
-                    Document(
-                        page_content=o.properties["text"],
-                        metadata={"doc_id": o.properties.get("doc_id", ""), "source": o.properties.get("doc_id", "")}
-                    ) 
-                    for o in res.objects 
-                    if o.properties.get("doc_id") in doc_ids and o.properties.get("text", "").strip()
+                    doc for doc, _ in _vector_search(query, max(k * 3, fetch_k), store, docs_by_key, tenant, vec)  # Get more results to filter
                 ]
                 
                 if filtered_docs:
                     print(f"✅ Vector search found {len(filtered_docs)} documents")
-                    return filtered_docs[:k]
+                    return narrow(filtered_docs, ranked=False)
                 else:
                     print("⚠️ Vector search returned no matching documents, trying fallback...")
             except Exception as vec_error:
@@ -234,22 +454,13 @@ def retrieve_docs(query, k=4, conversation_id=None):
             
             # Fallback: fetch all chunks from these documents
             try:
-                from weaviate.classes.query import Filter
-                from langchain_core.documents import Document
-                
-                res = collection.query.fetch_objects(
-                    limit=min(k * 2, 20),
-                    filters=Filter.by_property("doc_id").contains_any(doc_ids)
-                )
+                objects = store.fetch(doc_ids, min(k * 2, 20), tenant=tenant)
                 
-                if res.objects:
+                if objects:
                     fallback_docs = [
-                        Document(
-                            page_content=o.properties["text"],
-                            metadata={"doc_id": o.properties.get("doc_id", ""), "source": o.properties.get("doc_id", "")}
-                        )
-                        for o in res.objects
-                        if o.properties.get("text", "").strip()
+                        _object_to_document(properties, docs_by_key)
+                        for properties in objects
+                        if properties.get("text", "").strip()
                     ]
                     if fallback_docs:
                         print(f"✅ Fallback retrieval found {len(fallback_docs)} documents")
@@ -258,21 +469,19 @@ def retrieve_docs(query, k=4, conversation_id=None):
                 print(f"⚠️ Fallback retrieval also failed: {fallback_error}")
             
             # Final fallback: try disk retrieval
-            print("🔄 Weaviate retrieval failed, trying disk fallback...")
+            print("🔄 Vector store retrieval failed, trying disk fallback...")
             return retrieve_docs_from_disk(conversation_id, query, k)
         else:
             # No conversation_id - search all documents
+            if store.multi_tenant:
+                print("⚠️ Unscoped search is not available with per-user tenants")
+                return []
             try:
                 vec = embedder.embed_query(query)
-                res = collection.query.near_vector(near_vector=vec, limit=k)
-                from langchain_core.documents import Document
                 docs = [
-                    Document(
-                        page_content=o.properties["text"],
-                        metadata={"doc_id": o.properties.get("doc_id", ""), "source": o.properties.get("doc_id", "")}
-                    )
-                    for o in res.objects
-                    if o.properties.get("text", "").strip()
+                    _object_to_document(properties)
+                    for properties, _ in store.query(vec, k)
+                    if properties.get("text", "").strip()
                 ]
                 print(f"✅ Retrieved {len(docs)} documents (no conversation filter)")
                 return docs
@@ -280,93 +489,313 @@ def retrieve_docs(query, k=4, conversation_id=None):
                 print(f"⚠️ Error in global search: {e}")
                 return []
     except Exception as e:
-        print(f"⚠️ Error retrieving docs from Weaviate: {e}")
+        print(f"⚠️ Error retrieving docs from {store.name} vector store: {e}")
         import traceback
         traceback.print_exc()
         return []
 
+async def _avector_search(query, limit, store, docs_by_key, tenant=None, vec=None):
+    if vec is None:
+        vec = await asyncio.wait_for(embedder.aembed_query(query), settings.EMBED_QUERY_TIMEOUT)
+    results = await asyncio.wait_for(
+        store.aquery(vec, limit, list(docs_by_key), tenant=tenant),
+        settings.VECTOR_QUERY_TIMEOUT
+    )
+    return [
+        (_object_to_document(properties, docs_by_key), score)
+        for properties, score in results
+        if properties.get("doc_id") in docs_by_key and properties.get("text", "").strip()
+    ]
+
+async def _ahybrid_search(query, k, store, docs_by_key, alpha, fusion, tenant=None, vec=None):
+    limit = k * settings.HYBRID_CANDIDATE_MULTIPLIER
+    vector_side = _avector_search(query, limit, store, docs_by_key, tenant, vec) if store else asyncio.sleep(0, [])
+    vector_results, keyword_results = await asyncio.gather(
+        vector_side,
+        run_io(_keyword_search, query, limit, docs_by_key),
+        return_exceptions=True
+    )
+    if isinstance(vector_results, Exception):
+        print(f"⚠️ Vector side of hybrid search failed: {vector_results!r}")
+        vector_results = []
+    if isinstance(keyword_results, Exception):
+        print(f"⚠️ Keyword side of hybrid search failed: {keyword_results!r}")
+        keyword_results = []
+    return _fuse(vector_results, keyword_results, k, alpha, fusion)
+
+async def aretrieve_docs(
+    query, k=4, conversation_id=None, mode=None, alpha=None, fusion=None,
+    diversify=None, mmr_lambda=None, timeout=None
+):
+    """Async version of retrieve_docs that does not block the event loop.
+    
+    The query embedding and the vector query run on the async clients with
+    EMBED_QUERY_TIMEOUT and VECTOR_QUERY_TIMEOUT; BM25 and database lookups
+    run on the shared io and db pools. If the whole retrieval exceeds timeout (default
+    RETRIEVAL_TIMEOUT) it is cancelled and the stored chunks are searched
+    instead. Cancelling the caller cancels any request still in flight.
+    """
+    timeout = settings.RETRIEVAL_TIMEOUT if timeout is None else timeout
+    try:
+        return await asyncio.wait_for(
+            _aretrieve_docs(query, k, conversation_id, mode, alpha, fusion, diversify, mmr_lambda),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        print(f"⚠️ Retrieval timed out after {timeout}s, trying disk fallback...")
+        if conversation_id:
+            return await run_io(retrieve_docs_from_disk, conversation_id, query, k)
+        return []
+
+async def _aretrieve_docs(query, k, conversation_id, mode, alpha, fusion, diversify, mmr_lambda):
+    mode, alpha, fusion, diversify, mmr_lambda = _retrieval_options(mode, alpha, fusion, diversify, mmr_lambda)
+    fetch_k = k * settings.MMR_FETCH_MULTIPLIER if diversify else k
+    store = vector_store
+    
+    if not embedder or not store:
+        print("⚠️ Embedder not initialized" if not embedder else "⚠️ Vector store not initialized")
+        if conversation_id:
+            print("🔄 Trying disk fallback retrieval...")
+            return await run_io(retrieve_docs_from_disk, conversation_id, query, k)
+        return []
+    
+    if not conversation_id:
+        if store.multi_tenant:
+            print("⚠️ Unscoped search is not available with per-user tenants")
+            return []
+        try:
+            vec = await asyncio.wait_for(embedder.aembed_query(query), settings.EMBED_QUERY_TIMEOUT)
+            results = await asyncio.wait_for(store.aquery(vec, k), settings.VECTOR_QUERY_TIMEOUT)
+            docs = [_object_to_document(properties) for properties, _ in results if properties.get("text", "").strip()]
+            print(f"✅ Retrieved {len(docs)} documents (no conversation filter)")
+            return docs
+        except Exception as e:
+            print(f"⚠️ Error in global search: {e!r}")
+            return []
+    
+    try:
+        docs_by_key, tenant = await run_db(_retrieval_scope, conversation_id, store)
+    except Exception as e:
+        print(f"⚠️ Error loading documents for conversation {conversation_id}: {e}")
+        return []
+    doc_ids = list(docs_by_key)
+    print(f"🔍 Retrieving docs for conversation {conversation_id}, doc_ids: {doc_ids}")
+    if not doc_ids:
+        print("⚠️ No indexed document IDs found for conversation")
+        return []
+    
+    vec = None
+    if diversify:
+        try:
+            vec = await asyncio.wait_for(embedder.aembed_query(query), settings.EMBED_QUERY_TIMEOUT)
+        except Exception as embed_error:
+            print(f"⚠️ Query embedding failed, skipping diversification: {embed_error!r}")
+            diversify, fetch_k = False, k
+    
+    async def narrow(docs, ranked):
+        if not diversify:
+            return docs[:k]
+        try:
+            return await _adiversify(docs, vec, k, store, tenant, mmr_lambda, ranked)
+        except Exception as mmr_error:
+            print(f"⚠️ Diversification failed: {mmr_error!r}")
+            return _dedupe_by_content(docs)[:k]
+    
+    if mode == "hybrid":
+        try:
+            hybrid_docs = await narrow(
+                await _ahybrid_search(query, fetch_k, store, docs_by_key, alpha, fusion, tenant, vec),
+                ranked=True
+            )
+            if hybrid_docs:
+                print(f"✅ Hybrid search found {len(hybrid_docs)} documents")
+                return hybrid_docs
+            print("⚠️ Hybrid search returned no matching documents, trying fallback...")
+        except Exception as hybrid_error:
+            print(f"⚠️ Hybrid search failed: {hybrid_error!r}, trying fallback...")
+    
+    try:
+        filtered_docs = [
+            doc for doc, _ in await _avector_search(query, max(k * 3, fetch_k), store, docs_by_key, tenant, vec)
+        ]
+        if filtered_docs:
+            print(f"✅ Vector search found {len(filtered_docs)} documents")
+            return await narrow(filtered_docs, ranked=False)
+        print("⚠️ Vector search returned no matching documents, trying fallback...")
+    except Exception as vec_error:
+        print(f"⚠️ Vector search failed: {vec_error!r}, trying fallback...")
+    
+    try:
+        objects = await asyncio.wait_for(
+            store.afetch(doc_ids, min(k * 2, 20), tenant=tenant),
+            settings.VECTOR_QUERY_TIMEOUT
+        )
+        fallback_docs = [
+            _object_to_document(properties, docs_by_key)
+            for properties in objects
+            if properties.get("text", "").strip()
+        ]
+        if fallback_docs:
+            print(f"✅ Fallback retrieval found {len(fallback_docs)} documents")
+            return fallback_docs[:k]
+    except Exception as fallback_error:
+        print(f"⚠️ Fallback retrieval also failed: {fallback_error!r}")
+    
+    print("🔄 Vector store retrieval failed, trying disk fallback...")
+    return await run_io(retrieve_docs_from_disk, conversation_id, query, k)
+
 def get_client():
     return client
 
+def get_vector_store():
+    return vector_store
+
+def sync_document_tenants(storage_key):
+    """Give every user holding a document a copy of its vectors in their tenant.
+    
+    Vectors are indexed once, into the tenant of the user whose upload was
+    ingested; users who uploaded the same file are served by copying them.
+    """
+    if not vector_store or not vector_store.multi_tenant:
+        return 0
+    from app.database import get_document_blob_users, get_document_blob_tenants
+    from app.services.vector_store import tenant_for_user
+    
+    present = get_document_blob_tenants(storage_key)
+    if not present:
+        return 0
+    copied = 0
+    for tenant in {tenant_for_user(user_id) for user_id in get_document_blob_users(storage_key)} - set(present):
+        count = vector_store.copy_document(storage_key, present[0], tenant)
+        print(f"📋 Copied {count} vectors of {storage_key[:12]} to tenant {tenant}")
+        copied += count
+    return copied
+
+def release_document_tenant(storage_key, user_id):
+    """Drop a user's tenant copy of a document once they no longer hold any upload of it."""
+    if not vector_store or not vector_store.multi_tenant:
+        return
+    from app.database import get_document_blob_users
+    if user_id in get_document_blob_users(storage_key):
+        return
+    from app.services.vector_store import tenant_for_user
+    try:
+        vector_store.delete(storage_key, tenant=tenant_for_user(user_id))
+    except Exception as e:
+        print(f"⚠️ Error removing {storage_key[:12]} from tenant of user {user_id}: {e}")
+
+async def tenant_idle_sweeper(interval_seconds=60):
+    """Periodically deactivate tenants idle for WEAVIATE_TENANT_IDLE_MINUTES."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        if not vector_store or not vector_store.multi_tenant:
+            continue
+        try:
+            await run_io(
+                vector_store.deactivate_idle_tenants,
+                settings.WEAVIATE_TENANT_IDLE_MINUTES * 60,
+                settings.WEAVIATE_TENANT_IDLE_ACTION
+            )
+        except Exception as e:
+            print(f"⚠️ Tenant idle sweep failed: {e}")
+
 def get_embedder():
     return embedder
 
+def _backfill_chunk_store(doc_record):
+    """Parse a document uploaded before the chunk store existed and persist its chunks."""
+    from app.services.executors import get_pool
+    from app.services.ingestion_service import _iter_document_chunks
+    from app.services.chunk_store import store_chunks, load_chunks
+    from app.services.document_service import get_document_path
+    import os
+    
+    file_path = get_document_path(doc_record["storage_key"], doc_record["storage_file_type"])
+    if not os.path.exists(file_path):
+        print(f"⚠️ Document file not found: {file_path}")
+        return []
+    
+    print(f"🔄 Backfilling chunk store for {doc_record.get('name', doc_record['id'])}")
+    store_chunks(
+        doc_record["storage_key"],
+        get_pool("cpu").iterate(_iter_document_chunks, file_path, doc_record["storage_file_type"])
+    )
+    return load_chunks(doc_record["storage_key"])
+
+def _chunk_to_document(storage_key, chunk, doc_record):
+    from langchain_core.documents import Document
+    return Document(
+        page_content=chunk.page_content,
+        metadata={
+            "doc_id": doc_record["id"],
+            "source": doc_record.get("name", ""),
+            "storage_key": storage_key,
+            "chunk_index": chunk.metadata["chunk_index"]
+        }
+    )
+
+def _keyword_search(query, limit, docs_by_key):
+    """BM25 search over the stored chunks of the given documents. Returns (Document, score) pairs."""
+    from app.services.chunk_store import load_chunks, has_chunks
+    from app.services.bm25_index import search_bm25
+    
+    searchable = {}
+    for storage_key, doc_record in docs_by_key.items():
+        if doc_record["status"] != "ready":
+            print(f"⏳ Skipping document still being indexed: {doc_record.get('name', doc_record['id'])}")
+            continue
+        try:
+            if has_chunks(storage_key) or _backfill_chunk_store(doc_record):
+                searchable[storage_key] = doc_record
+        except Exception as e:
+            print(f"⚠️ Error reading document {doc_record['id']}: {e}")
+    if not searchable:
+        return []
+    
+    hits = search_bm25(list(searchable), query, k=limit)
+    
+    wanted = {}
+    for storage_key, chunk_index, _ in hits:
+        wanted.setdefault(storage_key, []).append(chunk_index)
+    chunks_by_hit = {}
+    for storage_key, chunk_indexes in wanted.items():
+        for chunk in load_chunks(storage_key, chunk_indexes):
+            chunks_by_hit[(storage_key, chunk.metadata["chunk_index"])] = chunk
+    
+    return [
+        (_chunk_to_document(storage_key, chunks_by_hit[(storage_key, chunk_index)], searchable[storage_key]), score)
+        for storage_key, chunk_index, score in hits
+        if (storage_key, chunk_index) in chunks_by_hit
+    ]
+
 def retrieve_docs_from_disk(conversation_id, query, k=4):
-    """Fallback: Read documents directly from disk when Weaviate is unavailable"""
+    """Fallback: Read persisted document chunks when Weaviate is unavailable"""
     if not conversation_id:
         return []
     
     try:
         from app.database import get_uploaded_documents
-        from app.config import settings
-        from app.routers.documents import process_document
-        from langchain_core.documents import Document
-        import os
+        from app.services.chunk_store import load_chunks, has_chunks
         
         doc_records = get_uploaded_documents(conversation_id)
         if not doc_records:
             print("⚠️ No documents found in database for disk fallback")
             return []
         
-        print(f"🔄 Reading {len(doc_records)} document(s) from disk...")
-        all_docs = []
-        documents_dir = os.path.abspath(settings.DOCUMENTS_DIR)
+        docs_by_key = {doc["storage_key"]: doc for doc in doc_records}
+        results = _keyword_search(query, k, docs_by_key)
+        if results:
+            print(f"✅ Disk fallback found {len(results)} relevant document chunks")
+            return [doc for doc, _ in results]
         
-        for doc_record in doc_records:
-            doc_id = doc_record["id"]
-            file_type = doc_record.get("file_type", "")
-            file_path = os.path.join(documents_dir, f"{doc_id}{file_type}")
-            
-            if os.path.exists(file_path):
-                try:
-                    with open(file_path, "rb") as f:
-                        file_content = f.read()
-                    
-                    # Process the document
-                    processed_docs = process_document(file_content, file_type)
-                    for doc in processed_docs:
-                        all_docs.append(Document(
-                            page_content=doc.page_content,
-                            metadata={"doc_id": doc_id, "source": doc_record.get("name", "")}
-                        ))
-                    print(f"✅ Loaded document: {doc_record.get('name', doc_id)}")
-                except Exception as e:
-                    print(f"⚠️ Error reading document {doc_id}: {e}")
-                    continue
-            else:
-                print(f"⚠️ Document file not found: {file_path}")
-        
-        if not all_docs:
-            print("⚠️ No document content extracted from disk")
-            return []
-        
-        # Simple keyword-based ranking (fallback when no vector search)
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
-        
-        scored_docs = []
-        for doc in all_docs:
-            content_lower = doc.page_content.lower()
-            # Count matching words
-            matches = sum(1 for word in query_words if word in content_lower)
-            # Also check for phrase matches
-            if query_lower in content_lower:
-                matches += 10  # Boost for exact phrase
-            if matches > 0:
-                scored_docs.append((matches, doc))
-        
-        # Sort by match count and return top k
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
-        result = [doc for _, doc in scored_docs[:k]]
-        
-        if result:
-            print(f"✅ Disk fallback found {len(result)} relevant document chunks")
-        else:
-            # If no matches, return first k documents anyway
-            result = all_docs[:k]
-            print(f"✅ Disk fallback returning {len(result)} document chunks (no keyword matches)")
-        
-        return result
+        # If no matches, return the first k chunks anyway
+        for storage_key, doc_record in docs_by_key.items():
+            if doc_record["status"] == "ready" and has_chunks(storage_key):
+                result = [_chunk_to_document(storage_key, chunk, doc_record) for chunk in load_chunks(storage_key)[:k]]
+                print(f"✅ Disk fallback returning {len(result)} document chunks (no keyword matches)")
+                return result
+        print("⚠️ No document content extracted from disk")
+        return []
         
     except Exception as e:
         print(f"⚠️ Error in disk fallback retrieval: {e}")
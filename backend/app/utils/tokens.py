@@ -0,0 +1,32 @@
+from functools import lru_cache
+from typing import Optional
+
+DEFAULT_ENCODING = "cl100k_base"
+
+@lru_cache(maxsize=8)
+def get_encoding(model: Optional[str] = None):
+    """Return a tiktoken encoding for the model, or None if tiktoken is unavailable."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        if model:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                pass
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # tiktoken downloads encodings on first use, which fails on offline hosts
+        print(f"⚠️ tiktoken encoding unavailable, estimating token counts: {e}")
+        return None
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Rough estimate used by OpenAI for English text
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,92 @@
+"""Recall and throughput of the IVF index against brute force.
+
+Vectors are drawn around random cluster centres so the corpus has the kind of
+structure real embeddings have. Recall@k is the fraction of the exact top k
+(by brute force) that the IVF search returns. Large corpora are generated
+into a temporary memmap, the same way the local vector store holds them.
+
+Run from the backend directory:
+    python -m benchmarks.bench_ann --vectors 100000,1000000 --nprobe 4,16,64
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.ann_index import IVFIndex
+
+def make_corpus(n, dim, n_clusters, spread, path, rng):
+    matrix = np.memmap(path, dtype=np.float32, mode="w+", shape=(n, dim))
+    centres = rng.standard_normal((n_clusters, dim), dtype=np.float32)
+    for start in range(0, n, 100000):
+        m = min(100000, n - start)
+        block = centres[rng.integers(0, n_clusters, m)] + spread * rng.standard_normal((m, dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        matrix[start:start + m] = block
+    matrix.flush()
+    return matrix
+
+def exact_top_k(matrix, queries, k):
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, len(matrix), 100000):
+        scores = queries @ np.asarray(matrix[start:start + 100000]).T
+        rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return best_rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", default="100000", help="comma-separated corpus sizes")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--spread", type=float, default=1.2, help="noise around cluster centres; higher is harder")
+    parser.add_argument("--nprobe", default="4,16,64")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(3)
+    workdir = tempfile.mkdtemp()
+    print(f"{'vectors':>10}{'nlist':>7}{'nprobe':>8}{'recall@k':>10}{'QPS':>10}")
+    for n in (int(v) for v in args.vectors.split(",")):
+        path = os.path.join(workdir, f"corpus-{n}.f32")
+        matrix = make_corpus(n, args.dim, args.clusters, args.spread, path, rng)
+        queries = np.asarray(matrix[rng.choice(n, args.queries, replace=False)])
+        queries = queries + 0.1 * rng.standard_normal(queries.shape, dtype=np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        truth = exact_top_k(matrix, queries, args.k)
+        # One query at a time, the way the store serves them
+        timed = queries[:20]
+        start = time.perf_counter()
+        for q in timed:
+            exact_top_k(matrix, q[None, :], args.k)
+        brute_qps = len(timed) / (time.perf_counter() - start)
+
+        nlist = int(4 * np.sqrt(n))
+        start = time.perf_counter()
+        index = IVFIndex.train(matrix, nlist)
+        index.probe(queries[0], 1)
+        train_s = time.perf_counter() - start
+        print(f"{n:>10}{'-':>7}{'exact':>8}{1.0:>10.3f}{brute_qps:>10.1f}   (IVF trained in {train_s:.1f}s)")
+
+        for nprobe in (int(p) for p in args.nprobe.split(",")):
+            hits = 0
+            start = time.perf_counter()
+            for q, expected in zip(queries, truth):
+                rows, _ = index.search(matrix, q, args.k, nprobe)
+                hits += len(np.intersect1d(rows, expected))
+            qps = args.queries / (time.perf_counter() - start)
+            print(f"{n:>10}{nlist:>7}{nprobe:>8}{hits / truth.size:>10.3f}{qps:>10.1f}")
+        del matrix
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
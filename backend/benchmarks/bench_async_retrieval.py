@@ -0,0 +1,90 @@
+"""Throughput of concurrent chats with blocking and async retrieval.
+
+Each simulated chat retrieves context for a conversation and then awaits an
+LLM call. "sync" calls retrieve_docs from the coroutine, the way
+handle_rag_query used to, so every embedding and vector query blocks the
+event loop; "async" awaits aretrieve_docs. Embeddings and the vector store
+are the in-process fakes; BM25 runs for real over a small stored document.
+
+Run from the backend directory:
+    python -m benchmarks.bench_async_retrieval --chats 50
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from app.config import settings
+
+def setup(tmp, embed_rtt, vector_rtt):
+    settings.DB_PATH = os.path.join(tmp, "app.db")
+    settings.DOCUMENTS_DIR = os.path.join(tmp, "docs")
+    settings.BM25_INDEX_DIR = os.path.join(tmp, "docs", "bm25")
+    from app.database import init_db, ensure_conversation, add_uploaded_document_record
+    from app.services import weaviate_service
+    from app.services.chunk_store import store_chunks
+    from benchmarks.fakes import FakeEmbedder, FakeVectorStore, make_docs
+
+    init_db()
+    conversation_id = ensure_conversation(None)
+    add_uploaded_document_record(conversation_id, "bench-doc", "bench.txt", ".txt")
+    docs = make_docs(200, words_per_chunk=80)
+    for i, doc in enumerate(docs):
+        doc.metadata["chunk_index"] = i
+    store_chunks("bench-doc", docs)
+    weaviate_service.embedder = FakeEmbedder(dim=64, rtt=embed_rtt)
+    weaviate_service.vector_store = FakeVectorStore(
+        [{"text": doc.page_content, "doc_id": "bench-doc", "chunk_index": i} for i, doc in enumerate(docs)],
+        rtt=vector_rtt
+    )
+    return conversation_id
+
+async def run(chats, retrieve, llm_rtt):
+    latencies = []
+
+    async def chat(i):
+        start = time.perf_counter()
+        docs = await retrieve(f"word{i % 997} word{(i * 13) % 997}")
+        assert docs
+        await asyncio.sleep(llm_rtt)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(i) for i in range(chats)))
+    return time.perf_counter() - start, sorted(latencies)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--embed-rtt", type=float, default=0.05)
+    parser.add_argument("--vector-rtt", type=float, default=0.03)
+    parser.add_argument("--llm-rtt", type=float, default=0.5)
+    parser.add_argument("--mode", default="hybrid", choices=["vector", "hybrid"])
+    args = parser.parse_args()
+
+    conversation_id = setup(tempfile.mkdtemp(), args.embed_rtt, args.vector_rtt)
+    from app.services.weaviate_service import retrieve_docs, aretrieve_docs
+
+    async def blocking(query):
+        return retrieve_docs(query, k=8, conversation_id=conversation_id, mode=args.mode)
+
+    async def non_blocking(query):
+        return await aretrieve_docs(query, k=8, conversation_id=conversation_id, mode=args.mode)
+
+    # Warm the BM25 index and chunk store
+    asyncio.run(run(1, non_blocking, 0))
+
+    results = []
+    for name, retrieve in (("sync", blocking), ("async", non_blocking)):
+        wall, latencies = asyncio.run(run(args.chats, retrieve, args.llm_rtt))
+        results.append((name, wall, latencies))
+
+    print(f"{'retrieval':<10}{'chats':>6}{'wall s':>8}{'chats/s':>9}{'p50 ms':>8}{'p95 ms':>8}")
+    for name, wall, latencies in results:
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        print(f"{name:<10}{args.chats:>6}{wall:>8.2f}{args.chats / wall:>9.1f}{p50:>8.0f}{p95:>8.0f}")
+
+if __name__ == "__main__":
+    main()
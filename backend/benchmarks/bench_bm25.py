@@ -0,0 +1,96 @@
+"""Compare the substring keyword scorer with the BM25 index on a synthetic corpus.
+
+Each query targets one chunk that contains a rare identifier, so the hit
+rate shows whether that chunk makes it into the top k.
+
+Run from the backend directory:
+    python -m benchmarks.bench_bm25 --chunks 20000
+"""
+import argparse
+import random
+import time
+
+from app.services.bm25_index import BM25Index, search_bm25, _cache
+
+def legacy_keyword_search(chunks, query, k):
+    """The original disk fallback scorer."""
+    query_lower = query.lower()
+    query_words = set(query_lower.split())
+    scored = []
+    for i, text in enumerate(chunks):
+        content_lower = text.lower()
+        matches = sum(1 for word in query_words if word in content_lower)
+        if query_lower in content_lower:
+            matches += 10
+        if matches > 0:
+            scored.append((matches, i))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [i for _, i in scored[:k]]
+
+def make_corpus(n_chunks, words_per_chunk, rng):
+    vocab = [f"term{i}" for i in range(5000)] + ["course", "requirements", "exam", "level", "the", "for"]
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    chunks = []
+    for _ in range(n_chunks):
+        chunks.append(" ".join(rng.choices(vocab, weights=weights, k=words_per_chunk)))
+    targets = rng.sample(range(n_chunks), 100)
+    for j, t in enumerate(targets):
+        chunks[t] += f" The exam level for course CS-{9000 + j} is advanced."
+    queries = [(f"what is the exam level for course CS-{9000 + j}", t) for j, t in enumerate(targets)]
+    return chunks, queries
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=150)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    
+    rng = random.Random(11)
+    chunks, queries = make_corpus(args.chunks, args.words, rng)
+    queries = queries[:args.queries]
+    
+    start = time.perf_counter()
+    index = BM25Index()
+    for i, text in enumerate(chunks):
+        index.add(i, text)
+    index._compact()
+    build_s = time.perf_counter() - start
+    _cache("bench", index)
+    
+    results = {}
+    for name, search in (
+        ("legacy", lambda q: legacy_keyword_search(chunks, q, args.k)),
+        ("bm25", lambda q: [c for _, c, _ in search_bm25(["bench"], q, k=args.k)]),
+    ):
+        hits = 0
+        start = time.perf_counter()
+        for query, target in queries:
+            hits += target in search(query)
+        elapsed = time.perf_counter() - start
+        results[name] = (elapsed / len(queries) * 1000, hits / len(queries))
+    
+    try:
+        from rank_bm25 import BM25Okapi
+        from app.services.bm25_index import tokenize
+        start = time.perf_counter()
+        okapi = BM25Okapi([tokenize(t) for t in chunks])
+        okapi_build = time.perf_counter() - start
+        hits = 0
+        start = time.perf_counter()
+        for query, target in queries:
+            scores = okapi.get_scores(tokenize(query))
+            hits += target in sorted(range(len(scores)), key=lambda i: -scores[i])[:args.k]
+        results["rank_bm25"] = ((time.perf_counter() - start) / len(queries) * 1000, hits / len(queries))
+        print(f"rank_bm25 build: {okapi_build:.2f}s")
+    except ImportError:
+        pass
+    
+    print(f"corpus: {args.chunks} chunks, BM25Index build: {build_s:.2f}s")
+    print(f"{'scorer':<12}{'ms/query':>10}{f'hit@{args.k}':>10}")
+    for name, (ms, hit_rate) in results.items():
+        print(f"{name:<12}{ms:>10.2f}{hit_rate:>10.0%}")
+
+if __name__ == "__main__":
+    main()
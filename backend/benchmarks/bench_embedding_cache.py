@@ -0,0 +1,63 @@
+"""Measure query embedding latency with and without the embedding cache.
+
+Run from the backend directory:
+    python -m benchmarks.bench_embedding_cache --queries 500 --distinct 50
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from benchmarks.fakes import FakeEmbedder
+
+def run(embedder, queries):
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        embedder.embed_query(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def describe(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<10}{statistics.mean(latencies):>10.2f}{statistics.median(latencies):>10.2f}{p95:>10.2f}{sum(latencies) / 1000:>10.2f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=50)
+    parser.add_argument("--rtt", type=float, default=0.08)
+    args = parser.parse_args()
+    
+    # Zipf-like popularity: a few questions are asked far more often than the rest
+    rng = random.Random(7)
+    pool = [f"What are the requirements for course CS-{100 + i}?" for i in range(args.distinct)]
+    weights = [1 / (i + 1) for i in range(args.distinct)]
+    queries = rng.choices(pool, weights=weights, k=args.queries)
+    # Whitespace variations normalize to the same cache key
+    queries = [q if rng.random() < 0.8 else f"  {q}\n" for q in queries]
+    
+    uncached = run(FakeEmbedder(rtt=args.rtt), queries)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = EmbeddingCache(
+            os.path.join(tmp, "embedding_cache.db"),
+            memory_max_bytes=8 * 1024 * 1024,
+            disk_max_bytes=64 * 1024 * 1024,
+        )
+        inner = FakeEmbedder(rtt=args.rtt)
+        cached = run(CachedEmbeddings(inner, cache, "bench-deployment"), queries)
+        stats = cache.get_stats()
+    
+    print(f"{'mode':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    describe("uncached", uncached)
+    describe("cached", cached)
+    print(f"upstream calls: {len(queries)} -> {inner.calls}, hit rate: {stats['hit_rate']:.1%}")
+    print(f"latency saved: {(sum(uncached) - sum(cached)) / 1000:.2f}s over {len(queries)} queries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Compare the per-chunk ingestion loop with batched embedding and bulk import.
+
+Run from the backend directory:
+    python -m benchmarks.bench_ingest --chunks 500
+"""
+import argparse
+import time
+
+from app.services import weaviate_service
+from app.services.vector_store import WeaviateVectorStore
+from benchmarks.fakes import FakeEmbedder, FakeWeaviateClient, make_docs
+
+def legacy_embed_and_index(docs, collection, embedder, doc_id):
+    """The original loop: one embedding call and one insert per chunk."""
+    indexed = 0
+    for doc in docs:
+        content = doc.page_content.strip()
+        if not content:
+            continue
+        vec = embedder.embed_query(content)
+        collection.data.insert(
+            properties={"text": content, "doc_id": doc_id, "conversation_id": ""},
+            vector=vec
+        )
+        indexed += 1
+    return indexed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--embed-rtt", type=float, default=0.05)
+    parser.add_argument("--weaviate-rtt", type=float, default=0.02)
+    args = parser.parse_args()
+    
+    docs = make_docs(args.chunks)
+    
+    embedder = FakeEmbedder(rtt=args.embed_rtt)
+    client = FakeWeaviateClient(rtt=args.weaviate_rtt)
+    collection = client.collections.get("DocumentChunk")
+    start = time.perf_counter()
+    legacy_count = legacy_embed_and_index(docs, collection, embedder, "legacy")
+    legacy_elapsed = time.perf_counter() - start
+    legacy_calls = embedder.calls
+    
+    embedder = FakeEmbedder(rtt=args.embed_rtt)
+    weaviate_service.embedder = embedder
+    weaviate_service.vector_store = WeaviateVectorStore(FakeWeaviateClient(rtt=args.weaviate_rtt))
+    start = time.perf_counter()
+    result = weaviate_service.embed_and_index_docs(docs, doc_id="batched")
+    batched_elapsed = time.perf_counter() - start
+    
+    print(f"{'mode':<10}{'chunks':>8}{'seconds':>10}{'chunks/s':>10}{'embed calls':>13}")
+    print(f"{'legacy':<10}{legacy_count:>8}{legacy_elapsed:>10.2f}{legacy_count / legacy_elapsed:>10.1f}{legacy_calls:>13}")
+    print(f"{'batched':<10}{result['indexed']:>8}{batched_elapsed:>10.2f}{result['indexed'] / batched_elapsed:>10.1f}{embedder.calls:>13}")
+    if result["failed"]:
+        print(f"failed: {result['failed']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Memory and recall of int8 and product-quantized vector codes.
+
+For each mode the benchmark ranks the whole corpus on the codes, rescores the
+best k * rescore-factor rows exactly from the float vectors, and compares the
+result with exact top k. "codes only" recall is the ranking before rescoring.
+Memory is what the local vector store keeps hot per million chunks: the codes
+with quantization on, the float32 matrix without.
+
+Run from the backend directory:
+    python -m benchmarks.bench_quantization --vectors 100000 --dim 1536
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.quantization import ScalarQuantizer, ProductQuantizer
+from benchmarks.bench_ann import make_corpus, exact_top_k
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--spread", type=float, default=1.2)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=0, help="0 uses the store defaults: 4 for int8, 16 for pq")
+    parser.add_argument("--pq-subvectors", default="96,192", help="comma-separated PQ code sizes in bytes")
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(5)
+    path = os.path.join(tempfile.mkdtemp(), "corpus.f32")
+    matrix = make_corpus(args.vectors, args.dim, args.clusters, args.spread, path, rng)
+    queries = np.asarray(matrix[rng.choice(args.vectors, args.queries, replace=False)])
+    queries = queries + 0.1 * rng.standard_normal(queries.shape, dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = exact_top_k(matrix, queries, args.k)
+    sample = np.asarray(matrix[np.sort(rng.choice(args.vectors, min(args.vectors, 20000), replace=False))])
+
+    quantizers = [("int8", ScalarQuantizer.train(sample))]
+    for m in (int(v) for v in args.pq_subvectors.split(",")):
+        start = time.perf_counter()
+        quantizers.append((f"pq{m}", ProductQuantizer.train(sample, m)))
+        print(f"trained pq{m} in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'mode':<8}{'bytes/vec':>10}{'MB per 1M':>11}{'codes only':>12}{'rescored':>10}{'ms/query':>10}")
+    float_bytes = args.dim * 4
+    print(f"{'float32':<8}{float_bytes:>10}{float_bytes * 1e6 / 2**20:>11.0f}{1.0:>12.3f}{1.0:>10.3f}{'-':>10}")
+    for name, quantizer in quantizers:
+        shortlist = args.k * (args.rescore_factor or (4 if quantizer.kind == "int8" else 16))
+        codes = np.concatenate([quantizer.encode(matrix[s:s + 65536]) for s in range(0, args.vectors, 65536)])
+        raw_hits = rescored_hits = 0
+        start = time.perf_counter()
+        for q, expected in zip(queries, truth):
+            approx = quantizer.score(codes, q)
+            raw_hits += len(np.intersect1d(np.argpartition(-approx, args.k - 1)[:args.k], expected))
+            rows = np.sort(np.argpartition(-approx, shortlist - 1)[:shortlist])
+            scores = matrix[rows] @ q
+            rescored_hits += len(np.intersect1d(rows[np.argpartition(-scores, args.k - 1)[:args.k]], expected))
+        ms = (time.perf_counter() - start) * 1000 / args.queries
+        code_bytes = quantizer.code_size
+        print(f"{name:<8}{code_bytes:>10}{code_bytes * 1e6 / 2**20:>11.0f}"
+              f"{raw_hits / truth.size:>12.3f}{rescored_hits / truth.size:>10.3f}{ms:>10.1f}")
+    del matrix
+    os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Latency of /chat/text with and without speculative retrieval.
+
+Each request goes through chat_text in a fresh conversation holding one
+document. The chat model is a fake: the routing classification takes
+--route-rtt seconds and the answer --llm-rtt, both with lognormal jitter, and
+--doc-share of the queries are classified as document questions. Embeddings
+(behind the real CachedEmbeddings), the vector store and BM25 are the
+in-process fakes used by the other benchmarks. "sequential" routes, then
+retrieves; "speculative" starts retrieval alongside routing and cancels it
+for queries that are not routed to RAG. The routing and answer caches are
+off so every request pays for routing.
+
+Run from the backend directory:
+    python -m benchmarks.bench_speculative_chat --requests 200
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+from app.config import settings
+
+def setup(tmp, embed_rtt, vector_rtt):
+    settings.DB_PATH = os.path.join(tmp, "app.db")
+    settings.DOCUMENTS_DIR = os.path.join(tmp, "docs")
+    settings.BM25_INDEX_DIR = os.path.join(tmp, "docs", "bm25")
+    settings.EMBED_CACHE_PATH = os.path.join(tmp, "embedding_cache.db")
+    settings.ROUTER_MODE = "llm"
+    settings.ROUTER_AUDIT_RATE = 0
+    settings.ROUTER_CACHE_SIZE = 0
+    settings.ANSWER_CACHE_ENABLED = False
+    from app.database import init_db
+    from app.services import weaviate_service
+    from app.services.chunk_store import store_chunks
+    from app.services.embedding_cache import CachedEmbeddings, get_embedding_cache
+    from benchmarks.fakes import FakeEmbedder, FakeVectorStore, make_docs
+
+    init_db()
+    docs = make_docs(200, words_per_chunk=80)
+    for i, doc in enumerate(docs):
+        doc.metadata["chunk_index"] = i
+    store_chunks("bench-doc", docs)
+    weaviate_service.embedder = CachedEmbeddings(FakeEmbedder(dim=64, rtt=embed_rtt), get_embedding_cache(), "bench")
+    weaviate_service.vector_store = FakeVectorStore(
+        [{"text": doc.page_content, "doc_id": "bench-doc", "chunk_index": i} for i, doc in enumerate(docs)],
+        rtt=vector_rtt
+    )
+
+def is_doc_question(query, doc_share):
+    return int(hashlib.sha256(query.encode("utf-8")).hexdigest(), 16) % 1000 < doc_share * 1000
+
+def make_llm(route_rtt, llm_rtt, jitter, doc_share, rng):
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    async def respond(prompt):
+        messages = prompt.to_messages()
+        if "routing assistant" in messages[0].content:
+            await asyncio.sleep(route_rtt * rng.lognormvariate(0, jitter))
+            return AIMessage(content="YES" if is_doc_question(messages[-1].content, doc_share) else "NO")
+        await asyncio.sleep(llm_rtt * rng.lognormvariate(0, jitter))
+        return AIMessage(content="An answer.")
+
+    return RunnableLambda(respond)
+
+async def run(requests, seed):
+    from app.database import ensure_conversation, add_uploaded_document_record
+    from app.routers import chat
+
+    user = {"id": "bench-user"}
+    latencies = {"rag": [], "llm": []}
+    for i in range(requests):
+        conversation_id = ensure_conversation(None, user["id"])
+        add_uploaded_document_record(conversation_id, f"bench-{seed}-{i}", "bench.txt", ".txt", content_hash="bench-doc")
+        query = f"question {seed}-{i} about word{i % 997} and word{(i * 13) % 997}"
+        start = time.perf_counter()
+        response = await chat.chat_text(
+            query=query, search_online="false", conversation_id=conversation_id, retrieval_mode=None,
+            hybrid_alpha=None, top_k=8, diversify=None, mmr_lambda=None, history_mode="full", after_seq=None,
+            current_user=user
+        )
+        elapsed = time.perf_counter() - start
+        latencies["rag" if response["references"] else "llm"].append(elapsed)
+    return latencies
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else float("nan")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--route-rtt", type=float, default=0.4)
+    parser.add_argument("--llm-rtt", type=float, default=0.8)
+    parser.add_argument("--embed-rtt", type=float, default=0.05)
+    parser.add_argument("--vector-rtt", type=float, default=0.03)
+    parser.add_argument("--jitter", type=float, default=0.3, help="sigma of the lognormal latency multiplier")
+    parser.add_argument("--doc-share", type=float, default=0.7, help="share of queries classified as document questions")
+    args = parser.parse_args()
+
+    setup(tempfile.mkdtemp(), args.embed_rtt, args.vector_rtt)
+    from app.routers import chat
+    # MLflow logging is not what is measured here
+    chat._log_chat_metrics = lambda *args, **kwargs: None
+
+    results = {}
+    for name, speculative in (("sequential", False), ("speculative", True)):
+        settings.SPECULATIVE_RETRIEVAL = speculative
+        rng = random.Random(7)
+        chat._chat_llm = lambda: make_llm(args.route_rtt, args.llm_rtt, args.jitter, args.doc_share, rng)
+        # Same queries and latencies for both modes; warm the BM25 index first
+        asyncio.run(run(1, "warmup"))
+        results[name] = asyncio.run(run(args.requests, "bench"))
+
+    print(f"{'mode':<13}{'route':<6}{'requests':>9}{'p50 ms':>8}{'p95 ms':>8}")
+    for name, latencies in results.items():
+        for route in ("rag", "llm"):
+            values = latencies[route]
+            print(f"{name:<13}{route:<6}{len(values):>9}{percentile(values, 0.5):>8.0f}{percentile(values, 0.95):>8.0f}")
+    print()
+    print(f"{'saved':<13}{'route':<6}{'p50 ms':>17}{'p95 ms':>8}")
+    for route in ("rag", "llm"):
+        before, after = results["sequential"][route], results["speculative"][route]
+        print(
+            f"{'':<13}{route:<6}{percentile(before, 0.5) - percentile(after, 0.5):>17.0f}"
+            f"{percentile(before, 0.95) - percentile(after, 0.95):>8.0f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Compare peak memory of reading an upload into memory with streaming it to disk.
+
+"streaming" feeds a multipart/form-data body in 64 KB chunks, as the server
+receives it, through receive_upload.
+
+Run from the backend directory:
+    python -m benchmarks.bench_upload --size-mb 200
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+import tracemalloc
+
+from starlette.datastructures import UploadFile
+
+from app.services.document_service import receive_upload
+
+BOUNDARY = "bench-boundary"
+
+def make_upload(path, size_mb):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+    return UploadFile(file=open(path, "rb"), filename="bench.pdf")
+
+async def legacy_upload(upload, directory):
+    """The original handler: read everything, then write it twice more."""
+    file_content = await upload.read()
+    content_hash = hashlib.sha256(file_content).hexdigest()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf", dir=directory) as tmp_file:
+        tmp_file.write(file_content)
+    os.unlink(tmp_file.name)
+    dest = os.path.join(directory, f"{content_hash}.pdf")
+    with open(dest, "wb") as f:
+        f.write(file_content)
+    return dest
+
+async def multipart_body(path, chunk_size=64 * 1024):
+    yield (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"bench.pdf\"\r\n"
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+async def streaming_upload(upload, directory, block_size):
+    _, received = await receive_upload(
+        f"multipart/form-data; boundary={BOUNDARY}", multipart_body(upload.file.name), directory, 1 << 40, block_size
+    )
+    dest = os.path.join(directory, f"{received['content_hash']}.pdf")
+    os.replace(received["tmp_path"], dest)
+    return dest
+
+def measure(name, coro_factory, source, size_mb):
+    upload = make_upload(source, size_mb)
+    tracemalloc.start()
+    start = time.perf_counter()
+    asyncio.run(coro_factory(upload))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    upload.file.close()
+    print(f"{name:<10}{size_mb:>8}{peak / (1024 * 1024):>14.1f}{elapsed:>10.2f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--block-size", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.bin")
+        print(f"{'mode':<10}{'MB':>8}{'peak alloc MB':>14}{'seconds':>10}")
+        measure("legacy", lambda u: legacy_upload(u, tmp), source, args.size_mb)
+        measure("streaming", lambda u: streaming_upload(u, tmp, args.block_size), source, args.size_mb)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Measure query latency of the local vector store.
+
+Filtered queries are scoped to one conversation's documents, the way
+retrieve_docs calls the store; unfiltered queries scan every vector.
+
+Run from the backend directory:
+    python -m benchmarks.bench_vector_store --vectors 100000
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.vector_store import LocalVectorStore
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--chunks-per-doc", type=int, default=500)
+    parser.add_argument("--docs-per-query", type=int, default=3)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    store = LocalVectorStore(tempfile.mkdtemp())
+    n_docs = max(1, args.vectors // args.chunks_per_doc)
+    start = time.perf_counter()
+    for offset in range(0, args.vectors, 10000):
+        n = min(10000, args.vectors - offset)
+        vectors = rng.standard_normal((n, args.dim), dtype=np.float32)
+        store.add([
+            (f"{offset + i}", vectors[i], {"text": "", "doc_id": f"doc{(offset + i) // args.chunks_per_doc}", "chunk_index": offset + i})
+            for i in range(n)
+        ])
+    build_s = time.perf_counter() - start
+
+    # The IVF index trains in the background; the first query must not wait for it
+    start = time.perf_counter()
+    store.query(rng.standard_normal(args.dim, dtype=np.float32), args.k)
+    first_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    if store._ann_training is not None:
+        store._ann_training.result()
+    train_s = time.perf_counter() - start
+
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    doc_sets = [[f"doc{d}" for d in rng.choice(n_docs, min(args.docs_per_query, n_docs), replace=False)] for _ in range(args.queries)]
+
+    def timed(run):
+        latencies = []
+        for i, q in enumerate(queries):
+            start = time.perf_counter()
+            run(i, q)
+            latencies.append(time.perf_counter() - start)
+        return np.percentile(np.asarray(latencies) * 1000, [50, 95])
+
+    filtered = timed(lambda i, q: store.query(q, args.k, doc_sets[i]))
+    unfiltered = timed(lambda i, q: store.query(q, args.k))
+
+    print(f"vectors: {args.vectors} x {args.dim}, built in {build_s:.1f}s, index ready {train_s:.1f}s later")
+    print(f"first query (index still training): {first_ms:.1f} ms")
+    print(f"{'query':<28}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{f'filtered ({args.docs_per_query} docs)':<28}{filtered[0]:>10.3f}{filtered[1]:>10.3f}")
+    print(f"{'unfiltered':<28}{unfiltered[0]:>10.3f}{unfiltered[1]:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""In-process stand-ins for Azure OpenAI embeddings and Weaviate used by the benchmarks.
+
+Latencies are simulated with time.sleep so the numbers reflect round-trip
+counts rather than the speed of the machine running the benchmark.
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+class FakeEmbedder:
+    def __init__(self, dim=1536, rtt=0.05, per_text=0.0005):
+        self.dim = dim
+        self.rtt = rtt
+        self.per_text = per_text
+        self.calls = 0
+
+    def _vector(self, text):
+        seed = hashlib.sha256(text.encode("utf-8")).digest()
+        return [((seed[i % len(seed)] / 255.0) - 0.5) for i in range(self.dim)]
+
+    def embed_query(self, text):
+        self.calls += 1
+        time.sleep(self.rtt + self.per_text)
+        return self._vector(text)
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        time.sleep(self.rtt + self.per_text * len(texts))
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text):
+        import asyncio
+        self.calls += 1
+        await asyncio.sleep(self.rtt + self.per_text)
+        return self._vector(text)
+
+class _FakeData:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def insert(self, properties, vector=None, uuid=None):
+        time.sleep(self._collection.rtt)
+        self._collection._store(properties, vector, uuid)
+
+    def delete_many(self, where=None):
+        time.sleep(self._collection.rtt)
+
+class _FakeBatchContext:
+    def __init__(self, collection, batch_size, concurrent_requests):
+        self._collection = collection
+        self._batch_size = batch_size
+        self._pool = ThreadPoolExecutor(max_workers=concurrent_requests)
+        self._pending = []
+        self._futures = []
+
+    def __enter__(self):
+        self._collection.batch.failed_objects = []
+        return self
+
+    def add_object(self, properties, vector=None, uuid=None):
+        self._pending.append((properties, vector, uuid))
+        if len(self._pending) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        objects, self._pending = self._pending, []
+        self._futures.append(self._pool.submit(self._send, objects))
+
+    def _send(self, objects):
+        time.sleep(self._collection.rtt)
+        for properties, vector, uuid in objects:
+            self._collection._store(properties, vector, uuid)
+
+    def __exit__(self, *exc):
+        if self._pending:
+            self._flush()
+        for f in self._futures:
+            f.result()
+        self._pool.shutdown()
+        return False
+
+class _FakeBatch:
+    def __init__(self, collection):
+        self._collection = collection
+        self.failed_objects = []
+
+    def fixed_size(self, batch_size=100, concurrent_requests=2):
+        return _FakeBatchContext(self._collection, batch_size, concurrent_requests)
+
+class FakeCollection:
+    def __init__(self, rtt=0.02):
+        self.rtt = rtt
+        self.objects = {}
+        self._lock = threading.Lock()
+        self.data = _FakeData(self)
+        self.batch = _FakeBatch(self)
+
+    def _store(self, properties, vector, uuid):
+        with self._lock:
+            key = uuid or len(self.objects)
+            self.objects[key] = SimpleNamespace(properties=properties, vector=vector, uuid=key)
+
+class _FakeCollections:
+    def __init__(self, rtt):
+        self._rtt = rtt
+        self._collections = {}
+
+    def exists(self, name):
+        return name in self._collections
+
+    def create(self, name, **kwargs):
+        self._collections[name] = FakeCollection(self._rtt)
+
+    def get(self, name):
+        if name not in self._collections:
+            self.create(name)
+        return self._collections[name]
+
+class FakeWeaviateClient:
+    def __init__(self, rtt=0.02):
+        self.collections = _FakeCollections(rtt)
+
+def make_docs(n, words_per_chunk=200):
+    from langchain_core.documents import Document
+    return [
+        Document(page_content=" ".join(f"word{(i * 7 + j) % 997}" for j in range(words_per_chunk)))
+        for i in range(n)
+    ]
+
+class FakeVectorStore:
+    """A vector store answering every query with the first limit objects after rtt seconds.
+
+    query sleeps the calling thread, aquery only the calling coroutine, like
+    the sync and async Weaviate clients.
+    """
+    name = "fake"
+    multi_tenant = False
+
+    def __init__(self, objects, rtt=0.02):
+        self.objects = objects
+        self.rtt = rtt
+
+    def query(self, vector, limit, storage_keys=None, tenant=None):
+        time.sleep(self.rtt)
+        return [(properties, 1.0) for properties in self.objects[:limit]]
+
+    def fetch(self, storage_keys, limit, tenant=None):
+        time.sleep(self.rtt)
+        return self.objects[:limit]
+
+    async def aquery(self, vector, limit, storage_keys=None, tenant=None):
+        import asyncio
+        await asyncio.sleep(self.rtt)
+        return [(properties, 1.0) for properties in self.objects[:limit]]
+
+    async def afetch(self, storage_keys, limit, tenant=None):
+        import asyncio
+        await asyncio.sleep(self.rtt)
+        return self.objects[:limit]
+
+    def vectors(self, uuids, tenant=None):
+        time.sleep(self.rtt)
+        return {}
+
+    async def avectors(self, uuids, tenant=None):
+        import asyncio
+        await asyncio.sleep(self.rtt)
+        return {}
@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,20 +8,45 @@ from typing import Optional
 import mlflow
 
 from app.config import settings
-from app.database import init_db
+from app.database import init_db, get_routing_stats
 from app.services.sql_agent_service import init_sql_agent
-from app.services.weaviate_service import init_weaviate_client
+from app.services.weaviate_service import (
+    init_weaviate_client,
+    init_async_weaviate_client,
+    close_async_weaviate_client,
+    tenant_idle_sweeper
+)
+from app.services.ingestion_service import init_ingestion_workers, shutdown_ingestion_workers
+from app.services.executors import run_db, monitor_loop_lag, shutdown_executors, get_executor_stats
+from app.services.embedding_cache import flush_embedding_cache
+from app.services.clients import init_clients, close_clients, get_client_stats
+from app.services.query_router import get_routing_cache_stats, routing_log_sweeper
+from app.services.answer_cache import get_answer_cache_stats
 from app.routers import chat, documents, auth, feedback, conversations
 from app.utils.auth import get_user_from_jwt
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    init_clients()
     init_weaviate_client()
+    await init_async_weaviate_client()
     init_sql_agent()
     mlflow.set_tracking_uri(settings.MLFLOW_TRACKING_URI)
     mlflow.set_experiment("rag-chat-system")
+    init_ingestion_workers()
+    tenant_sweeper = asyncio.create_task(tenant_idle_sweeper())
+    loop_lag_monitor = asyncio.create_task(monitor_loop_lag())
+    routing_sweeper = asyncio.create_task(routing_log_sweeper())
     yield
+    routing_sweeper.cancel()
+    loop_lag_monitor.cancel()
+    tenant_sweeper.cancel()
+    await close_async_weaviate_client()
+    shutdown_ingestion_workers()
+    shutdown_executors()
+    flush_embedding_cache()
+    await close_clients()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -72,7 +98,7 @@ async def me(authorization: Optional[str] = Header(None)):
     token = None
     if authorization and authorization.lower().startswith("bearer "):
         token = authorization.split(" ", 1)[1]
-    user = get_user_from_jwt(token)
+    user = await run_db(get_user_from_jwt, token)
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     return user
@@ -80,7 +106,16 @@ async def me(authorization: Optional[str] = Header(None)):
 @app.get("/status")
 async def status():
     from app.services.document_service import get_uploaded_docs_count
-    return {"status": "running", "docs_uploaded": get_uploaded_docs_count()}
+    from app.services.embedding_cache import get_embedding_cache_stats
+    return {
+        "status": "running",
+        "docs_uploaded": get_uploaded_docs_count(),
+        "embedding_cache": await run_db(get_embedding_cache_stats),
+        "executors": get_executor_stats(),
+        "http_clients": get_client_stats(),
+        "routing": {**await run_db(get_routing_stats, settings.ROUTER_STATS_WINDOW_HOURS), "cache": get_routing_cache_stats()},
+        "answer_cache": get_answer_cache_stats()
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,83 @@
+"""Move objects from the shared DocumentChunk collection into per-user tenants.
+
+Each object is copied into the tenant of every user holding an upload of its
+document, and the copy is recorded in document_blob_tenants. Objects of
+documents nobody holds anymore are skipped. Object uuids are kept, so the
+migration can be re-run safely.
+
+Run from the backend directory:
+    python -m scripts.migrate_weaviate_tenants [--dry-run] [--drop-legacy]
+"""
+import argparse
+
+from app.config import settings
+from app.database import init_db, get_document_blob_users, add_document_blob_tenant
+from app.services import weaviate_service
+from app.services.vector_store import COLLECTION_NAME, tenant_for_user
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="count what would be copied without writing")
+    parser.add_argument("--drop-legacy", action="store_true", help="delete DocumentChunk once every object was copied")
+    args = parser.parse_args()
+
+    init_db()
+    weaviate_service.init_weaviate_client()
+    client = weaviate_service.get_client()
+    store = weaviate_service.get_vector_store()
+    if not client or not store or not store.multi_tenant:
+        print("⚠️ Needs a Weaviate connection with WEAVIATE_MULTI_TENANCY enabled")
+        return
+    if not client.collections.exists(COLLECTION_NAME):
+        print(f"✅ No {COLLECTION_NAME} collection, nothing to migrate")
+        return
+    store.ensure_schema()
+
+    tenants_by_key = {}
+    copied = skipped = 0
+    with client.batch.fixed_size(
+        batch_size=settings.WEAVIATE_BATCH_SIZE,
+        concurrent_requests=settings.WEAVIATE_BATCH_CONCURRENCY,
+    ) as batch:
+        for o in client.collections.get(COLLECTION_NAME).iterator(include_vector=True):
+            storage_key = o.properties.get("doc_id", "")
+            if storage_key not in tenants_by_key:
+                tenants_by_key[storage_key] = {tenant_for_user(u) for u in get_document_blob_users(storage_key)}
+            tenants = tenants_by_key[storage_key]
+            if not tenants:
+                skipped += 1
+                continue
+            vector = o.vector.get("default") if isinstance(o.vector, dict) else o.vector
+            for tenant in tenants:
+                if not args.dry_run:
+                    batch.add_object(
+                        collection=settings.WEAVIATE_TENANT_COLLECTION,
+                        properties=o.properties,
+                        vector=vector,
+                        uuid=o.uuid,
+                        tenant=tenant
+                    )
+                copied += 1
+
+    failed = client.batch.failed_objects
+    failed_keys = {f.object_.properties.get("doc_id", "") for f in failed}
+    if not args.dry_run:
+        for storage_key, tenants in tenants_by_key.items():
+            if storage_key in failed_keys:
+                continue
+            for tenant in tenants:
+                add_document_blob_tenant(storage_key, tenant)
+
+    documents = sum(1 for tenants in tenants_by_key.values() if tenants)
+    action = "Would copy" if args.dry_run else "Copied"
+    print(f"{action} {copied} objects of {documents} documents into {settings.WEAVIATE_TENANT_COLLECTION}; "
+          f"skipped {skipped} objects of unreferenced documents")
+    if failed:
+        print(f"⚠️ {len(failed)} objects failed; their documents were not recorded, re-run to retry")
+    elif args.drop_legacy and not args.dry_run:
+        client.collections.delete(COLLECTION_NAME)
+        print(f"🗑️ Deleted legacy collection {COLLECTION_NAME}")
+    client.close()
+
+if __name__ == "__main__":
+    main()
@@ -231,11 +231,13 @@ function App() {
       if (conversationId) {
         formData.append("conversation_id", conversationId)
       }
+      // Only the new turn comes back, not the whole conversation
+      formData.append("history_mode", "delta")
 
       const res = await axios.post(`${API_URL}/chat/text`, formData)
       
-      // Update chat history with the complete response (includes message_ids and references)
-      setChatHistory(res.data.chat_history)
+      // Replace the pending message with the saved turn (includes message_ids and references)
+      setChatHistory(prev => [...prev.slice(0, -1), ...res.data.chat_history])
       
       // Load feedback for the new message if it exists
       if (res.data.message_id) {